@@ -55,11 +55,14 @@ class LambdaBuildCLI(configuration.BossCLI):
         self.parser = ParentParser(description = "Script for build lambda code zip",
                                    help = 'Build lambda code zip')
         self.parser.add_bosslet()
+        self.parser.add_argument('--force',
+                                 action='store_true',
+                                 help='Build the code zip even if the code matches the existing zip in S3')
         self.parser.add_argument('lambda_name',
                                  help='Name of lambda to build')
 
     def run(self, args):
-        lambdas.load_lambdas_on_s3(args.bosslet_config, args.lambda_name)
+        lambdas.load_lambdas_on_s3(args.bosslet_config, args.lambda_name, force=args.force)
 
 class LambdaFreshenCLI(configuration.BossCLI):
     def get_parser(self, ParentParser=configuration.BossParser):
@@ -77,13 +80,11 @@ class LambdaFreshenCLI(configuration.BossCLI):
 
     def run(self, args):
         if args.code:
-            lambda_names = [k for k, v in lambdas.lambda_dirs(args.bosslet_config).items()
-                              if v == args.lambda_name]
+            lambda_names = lambdas.zip_functions(args.bosslet_config).get(args.lambda_name, [])
         else:
             lambda_names = [args.lambda_name]
 
-        for lambda_name in lambda_names:
-            lambdas.freshen_lambda(args.bosslet_config, lambda_name)
+        lambdas.update_functions(args.bosslet_config, lambda_names)
 
 class LambdaCLI(configuration.NestedBossCLI):
     COMMANDS = {
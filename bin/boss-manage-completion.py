@@ -52,7 +52,10 @@ def cloudformation(argc, args):
                  '--help': 0,
                  '--ami-version': 1,
                  '--scenario': 1,
-                 '--disable-preview': 0}
+                 '--disable-preview': 0,
+                 '--force-update': 0,
+                 '--force-build': 0,
+                 '--parallel': 1}
 
     seen_action = False
     seen_bosslet = False
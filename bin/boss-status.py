@@ -14,10 +14,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import time
 import json
 import itertools
 from pprint import pformat
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import alter_path
 from lib import aws
@@ -49,6 +51,122 @@ def columnize(s, header=None, width=40):
         ls.insert(1, '-' * width)
     return ls
 
+# Directory where the drift results of each stack are cached
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'boss-manage', 'status')
+
+# Seconds that a stack's cached drift results are used, if the stack hasn't been updated
+# Drift can be caused by changes made outside of CloudFormation, which don't
+# change the stack, so results cannot be cached forever
+CACHE_MAX_AGE = 60 * 60
+
+# Number of stacks to detect drift for concurrently
+DRIFT_WORKERS = 8
+
+# Initial and maximum seconds between checks of a drift detection's status
+POLL_DELAY = 2
+POLL_MAX_DELAY = 20
+
+class DriftCache(object):
+    """Cache of the drift results of a bosslet's stacks, stored on disk
+
+    Results are keyed by the stack's LastUpdatedTime (or CreationTime) and
+    status, so that they are not used once the stack has been changed. Only
+    the results of completed drift detections are cached.
+
+    Args:
+        bosslet (str): Name of the bosslet
+        max_age (int): Seconds that cached results are used
+    """
+    def __init__(self, bosslet, max_age=CACHE_MAX_AGE):
+        self.directory = os.path.join(CACHE_DIR, bosslet)
+        self.max_age = max_age
+
+    def path(self, config):
+        return os.path.join(self.directory, config + '.json')
+
+    @staticmethod
+    def key(stack):
+        updated = stack.get('LastUpdatedTime', stack['CreationTime'])
+        return [stack['StackName'], str(updated), stack['StackStatus']]
+
+    def get(self, config, stack):
+        """Get the cached drift results for the stack
+
+        Returns:
+            dict|None: Cached results or None if there are no valid cached results
+        """
+        try:
+            with open(self.path(config)) as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        if entry['key'] != self.key(stack):
+            return None
+        if time.time() - entry['checked'] > self.max_age:
+            return None
+        return entry
+
+    def put(self, config, stack, status, drifts):
+        """Cache the drift results of a completed drift detection
+
+        Args:
+            config (str): Name of the config
+            stack (dict): Stack description, used to build the cache key
+            status (str): The detection's StackDriftStatus
+            drifts (list[dict]): The modified and deleted resources
+
+        Returns:
+            dict: The cached entry
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {
+            'key': self.key(stack),
+            'checked': time.time(),
+            'status': status,
+            'drifts': drifts,
+        }
+        with open(self.path(config), 'w') as fh:
+            json.dump(entry, fh, indent=2, default=str)
+        return entry
+
+def detect_drift(client, stack_name):
+    """Detect the drift of a stack and get the drifted resources
+
+    Args:
+        client (CloudFormation.Client): CloudFormation client
+        stack_name (str): Name of the stack
+
+    Returns:
+        tuple[str, str, list[dict]]: The drift detection's DetectionStatus, the
+                                     StackDriftStatus (or the reason the detection
+                                     failed), and the modified and deleted resources
+    """
+    id = client.detect_stack_drift(StackName = stack_name)['StackDriftDetectionId']
+
+    delay = POLL_DELAY
+    while True:
+        time.sleep(delay)
+        resp = client.describe_stack_drift_detection_status(StackDriftDetectionId = id)
+        if resp['DetectionStatus'] != 'DETECTION_IN_PROGRESS':
+            break
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+    # Get the status of all of the stack's resources
+    drifts = aws.get_all(client.describe_stack_resource_drifts, 'StackResourceDrifts') \
+                        (StackName = stack_name,
+                         StackResourceDriftStatusFilters = ['MODIFIED', 'DELETED'])
+    drifts = [{
+                'LogicalResourceId': item['LogicalResourceId'],
+                'StackResourceDriftStatus': item['StackResourceDriftStatus'],
+                'PropertyDifferences': item.get('PropertyDifferences', []),
+              } for item in drifts]
+
+    if resp['DetectionStatus'] == 'DETECTION_COMPLETE':
+        return resp['DetectionStatus'], resp['StackDriftStatus'], drifts
+    else:
+        return resp['DetectionStatus'], resp.get('DetectionStatusReason', 'Unknown reason'), drifts
+
 class StatusCLI(configuration.BossCLI):
     def get_parser(self, ParentParser=configuration.BossParser):
         self.parser = ParentParser(description = 'Command for displaying the current status of the bosslet')
@@ -56,6 +174,14 @@ class StatusCLI(configuration.BossCLI):
         self.parser.add_argument('--diff', '-d',
                                  action='store_true',
                                  help='Display the details of the drifted resources')
+        self.parser.add_argument('--refresh', '-r',
+                                 action='store_true',
+                                 help='Detect drift for all stacks, ignoring cached results')
+        self.parser.add_argument('--cache-age',
+                                 type=int,
+                                 default=CACHE_MAX_AGE,
+                                 metavar='SECONDS',
+                                 help='Seconds to use the cached drift results of unchanged stacks (default: {})'.format(CACHE_MAX_AGE))
         return self.parser
 
     def run(self, args):
@@ -71,35 +197,55 @@ class StatusCLI(configuration.BossCLI):
             print("No templates running")
             return
 
-        # Trigger the detection of drift for the stacks
-        print("Detecting drift .", end="", flush=True)
-        drift_ids = { name: client.detect_stack_drift(StackName = obj['StackName'])['StackDriftDetectionId']
-                      for name, obj in existing.items()
-                      if obj['StackStatus'].endswith('_COMPLETE') and 
-                         obj['StackStatus'] not in ('ROLLBACK_COMPLETE', ) }
-
-        # Wait untils all of the detections have finished
+        # Detect the drift of the stacks that don't have cached results
+        cache = DriftCache(bosslet_config.bosslet, args.cache_age)
         status = {}
-        while len(drift_ids) > 0:
-            for config, id in drift_ids.copy().items():
-                resp = client.describe_stack_drift_detection_status(StackDriftDetectionId = id)
-                if resp['DetectionStatus'] != 'DETECTION_IN_PROGRESS':
-                    del drift_ids[config]
-                    status[config] = resp
-            print(".", end="", flush=True)
-            time.sleep(5)
-        print(" complete")
+        pending = []
+        for name, obj in existing.items():
+            if not obj['StackStatus'].endswith('_COMPLETE') or \
+               obj['StackStatus'] in ('ROLLBACK_COMPLETE', ):
+                continue
+
+            entry = None if args.refresh else cache.get(name, obj)
+            if entry is not None:
+                status[name] = entry
+            else:
+                pending.append(name)
+
+        if len(status) > 0:
+            print("Using cached drift results for {} unchanged stacks".format(len(status)))
+
+        if len(pending) > 0:
+            print("Detecting drift for {} stacks .".format(len(pending)), end="", flush=True)
+            start = time.time()
+            with ThreadPoolExecutor(DRIFT_WORKERS) as executor:
+                futures = {executor.submit(detect_drift, client, existing[name]['StackName']): name
+                           for name in pending}
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        detection, drift_status, drifts = future.result()
+                    except Exception as ex:
+                        detection, drift_status, drifts = 'DETECTION_FAILED', str(ex), []
+
+                    if detection == 'DETECTION_COMPLETE':
+                        status[name] = cache.put(name, existing[name], drift_status, drifts)
+                    else:
+                        # Don't cache failures, so that drift isn't hidden until they expire
+                        status[name] = {'status': detection, 'reason': drift_status, 'drifts': drifts}
+                    print(".", end="", flush=True)
+            print(" complete ({:.0f} seconds)".format(time.time() - start))
 
         # Sort the keys so there is a predictable order
         keys = list(existing.keys()); keys.sort()
         for config in keys:
             obj = existing[config]
-            print("{} -> {}".format(config, obj['StackStatus']))
             if config in status:
-                # Get the status of all of the stack's resources
-                resp = aws.get_all(client.describe_stack_resource_drifts, 'StackResourceDrifts') \
-                                  (StackName = obj['StackName'],
-                                   StackResourceDriftStatusFilters = ['MODIFIED', 'DELETED'])
+                print("{} -> {} ({})".format(config, obj['StackStatus'], status[config]['status']))
+                if status[config]['status'] == 'DETECTION_FAILED':
+                    print("\tDrift detection failed: {}".format(status[config]['reason']))
+
+                resp = status[config]['drifts']
                 for item in resp:
                     print("\t{} -> {}".format(item['LogicalResourceId'], item['StackResourceDriftStatus']))
                     if args.diff: # Print the details of the difference
@@ -116,9 +262,12 @@ class StatusCLI(configuration.BossCLI):
                                     print("\t\t{} | {}".format(e,a))
                             print()
 
+            else:
+                print("{} -> {}".format(config, obj['StackStatus']))
+
             # DP ???: Should this be if 'ROLLBACK' in obj['StackStatus']: so that UPDATE_ROLLBACK_COMPLETE
             #         will also have the error messages printed
-            elif obj['StackStatus'] == 'ROLLBACK_COMPLETE':
+            if obj['StackStatus'] == 'ROLLBACK_COMPLETE':
                 config = cloudformation.CloudFormationConfiguration(config, bosslet_config)
 
                 for reason in config.get_failed_reasons():
@@ -29,30 +29,36 @@ from lib import boss_rds
 from lib import configuration
 import logging
 
-def run(bosslet, in_file, out_file):
+def run(bosslet, in_file, out_file, chunk_size=boss_rds.LOOKUP_KEY_CHUNK):
     """
     Main worker function.
 
+    The input file is read once, resolving the names for each chunk of rows
+    with a single database query over a single database connection.
+
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object.
         in_file (str): Path to input CSV file.
         out_file (str): Path to output CSV file.
+        chunk_size (int): Number of rows to resolve names for at a time.
     """
-    keys = []
-    with open(in_file, 'rt') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            keys.append(strip_resolution(row['lookup_key']))
-
-    names = boss_rds.sql_get_names_from_lookup_keys(bosslet, keys)
-
     fields = ['lookup_key', 'total_size', 'collection', 'experiment', 'channel']
-    with open(out_file, 'wt') as out:
+    names = {}
+
+    with open(in_file, 'rt') as f, \
+         open(out_file, 'wt') as out, \
+         bosslet.call.connect_rds() as cursor:
+        reader = csv.DictReader(f)
         writer = csv.DictWriter(out, fields)
         writer.writeheader()
-        with open(in_file, 'rt') as f:
-            reader = csv.DictReader(f)
-            for (row, row_names) in zip(reader, names):
+
+        def write(rows):
+            keys = [strip_resolution(row['lookup_key']) for row in rows]
+            missing = [key for key in keys if key not in names]
+            names.update(boss_rds.sql_get_names_by_lookup_key(bosslet, missing, cursor, chunk_size))
+
+            for row, key in zip(rows, keys):
+                row_names = names[key]
                 writer.writerow({
                     'lookup_key': row['lookup_key'],
                     'total_size': row['total_size'],
@@ -61,6 +67,14 @@ def run(bosslet, in_file, out_file):
                     'channel': row_names[2]
                 })
 
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                write(rows)
+                rows = []
+        write(rows)
+
 def strip_resolution(key):
     """
     Removes the resolution from the lookup key.
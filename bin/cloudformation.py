@@ -22,6 +22,9 @@ import os
 import importlib
 import glob
 import traceback
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
 
 import alter_path
 from lib import exceptions
@@ -167,9 +170,27 @@ def build_dependency_graph(action, bosslet_config, modules):
     return reordered
 
 
-def call_configs(bosslet_config, configs, func_name):
+def call_config(bosslet_config, config, module, func_name):
+    """Call the requested function of a single config module"""
+    if func_name in module.__dict__:
+        module.__dict__[func_name](bosslet_config)
+    elif func_name == 'delete':
+        CloudFormationConfiguration(config, bosslet_config).delete()
+    else:
+        print("Configuration '{}' doesn't implement function '{}', skipping".format(config, func_name))
+
+    cache = aws.lookup_cache(bosslet_config)
+    if cache is not None:
+        hits, misses = cache.reset_stats()
+        if hits:
+            console.debug("{}: {} AWS lookups, {} API calls saved by caching".format(config, hits + misses, hits))
+
+def call_configs(bosslet_config, configs, func_name, parallel=None):
     """Import 'configs.<config>' and then call the requested function with
     <session> and <bosslet>.
+
+    If parallel is given, up to that many configs are executed at the same
+    time, see call_configs_parallel().
     """
     modules = [(config, importlib.import_module("configs." + config)) for config in configs]
 
@@ -180,17 +201,152 @@ def call_configs(bosslet_config, configs, func_name):
     for config, module in modules:
         print("\t{}".format(config))
 
+    if parallel is not None:
+        call_configs_parallel(bosslet_config, modules, func_name, parallel)
+        return
+
     with console.status_line(spin=True, print_status=True) as status:
         for config, module in modules:
             print()
             status('Working on {}'.format(config))
 
-            if func_name in module.__dict__:
-                module.__dict__[func_name](bosslet_config)
-            elif func_name == 'delete':
-                CloudFormationConfiguration(config, bosslet_config).delete()
-            else:
-                print("Configuration '{}' doesn't implement function '{}', skipping".format(config, func_name))
+            call_config(bosslet_config, config, module, func_name)
+
+def build_blockers(func_name, modules):
+    """Find the configs that have to finish before each config can start
+
+    Only dependencies between the given configs are included, as any other
+    dependencies were already verified to exist by build_dependency_graph().
+
+    Args:
+        func_name (str): Name of the function being called. For 'generate'
+                         there are no dependencies
+        modules (list[tuple[str, module]]): Configs being executed
+
+    Returns:
+        dict: Mapping of config name to set of config names it is waiting on
+    """
+    names = [config for config, _ in modules]
+    blockers = { config: set() for config in names }
+
+    if func_name == 'generate':
+        return blockers
+
+    for config, module in modules:
+        deps = module.__dict__.get('DEPENDENCIES') or []
+        if type(deps) == str:
+            deps = [deps]
+
+        for dep in deps:
+            if dep in blockers:
+                blockers[config].add(dep)
+
+    return blockers
+
+def _call_config_process(bosslet_config, config, module, func_name, output):
+    """Worker process target that sends all output through the given pipe"""
+    # Redirect the file descriptors so that output from subprocesses
+    # is also captured
+    os.dup2(output, 1)
+    os.dup2(output, 2)
+    os.close(output)
+    sys.stdout = os.fdopen(1, 'w', buffering=1)
+    sys.stderr = os.fdopen(2, 'w', buffering=1)
+
+    try:
+        call_config(bosslet_config, config, module, func_name)
+    except Exception:
+        traceback.print_exc(chain=False)
+        sys.exit(1)
+
+def call_configs_parallel(bosslet_config, modules, func_name, workers):
+    """Execute configs in worker processes as soon as their dependencies finish
+
+    Each config runs in its own process and its output is printed with a
+    '[config]' prefix. There is no input for the workers, so prompts that
+    default to yes receive their default answer and prompts that default to
+    no fail the config (see console.confirm()). After the first failure no new configs are
+    started, the running configs are allowed to finish, and then an error
+    is raised.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet to execute the configs in
+        modules (list[tuple[str, module]]): Configs to execute, in the order
+                                            returned by build_dependency_graph()
+        func_name (str): Name of the config function to call
+        workers (int): Maximum number of configs to execute at the same time
+
+    Raises:
+        BossManageError: If any of the configs failed
+    """
+    # Fork so that the worker processes inherit the imported config modules
+    # and the bosslet configuration (which cannot be pickled)
+    ctx = multiprocessing.get_context('fork')
+    lock = threading.Lock()
+
+    blockers = build_blockers(func_name, modules)
+    pending = list(modules)
+    running = {} # process sentinel -> (config, process, output thread)
+    finished = set()
+    failed = []
+
+    def relay(config, fd):
+        with os.fdopen(fd, 'r', errors='replace') as fh:
+            for line in fh:
+                with lock:
+                    print('[{}] {}'.format(config, line.rstrip('\n')))
+
+    with console.status_line(spin=True) as status:
+        def update_status():
+            with lock:
+                status('Working on {}'.format(', '.join(c for c, _, _ in running.values())))
+
+        while pending or running:
+            if not failed:
+                for config, module in pending[:]:
+                    if len(running) >= workers:
+                        break
+                    if not blockers[config].issubset(finished):
+                        continue
+
+                    pending.remove((config, module))
+                    read_fd, write_fd = os.pipe()
+                    proc = ctx.Process(target=_call_config_process,
+                                       args=(bosslet_config, config, module, func_name, write_fd))
+                    proc.start()
+                    os.close(write_fd)
+
+                    relay_thread = threading.Thread(target=relay, args=(config, read_fd), daemon=True)
+                    relay_thread.start()
+                    running[proc.sentinel] = (config, proc, relay_thread)
+                    update_status()
+            elif not running:
+                break
+
+            if not running:
+                # Nothing can be started, remaining configs depend on each other
+                raise exceptions.CircularDependencyError()
+
+            for sentinel in wait(list(running.keys())):
+                config, proc, relay_thread = running.pop(sentinel)
+                proc.join()
+                relay_thread.join()
+
+                with lock:
+                    if proc.exitcode == 0:
+                        finished.add(config)
+                        console.info("Finished {}".format(config))
+                    else:
+                        failed.append(config)
+                        console.fail("{} failed, not starting any new configs".format(config))
+            if running:
+                update_status()
+
+    if failed:
+        not_started = [config for config, _ in pending]
+        raise exceptions.BossManageError("Problems executing {}".format(func_name),
+                                         causes = ['Failed: ' + ', '.join(failed),
+                                                   'Not started: ' + (', '.join(not_started) or 'None')])
 
 def update_migrate(bosslet_config, config):
     migration_progress = constants.repo_path("cloud_formation", "configs", "migrations", config, "progress")
@@ -251,6 +407,16 @@ if __name__ == '__main__':
     parser.add_argument("--disable-preview",
                         action = "store_true",
                         help = "Disable update previews change sets (default: enable)"),
+    parser.add_argument("--force-update",
+                        action = "store_true",
+                        help = "Update stacks even if the template and arguments match the deployed stack (default: skip unchanged stacks)")
+    parser.add_argument("--force-build",
+                        action = "store_true",
+                        help = "Build lambda code zips even if the code matches the existing zip in S3 (default: skip unchanged lambdas)")
+    parser.add_argument("--parallel",
+                        metavar = "<N>",
+                        type = int,
+                        help = "Execute up to N configs at the same time, once their dependencies finish. Not supported for delete, update requires --disable-preview (default: one at a time)")
     parser.add_argument("action",
                         choices = actions,
                         metavar = "action",
@@ -266,9 +432,19 @@ if __name__ == '__main__':
                         help="Configuration to act upon (imported from configs/)")
     args = parser.parse_args()
 
+    # Worker processes cannot prompt the user, so reject the actions that
+    # require confirmation instead of letting them fail in every worker
+    if args.parallel is not None:
+        if args.action == "delete":
+            parser.error("--parallel is not supported for delete, as each config must be confirmed")
+        if args.action == "update" and not args.disable_preview:
+            parser.error("--parallel requires --disable-preview for update, as each change set must be confirmed")
+
     try:
         bosslet_config = configuration.BossConfiguration(args.bosslet_name,
                                                          disable_preview = args.disable_preview,
+                                                         force_update = args.force_update,
+                                                         force_build = args.force_build,
                                                          ami_version = args.ami_version,
                                                          scenario = args.scenario)
 
@@ -286,7 +462,7 @@ if __name__ == '__main__':
             sys.exit(0)
 
         func = args.action.replace('-','_')
-        call_configs(bosslet_config, configs, func)
+        call_configs(bosslet_config, configs, func, args.parallel)
         sys.exit(0)
     except exceptions.StatusCheckError as ex:
         target = 'the server'
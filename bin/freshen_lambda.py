@@ -23,7 +23,7 @@ but a full rebuild of the entire zip file isn't required.
 
 import alter_path
 from lib import configuration
-from lib.lambdas import freshen_lambda, lambda_dirs
+from lib.lambdas import update_functions, zip_functions
 
 if __name__ == '__main__':
     parser = configuration.BossParser(description = "Script for freshening lambda " +
@@ -43,10 +43,8 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.code:
-        lambda_names = [k for k, v in lambda_dirs(args.bosslet_config).items()
-                          if v == args.lambda_name]
+        lambda_names = zip_functions(args.bosslet_config).get(args.lambda_name, [])
     else:
         lambda_names = [args.lambda_name]
 
-    for lambda_name in lambda_names:
-        freshen_lambda(args.bosslet_config, lambda_name)
+    update_functions(args.bosslet_config, lambda_names)
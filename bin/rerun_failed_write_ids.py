@@ -19,14 +19,22 @@ Script that extracts all the messages from the Indexdeadletter queue and
 starts Index.IdWriters for the messages with operation == 'write_id_index'.
 For Index.IdWriters that successfully start, the corresponding message is
 deleted from the queue.
+
+Messages are received by multiple concurrent receivers, Index.IdWriters are
+started at a limited rate, and messages are deleted in batches. The
+MessageIds of started Index.IdWriters are written to a checkpoint file, so
+that if the script is interrupted it can be rerun without starting the
+Index.IdWriters again for messages that were not yet deleted.
 """
 
 import argparse
-import botocore
+import botocore.exceptions
 import boto3
 import json
 import os
+import threading
 import time
+from collections import Counter
 from hashlib import md5
 
 import alter_path
@@ -34,6 +42,10 @@ from lib import aws
 from lib import configuration
 
 MAX_SQS_RECEIVE = 10
+RECEIVE_WAIT_SECS = 20 # SQS long poll maximum
+VISIBILITY_TIMEOUT = 300 # Seconds to start the Index.IdWriters for a batch of messages
+RECEIVERS = 4
+START_RATE = 10 # start_execution calls per second
 
 class CorruptSqsResponseError(Exception):
     """
@@ -67,85 +79,260 @@ def check_response(msg):
         raise CorruptSqsResponseError('Message corrupt - MD5 mismatch')
 
 
-def start(bosslet_config, spacing):
+class Checkpoint(object):
+    """
+    File containing the MessageIds of the messages for which an Index.IdWriter
+    was started, so that an interrupted run can be resumed.
+
+    Args:
+        filename (str): Path of the checkpoint file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.started = set()
+
+        if os.path.exists(filename):
+            with open(filename) as fh:
+                self.started = set(line.strip() for line in fh if line.strip())
+            print('Resuming from {}, {} Index.IdWriters already started'.format(
+                filename, len(self.started)))
+
+        self.fh = open(filename, 'a')
+
+    def __contains__(self, message_id):
+        with self.lock:
+            return message_id in self.started
+
+    def add(self, message_id):
+        with self.lock:
+            self.started.add(message_id)
+            self.fh.write(message_id + '\n')
+            self.fh.flush()
+
+    def close(self, remove=False):
+        self.fh.close()
+        if remove:
+            os.remove(self.filename)
+
+class Replayer(object):
+    """
+    Replays the messages in the Indexdeadletter queue.
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration for the target Bosslet
+        spacing (int): Space start of step function's lambda task by this many seconds.
+        rate (float): Maximum number of step functions to start per second.
+        checkpoint (Checkpoint): Record of the messages already started.
+    """
+    def __init__(self, bosslet_config, spacing, rate, checkpoint):
+        sfn_arn_prefix = 'arn:aws:states:{}:{}:stateMachine:'.format(bosslet_config.REGION,
+                                                                     bosslet_config.ACCOUNT_ID)
+        self.arn = '{}{}'.format(sfn_arn_prefix, bosslet_config.names.index_id_writer.sfn)
+
+        # boto3 clients are thread safe
+        self.sqs = bosslet_config.session.client('sqs')
+        self.sfn = bosslet_config.session.client('stepfunctions')
+
+        resp = self.sqs.get_queue_url(QueueName=bosslet_config.names.index_deadletter.sqs)
+        self.queue_url = resp['QueueUrl']
+
+        self.spacing = spacing
+        self.limiter = aws.RateLimiter(rate)
+        self.checkpoint = checkpoint
+
+        self.lock = threading.Lock()
+        self.wait_secs = 0
+        self.reasons = Counter() # failure reason -> Index.IdWriters started
+        self.counts = Counter() # outcome -> number of messages
+
+    def count(self, outcome, reason=None):
+        with self.lock:
+            self.counts[outcome] += 1
+            if reason is not None:
+                self.reasons[reason] += 1
+
+    def next_wait_secs(self):
+        # Stagger startup of Index.IdWriters so Dynamo has more time to scale
+        # if necessary.
+        with self.lock:
+            wait_secs = self.wait_secs
+            self.wait_secs += self.spacing
+            return wait_secs
+
+    def replay(self, msg):
+        """
+        Start an Index.IdWriter for the message, if needed.
+
+        Args:
+            msg (dict): A message returned by SQS.Client.receive_message().
+
+        Returns:
+            (bool): If the message should be deleted from the queue.
+        """
+        try:
+            check_response(msg)
+        except CorruptSqsResponseError as ex:
+            print('Skipping bad message: {}'.format(ex))
+            self.count('skipped')
+            return False
+
+        if msg['MessageId'] in self.checkpoint:
+            self.count('already started')
+            return True
+
+        body = json.loads(msg['Body'])
+        if 'operation' not in body:
+            print('Skipping message without operation field.')
+            self.count('skipped')
+            return False
+
+        if body['operation'] != 'write_id_index':
+            print('Skipping message with operation: {}'.format(body['operation']))
+            self.count('skipped')
+            return False
+
+        result = body.pop('result', None)
+        reason = result['Error'] if result is not None else 'unknown reasons'
+
+        body['wait_secs'] = self.next_wait_secs()
+
+        self.limiter.acquire()
+        try:
+            # Naming the execution after the message means that Step Functions
+            # will not start a second execution for the same message
+            self.sfn.start_execution(stateMachineArn=self.arn,
+                                     name=msg['MessageId'],
+                                     input=json.dumps(body))
+        except botocore.exceptions.ClientError as ex:
+            if ex.response['Error']['Code'] != 'ExecutionAlreadyExists':
+                print('Failed to start Index.IdWriter: {}'.format(ex))
+                self.count('failed to start')
+                return False
+
+        self.checkpoint.add(msg['MessageId'])
+        self.count('started', reason)
+        return True
+
+    def delete(self, msgs):
+        """
+        Delete a batch of messages from the queue.
+
+        Args:
+            msgs (list[dict]): Up to 10 messages returned by SQS.Client.receive_message().
+        """
+        if len(msgs) == 0:
+            return
+
+        entries = [{'Id': str(i), 'ReceiptHandle': msg['ReceiptHandle']}
+                   for i, msg in enumerate(msgs)]
+        try:
+            resp = self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            failed = resp.get('Failed', [])
+        except botocore.exceptions.ClientError as ex:
+            failed = [{'Id': entry['Id'], 'Message': str(ex)} for entry in entries]
+
+        for failure in failed:
+            print('Failed to delete message {} from queue: {}'.format(
+                msgs[int(failure['Id'])]['MessageId'], failure.get('Message')))
+            self.count('failed to delete')
+
+    def receive(self):
+        """
+        Receive, replay, and delete messages until the queue is empty.
+        """
+        while True:
+            resp = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=MAX_SQS_RECEIVE,
+                WaitTimeSeconds=RECEIVE_WAIT_SECS,
+                VisibilityTimeout=VISIBILITY_TIMEOUT)
+
+            if 'Messages' not in resp or len(resp['Messages']) == 0:
+                break
+
+            self.delete([msg for msg in resp['Messages'] if self.replay(msg)])
+
+    def run(self, receivers):
+        """
+        Drain the queue using multiple concurrent receivers.
+
+        Args:
+            receivers (int): Number of concurrent receivers.
+        """
+        errors = []
+        def receive():
+            try:
+                self.receive()
+            except Exception as ex:
+                errors.append(ex)
+
+        # Daemon threads, so that an interrupted run exits without draining the queue
+        threads = [threading.Thread(target=receive, daemon=True) for _ in range(receivers)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        print('Finished in {:.1f} seconds'.format(elapsed))
+        for outcome, count in sorted(self.counts.items()):
+            print('{}: {}'.format(outcome.capitalize(), count))
+        if self.reasons:
+            print('Index.IdWriters started by failure reason:')
+            for reason, count in self.reasons.most_common():
+                print('    {}: {}'.format(reason, count))
+
+        if errors:
+            raise errors[0]
+
+def start(bosslet_config, spacing, rate=START_RATE, receivers=RECEIVERS, checkpoint=None):
     """
-    Main entry point of script.  Step functions are started as fast as
-    possible but the first state is a delay.  The spacing argument is added to
+    Main entry point of script.  Step functions are started at most `rate`
+    per second but the first state is a delay.  The spacing argument is added to
     the total delay time, so the first step function's delay is 0 * spacing.
     The nth's step function's delay is (n-1) * spacing.
 
     Args:
         bosslet_config (BossConfiguration): Configuration for the target Bosslet
         spacing (int): Space start of step function's lambda task by this many seconds.
+        rate (float): Maximum number of step functions to start per second.
+        receivers (int): Number of concurrent queue receivers.
+        checkpoint (str): Path of the checkpoint file, defaults to
+                          '<deadletter queue name>.checkpoint'.
     """
-    sfn_arn_prefix = 'arn:aws:states:{}:{}:stateMachine:'.format(bosslet_config.REGION,
-                                                                 bosslet_config.ACCOUNT_ID)
-    arn = '{}{}'.format(sfn_arn_prefix, bosslet_config.names.index_id_writer.sfn)
-    queue_name = names.index_deadletter.sqs
+    if checkpoint is None:
+        checkpoint = '{}.checkpoint'.format(bosslet_config.names.index_deadletter.sqs)
+    checkpoint = Checkpoint(checkpoint)
 
-    sqs = bosslet_config.session.client('sqs')
-    resp = sqs.get_queue_url(QueueName=queue_name)
-    queue_url = resp['QueueUrl']
+    replayer = Replayer(bosslet_config, spacing, rate, checkpoint)
+    try:
+        replayer.run(receivers)
+    except:
+        checkpoint.close()
+        raise
 
-    sfn = bosslet_config.session.client('stepfunctions')
-
-    wait_secs = 0
-
-    while True:
-        resp = sqs.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=MAX_SQS_RECEIVE,
-            WaitTimeSeconds=5,
-            VisibilityTimeout=60)
-
-        if 'Messages' not in resp or len(resp['Messages']) == 0:
-            break
-
-        for msg in resp['Messages']:
-            try:
-                check_response(msg)
-            except CorruptSqsResponseError as ex:
-                print('Skipping bad message: {}'.format(ex))
-                continue
-
-            body = json.loads(msg['Body']) 
-            if 'operation' not in body:
-                print('Skipping message without operation field.')
-                continue
-
-            if body['operation'] != 'write_id_index':
-                print('Skipping message with operation: {}'.format(body['operation']))
-                continue
-
-            result = body.pop('result', None)
-            if result is not None:
-                print('Retrying Index.IdWriter that failed because: {}'.format(result['Error']))
-            else:
-                print('Retrying Index.IdWriter that failed because of unknown reasons.') 
-
-            # Stagger startup of Index.IdWriters so Dynamo has more time to scale
-            # if necessary.
-            body['wait_secs'] = wait_secs
-
-            try:
-                sfn.start_execution(stateMachineArn=arn, input=json.dumps(body))
-                wait_secs += spacing
-            except botocore.exception.ClientError as ex:
-                print('Failed to start Index.IdWriter: {}'.format(ex))
-                continue
-
-            try:
-                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=msg['ReceiptHandle'])
-            except:
-                print('Failed to delete message {} from queue'.format(
-                    msg['MessageId']))
-                continue
+    # Keep the checkpoint if any started message is still in the queue
+    checkpoint.close(remove = replayer.counts['failed to delete'] == 0)
 
 
 if __name__ == '__main__':
     parser = configuration.BossParser(description='Script for retrying Index.IdWriters that failed' + 
                                       'To supply arguments from a file, provide the filename prepended with an `@`.',
                                       fromfile_prefix_chars = '@')
+    parser.add_argument('--rate',
+                        type=float,
+                        default=START_RATE,
+                        help='Maximum # step functions to start per second (default: {})'.format(START_RATE))
+    parser.add_argument('--receivers',
+                        type=int,
+                        default=RECEIVERS,
+                        help='# concurrent queue receivers (default: {})'.format(RECEIVERS))
+    parser.add_argument('--checkpoint',
+                        default=None,
+                        help='Checkpoint file used to resume an interrupted run ' +
+                             '(default: <deadletter queue name>.checkpoint)')
     parser.add_bosslet()
     parser.add_argument('wait_secs',
                         nargs='?',
@@ -155,6 +342,5 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    start(args.bosslet_config, args.wait_secs)
+    start(args.bosslet_config, args.wait_secs, args.rate, args.receivers, args.checkpoint)
     print('Done.')
-
@@ -20,13 +20,21 @@ A script that manually creates Data Pipelines to restore a backup
 
 import sys
 import os
+import time
 import random
+import multiprocessing
+from multiprocessing.connection import wait
 
 import alter_path
 from lib import aws
+from lib import console
+from lib import exceptions
 from lib.datapipeline import DataPipeline, Ref
 from lib.configuration import BossParser
 
+# Default number of parallel scan segments / processes used when deleting DynamoDB data
+DDB_DELETE_SEGMENTS = 8
+
 def list_s3_bucket(session, bucket, prefix):
     client = session.client('s3')
 
@@ -54,7 +62,7 @@ def vault_pipeline(bosslet_config, directory):
     names = bosslet_config.names
     s3_backup = "s3://" + names.backup.s3 + "/" + directory
     s3_log = "s3://" + names.backup.s3 + "/restore-logs/"
-    cmd = "/usr/local/bin/python3 ~/vault.py restore {}".format(bosslet_config.INTERNAL_DOMAIN)
+    cmd = "/usr/local/bin/python3 ~/vault.py restore {} {}".format(bosslet_config.INTERNAL_DOMAIN, s3_backup)
 
     _, data = list_s3_bucket(bosslet_config.session, names.backup.s3, directory + "/vault")
     if len(data) == 0:
@@ -72,29 +80,175 @@ def vault_pipeline(bosslet_config, directory):
     pipeline.add_s3_bucket("VaultBucket", s3_backup + "/vault")
     return pipeline
 
-def ddb_delete_data(session, table_name):
-    response = None
-
-    ddb = session.resource('dynamodb')
-    tbl = ddb.Table(table_name)
-
-    print("Deleting data in {} table".format(table_name))
+def _ddb_delete_segment(session, table_name, keys, segment, total_segments, deleted):
+    """Delete all of the items in one segment of a parallel scan of the table
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+        keys (list[str]): Names of the table's key attributes
+        segment (int): Segment of the table to delete
+        total_segments (int): Total number of segments the table is divided into
+        deleted (multiprocessing.Value): Shared count of the items deleted
+    """
+    tbl = session.resource('dynamodb').Table(table_name)
+
+    # Only read the key attributes, as they are all that is needed for the delete
+    names = {'#k{}'.format(i): key for i, key in enumerate(keys)}
+    kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': ', '.join(names.keys()),
+        'ExpressionAttributeNames': names,
+    }
+
+    # The batch writer deletes 25 items per request and resends any
+    # UnprocessedItems returned by DynamoDB
+    with tbl.batch_writer(overwrite_by_pkeys = keys) as batch:
+        while True:
+            response = tbl.scan(**kwargs)
+            for item in response['Items']:
+                batch.delete_item(Key = item)
+
+            with deleted.get_lock():
+                deleted.value += len(response['Items'])
+
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def ddb_delete_data(session, table_name, segments = DDB_DELETE_SEGMENTS):
+    """Delete all of the items in a DynamoDB table
+
+    The table is divided into segments using a parallel scan and each
+    segment is deleted by a separate process.
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+        segments (int): Number of segments / processes to use
+
+    Raises:
+        BossManageError: If not all of the segments could be deleted
+    """
+    tbl = session.resource('dynamodb').Table(table_name)
 
     # Get the current schema keys for the table
     keys = [k['AttributeName'] for k in tbl.key_schema]
 
-    while response is None or 'LastEvaluatedKey' in response:
-        if response is None:
-            response = tbl.scan()
-        else:
-            response = tbl.scan(ExclusiveStartKey = response['LastEvaluatedKey'])
-
-        for item in response['Items']:
-            # calculate the key for the item, ignoring data elements
-            key = { k: v for k,v in item.items() if k in keys }
-            tbl.delete_item(Key = key)
-
-def ddb_pipeline(bosslet_config, directory):
+    # Fork so that the worker processes inherit the session (which cannot be pickled)
+    ctx = multiprocessing.get_context('fork')
+    deleted = ctx.Value('L', 0)
+    procs = [ctx.Process(target = _ddb_delete_segment,
+                         args = (session, table_name, keys, segment, segments, deleted))
+             for segment in range(segments)]
+
+    start = time.time()
+    for proc in procs:
+        proc.start()
+
+    with console.status_line(spin=True) as status:
+        running = [proc.sentinel for proc in procs]
+        while running:
+            for sentinel in wait(running, timeout = 1):
+                running.remove(sentinel)
+
+            elapsed = time.time() - start
+            status("Deleting data in {} table: {} items ({:.0f} items/s)".format(
+                        table_name, deleted.value, deleted.value / elapsed))
+
+    for proc in procs:
+        proc.join()
+
+    failed = [segment for segment, proc in enumerate(procs) if proc.exitcode != 0]
+    if failed:
+        raise exceptions.BossManageError("Could not delete all data in {} table".format(table_name),
+                                         causes = ["Segment {}: exit code {}".format(segment, procs[segment].exitcode)
+                                                   for segment in failed])
+
+    print("Deleted {} items from {} table in {:.1f} seconds".format(
+            deleted.value, table_name, time.time() - start))
+
+def ddb_recreate_table(session, table_name):
+    """Delete all of the items in a DynamoDB table by deleting and recreating
+    the table from its current description
+
+    The table's indexes, billing, stream, encryption, TTL, and tag
+    configuration are copied to the new table.
+
+    Note: For large tables this is faster than deleting the items, but the
+          table is unavailable while it is recreated, its stream ARN changes,
+          and any autoscaling configuration is removed
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+    """
+    client = session.client('dynamodb')
+
+    desc = client.describe_table(TableName = table_name)['Table']
+    ttl = client.describe_time_to_live(TableName = table_name)['TimeToLiveDescription']
+    tags = client.list_tags_of_resource(ResourceArn = desc['TableArn']).get('Tags', [])
+
+    billing = desc.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+    provisioned = billing == 'PROVISIONED'
+
+    def throughput(description):
+        return {
+            'ReadCapacityUnits': description['ReadCapacityUnits'],
+            'WriteCapacityUnits': description['WriteCapacityUnits'],
+        }
+
+    def index(description, global_ = False):
+        rtn = {
+            'IndexName': description['IndexName'],
+            'KeySchema': description['KeySchema'],
+            'Projection': description['Projection'],
+        }
+        if global_ and provisioned:
+            rtn['ProvisionedThroughput'] = throughput(description['ProvisionedThroughput'])
+        return rtn
+
+    args = {
+        'TableName': table_name,
+        'AttributeDefinitions': desc['AttributeDefinitions'],
+        'KeySchema': desc['KeySchema'],
+        'BillingMode': billing,
+    }
+    if provisioned:
+        args['ProvisionedThroughput'] = throughput(desc['ProvisionedThroughput'])
+    if desc.get('GlobalSecondaryIndexes'):
+        args['GlobalSecondaryIndexes'] = [index(gsi, True) for gsi in desc['GlobalSecondaryIndexes']]
+    if desc.get('LocalSecondaryIndexes'):
+        args['LocalSecondaryIndexes'] = [index(lsi) for lsi in desc['LocalSecondaryIndexes']]
+    if desc.get('StreamSpecification', {}).get('StreamEnabled'):
+        console.warning("{} table stream will have a new ARN".format(table_name))
+        args['StreamSpecification'] = desc['StreamSpecification']
+    if desc.get('SSEDescription', {}).get('Status') == 'ENABLED':
+        args['SSESpecification'] = {'Enabled': True}
+        if 'KMSMasterKeyArn' in desc['SSEDescription']:
+            args['SSESpecification']['SSEType'] = 'KMS'
+            args['SSESpecification']['KMSMasterKeyId'] = desc['SSEDescription']['KMSMasterKeyArn']
+
+    start = time.time()
+    aws.dynamodb_delete_table(session, table_name, wait = True)
+
+    print("Recreating {} table".format(table_name))
+    client.create_table(**args)
+    client.get_waiter('table_exists').wait(TableName = table_name)
+
+    if ttl.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        client.update_time_to_live(TableName = table_name,
+                                   TimeToLiveSpecification = {
+                                       'Enabled': True,
+                                       'AttributeName': ttl['AttributeName'],
+                                   })
+    if tags:
+        client.tag_resource(ResourceArn = desc['TableArn'], Tags = tags)
+
+    print("Recreated {} table in {:.1f} seconds".format(table_name, time.time() - start))
+
+def ddb_pipeline(bosslet_config, directory, segments = DDB_DELETE_SEGMENTS, recreate = False):
     names = bosslet_config.names
     s3_backup = "s3://" + names.backup.s3 + "/" + directory
     s3_log = "s3://" + names.backup.s3 + "/restore-logs/"
@@ -120,7 +274,10 @@ def ddb_pipeline(bosslet_config, directory):
         name = table.split('.', 1)[0]
         resp = input("Delete existing data in {} table? [y/N] ".format(name))
         if resp and len(resp) > 0 and resp[0].lower() == 'y':
-            ddb_delete_data(bosslet_config.session, table)
+            if recreate:
+                ddb_recreate_table(bosslet_config.session, table)
+            else:
+                ddb_delete_data(bosslet_config.session, table, segments)
 
     return pipeline
 
@@ -168,6 +325,15 @@ if __name__ == '__main__':
                         metavar = "<ami-version>",
                         default = "latest",
                         help = "The AMI version to use when selecting images (default: latest)")
+    parser.add_argument("--delete-segments",
+                        metavar = "<segments>",
+                        type = int,
+                        default = DDB_DELETE_SEGMENTS,
+                        help = "Number of processes used to delete existing DynamoDB data (default: {})".format(DDB_DELETE_SEGMENTS))
+    parser.add_argument("--recreate-tables",
+                        action = "store_true",
+                        default = False,
+                        help = "Delete existing DynamoDB data by deleting and recreating the table (faster for large tables)")
     parser.add_bosslet()
     parser.add_argument("backup_date", help="Year and week of the backup to restore (format: YYYY-ww")
     parser.add_argument("type",
@@ -203,12 +369,17 @@ if __name__ == '__main__':
         if name not in args.type:
             continue
 
-        pipeline = build(*pipeline_args)
+        if name == 'dynamo':
+            pipeline = build(*pipeline_args,
+                             segments = args.delete_segments,
+                             recreate = args.recreate_tables)
+        else:
+            pipeline = build(*pipeline_args)
         if pipeline is None:
             continue
 
         id = aws.create_data_pipeline(bosslet_config.session,
-                                      name + '-restore.' + bosslet_config.INTERNAL_DOMAIN
+                                      name + '-restore.' + bosslet_config.INTERNAL_DOMAIN,
                                       pipeline)
         if id is None:
             print("Problem creating {} pipeline, cannot restore".format(name))
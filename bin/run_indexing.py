@@ -20,16 +20,27 @@ Index.FindCuboids step function on the given channel.
 
 Can also stop a running indexing process or resume one that's been stopped via
 the --stop and --resume flags, respectively.
+
+With --batch, indexing is started for a list of channels read from a file.
+The progress of the batch is saved in a state file next to the channel file,
+so that running the same command again continues the batch.
 """
 
 import argparse
 import boto3
+import botocore.exceptions
 import os
 import json
-from collections import namedtuple
+import time
+import random
+from collections import namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import alter_path
+from lib import aws
+from lib import boss_rds
 from lib import configuration
+from lib import console
 
 # When this number of number of write units is consumed updating an entry in
 # the id index, a new entry will be created to reduce the cost of adding
@@ -41,6 +52,27 @@ RESOLUTION = 0
 # Format string for building the first part of step function's arn.
 SFN_ARN_PREFIX_FORMAT = 'arn:aws:states:{}:{}:stateMachine:'
 
+# Maximum number of Index.FindCuboids executions a batch runs at once.
+BATCH_CONCURRENCY = 5
+
+# Seconds between checks of the batch's running executions.
+BATCH_POLL_SECS = 10
+
+# Index.FindCuboids execution statuses that will not change.
+FINISHED_STATUSES = ('SUCCEEDED', 'FAILED', 'TIMED_OUT', 'ABORTED')
+
+# Number of concurrent stop_execution calls made when stopping indexing.
+STOP_WORKERS = 16
+
+# Retries, and the initial backoff in seconds, of throttled stop_execution calls.
+STOP_RETRIES = 6
+STOP_BACKOFF = 0.5
+THROTTLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException')
+
+# Number of times to list and stop a step function's running executions,
+# catching executions started while the previous pass was running.
+STOP_PASSES = 3
+
 #   "lookup_key": "4&4&24&0",   # This is the 192 cuboid test dataset with 249 ids per cuboid.
 #   "lookup_key": "8&8&26&0",   # This is the annotation regression test data.
 #   "lookup_key": "4&4&24&0",   # This is 1200 cuboid test dataset.
@@ -187,19 +219,83 @@ def get_running_step_fcns(bosslet_config, arn):
         (str): Execution arn of running step function.
     """
     sfn = bosslet_config.session.client('stepfunctions')
-    list_args = dict(
-        stateMachineArn=arn, statusFilter='RUNNING', maxResults=100)
+    executions = aws.iter_all(sfn.list_executions, 'executions',
+                              page_size=100, page_size_key='maxResults',
+                              token='nextToken')
+    for exe in executions(stateMachineArn=arn, statusFilter='RUNNING'):
+        yield exe['executionArn']
 
-    resp = sfn.list_executions(**list_args)
 
-    for exe in resp['executions']:
-        yield exe['executionArn']
+def stop_step_fcn(sfn, arn, error, cause):
+    """
+    Stop a step function execution, retrying if throttled.
+
+    Args:
+        sfn (StepFunctions.Client): Step Functions client.
+        arn (str): Execution arn to stop.
+        error (str): Error code of the stop.
+        cause (str): Cause of the stop.
+    """
+    delay = STOP_BACKOFF
+    for attempt in range(STOP_RETRIES + 1):
+        try:
+            sfn.stop_execution(executionArn=arn, error=error, cause=cause)
+            return
+        except botocore.exceptions.ClientError as ex:
+            code = ex.response['Error']['Code']
+            if code not in THROTTLE_ERRORS or attempt == STOP_RETRIES:
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+
+
+def stop_step_fcns(bosslet_config, arn, error, cause, workers=STOP_WORKERS):
+    """
+    Stop all running executions of a step function, listing the executions
+    while stopping them with a pool of workers.
 
-    while 'nextToken' in resp:
-        list_args['nextToken'] = resp['nextToken']
-        resp = sfn.list_executions(**list_args)
-        for exe in resp['executions']:
-            yield exe['executionArn']
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        arn (str): Specifies step function of interest.
+        error (str): Error code of the stop.
+        cause (str): Cause of the stop.
+        workers (int): Number of concurrent stop_execution calls.
+
+    Returns:
+        (tuple(int, list[str])): Number of executions stopped and the messages
+                                 of any executions that could not be stopped.
+    """
+    # boto3 clients are thread safe
+    sfn = bosslet_config.session.client('stepfunctions')
+    stopped = 0
+    failed = []
+
+    def finish(futures):
+        nonlocal stopped
+        for future in futures:
+            exe_arn = running.pop(future)
+            try:
+                future.result()
+                stopped += 1
+            except botocore.exceptions.ClientError as ex:
+                failed.append('{}: {}'.format(exe_arn, ex))
+
+    with ThreadPoolExecutor(workers) as executor:
+        for _ in range(STOP_PASSES):
+            running = {}
+            found = 0
+            for exe_arn in get_running_step_fcns(bosslet_config, arn):
+                if len(running) >= workers * 2:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    finish(done)
+                running[executor.submit(stop_step_fcn, sfn, exe_arn, error, cause)] = exe_arn
+                found += 1
+            finish(list(running))
+
+            if found == 0:
+                break
+
+    return stopped, failed
 
 
 def run_find_cuboids(bosslet_config, args):
@@ -234,6 +330,190 @@ def run_find_cuboids(bosslet_config, args):
     print(resp)
 
 
+def read_batch(filename):
+    """
+    Read the channels to index from a file.
+
+    Each non-blank line, that doesn't start with '#', is either a
+    collection/experiment/channel name or a lookup key
+    (col_id&exp_id&chan_id with an optional &resolution).
+
+    Args:
+        filename (str): Path of the channel file.
+
+    Returns:
+        (list[str]): The channels, in file order, without duplicates.
+    """
+    with open(filename) as fh:
+        lines = [line.strip() for line in fh]
+    return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+
+
+def resolve_batch(bosslet_config, channels):
+    """
+    Get the lookup keys for a batch of channels, looking up all of the
+    collection/experiment/channel names in one database round trip.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        channels (list[str]): Channels returned by read_batch().
+
+    Returns:
+        (dict[str, str]): Channel to lookup key.
+
+    Raises:
+        (ResourceNotFoundException): If any of the channel names could not be found.
+    """
+    keys = {}
+    names = {}
+    for channel in channels:
+        if '&' in channel:
+            parts = channel.split('&')
+            keys[channel] = channel if len(parts) == 4 else '{}&{}'.format(channel, RESOLUTION)
+        else:
+            parts = tuple(channel.strip('/').split('/'))
+            if len(parts) != 3:
+                raise ResourceNotFoundException(
+                    "Not a collection/experiment/channel: {}".format(channel))
+            names[channel] = parts
+
+    if names:
+        found = boss_rds.sql_get_lookup_keys_from_names(bosslet_config, names.values())
+        missing = [channel for channel, parts in names.items() if parts not in found]
+        if missing:
+            raise ResourceNotFoundException(
+                "Can't find channel(s): {}".format(', '.join(missing)))
+
+        for channel, parts in names.items():
+            keys[channel] = '{}&{}'.format(found[parts], RESOLUTION)
+
+    return keys
+
+
+class IndexingBatch(object):
+    """
+    Runs Index.FindCuboids for a batch of channels, a limited number at a
+    time, and tracks the executions in a state file.
+
+    State file format:
+        {channel: {"lookup_key": str, "execution": str|null, "status": str}}
+        where status is PENDING or an Index.FindCuboids execution status.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        filename (str): Path of the channel file, the state is saved in
+                        '<filename>.state'.
+    """
+    def __init__(self, bosslet_config, filename):
+        self.bosslet_config = bosslet_config
+        self.sfn = bosslet_config.session.client('stepfunctions')
+        self.filename = filename + '.state'
+
+        self.state = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as fh:
+                self.state = json.load(fh)
+
+        channels = [c for c in read_batch(filename) if c not in self.state]
+        if channels:
+            for channel, lookup_key in resolve_batch(bosslet_config, channels).items():
+                self.state[channel] = {
+                    'lookup_key': lookup_key,
+                    'execution': None,
+                    'status': 'PENDING',
+                }
+            self.save()
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.state, fh, indent=2, sort_keys=True)
+        os.replace(tmp, self.filename)
+
+    def channels(self, *statuses):
+        return [c for c, s in self.state.items() if s['status'] in statuses]
+
+    def counts(self):
+        return Counter(s['status'] for s in self.state.values())
+
+    def start(self, channel):
+        arn, input_ = get_find_cuboid_args(self.bosslet_config,
+                                           self.state[channel]['lookup_key'])
+        resp = self.sfn.start_execution(stateMachineArn=arn, input=input_)
+        self.state[channel]['execution'] = resp['executionArn']
+        self.state[channel]['status'] = 'RUNNING'
+        self.save()
+
+    def update(self, channel):
+        """Check on a running execution, returning True if it finished"""
+        resp = self.sfn.describe_execution(executionArn=self.state[channel]['execution'])
+        if resp['status'] == 'RUNNING':
+            return False
+
+        self.state[channel]['status'] = resp['status']
+        self.save()
+        return True
+
+    def run(self, concurrency=BATCH_CONCURRENCY):
+        """
+        Start the pending (and restart any failed) channels, with at most
+        `concurrency` running at once, until all of them finish.
+
+        Args:
+            concurrency (int): Maximum number of Index.FindCuboids to run at once.
+        """
+        for channel in self.channels('FAILED', 'TIMED_OUT', 'ABORTED'):
+            self.state[channel]['status'] = 'PENDING'
+        self.save()
+
+        start = time.time()
+        finished = 0
+        with console.status_line(spin=True) as status:
+            while True:
+                running = self.channels('RUNNING')
+                for channel in running:
+                    if self.update(channel):
+                        finished += 1
+                        print('{}: {} ({})'.format(self.state[channel]['status'],
+                                                   channel,
+                                                   self.state[channel]['lookup_key']))
+
+                running = self.channels('RUNNING')
+                for channel in self.channels('PENDING')[:max(0, concurrency - len(running))]:
+                    self.start(channel)
+                    print('STARTED: {} ({})'.format(channel, self.state[channel]['lookup_key']))
+
+                counts = self.counts()
+                rate = finished / (time.time() - start) * 3600
+                status('Pending: {}  Running: {}  Succeeded: {}  Failed: {}  ({:.1f} channels/hour)'.format(
+                            counts['PENDING'],
+                            counts['RUNNING'],
+                            counts['SUCCEEDED'],
+                            sum(counts[s] for s in ('FAILED', 'TIMED_OUT', 'ABORTED')),
+                            rate))
+
+                if counts['PENDING'] == 0 and counts['RUNNING'] == 0:
+                    break
+                time.sleep(BATCH_POLL_SECS)
+
+        counts = self.counts()
+        print('Batch finished: {} succeeded, {} failed'.format(
+            counts['SUCCEEDED'], len(self.state) - counts['SUCCEEDED']))
+
+    def stop(self):
+        """
+        Stop the batch's running Index.FindCuboids, they are restarted when
+        the batch is run again.
+        """
+        for channel in self.channels('RUNNING'):
+            print('\tStopping {}'.format(self.state[channel]['execution']))
+            self.sfn.stop_execution(executionArn=self.state[channel]['execution'],
+                                    error='ManualAbort',
+                                    cause='User initiated abort')
+            self.state[channel]['status'] = 'ABORTED'
+        self.save()
+
+
 def resume_indexing(bosslet_config):
     """
     Resume indexing a channel or channels.  If the CuboidsKeys queue is not
@@ -255,15 +535,19 @@ def resume_indexing(bosslet_config):
     print(resp)
 
 
-def stop_indexing(bosslet_config):
+def stop_indexing(bosslet_config, cuboid_supervisors=False, workers=STOP_WORKERS):
     """
-    Stop the indexing process, gracefully.  Index.CuboidSupervisors will not
-    be stopped, so the entire index process will not terminate, immediately.
+    Stop the indexing process, gracefully.  By default Index.CuboidSupervisors
+    will not be stopped, so the entire index process will not terminate, immediately.
     Only the Index.Supervisor and any running Index.DequeueCuboid step 
     functions will be halted.  This allows the indexing process to be resumed.
 
     Args:
         bosslet_config (BossConfiguration): Bosslet configuration object
+        cuboid_supervisors (bool): Also stop the Index.CuboidSupervisors, so that
+                                   indexing stops immediately.  Cuboids being
+                                   indexed by them will need to be reindexed.
+        workers (int): Number of concurrent stop_execution calls.
     """
     stop_args = get_common_args(bosslet_config)
 
@@ -272,25 +556,27 @@ def stop_indexing(bosslet_config):
     error = 'ManualAbort'
     cause = 'User initiated abort'
 
-    supe_arn = stop_args['id_supervisor_step_fcn']
-    sfn = session.client('stepfunctions')
-
-    print('Stopping Index.Supervisor . . .')
-    for arn in get_running_step_fcns(bosslet_config, supe_arn):
-        print('\tStopping {}'.format(arn))
-        sfn.stop_execution(
-            executionArn=arn,
-            error=error,
-            cause=cause)
-
-    print('Stopping Index.DequeueCuboids . . .')
-    deque_arn = stop_args['index_dequeue_cuboids_step_fcn']
-    for arn in get_running_step_fcns(bosslet_config, deque_arn):
-        print('\tStopping {}'.format(arn))
-        sfn.stop_execution(
-            executionArn=arn,
-            error=error,
-            cause=cause)
+    step_fcns = [
+        # Stop the supervisor first, so that it doesn't start new executions
+        ('Index.Supervisor', stop_args['id_supervisor_step_fcn']),
+        ('Index.DequeueCuboids', stop_args['index_dequeue_cuboids_step_fcn']),
+    ]
+    if cuboid_supervisors:
+        step_fcns.append(('Index.CuboidSupervisor', stop_args['id_cuboid_supervisor_step_fcn']))
+
+    start = time.time()
+    summary = []
+    for name, arn in step_fcns:
+        print('Stopping {} . . .'.format(name))
+        stopped, failed = stop_step_fcns(bosslet_config, arn, error, cause, workers)
+        for msg in failed:
+            print('\tFailed to stop {}'.format(msg))
+        summary.append((name, stopped, len(failed)))
+
+    print('Stopped in {:.1f} seconds'.format(time.time() - start))
+    for name, stopped, failed in summary:
+        print('\t{}: {} stopped{}'.format(name, stopped,
+                                         ', {} failed'.format(failed) if failed else ''))
 
     print('Done.')
 
@@ -310,10 +596,27 @@ def parse_args():
         '--lookup-key', '-l',
         default=None,
         help='Lookup key of channel (supply this to avoid slow tunneling to DB)')
+    parser.add_argument(
+        '--batch', '-b',
+        metavar='FILE',
+        default=None,
+        help='File of channels (coll/exp/chan or lookup key, one per line) to index; ' +
+             'rerun to continue the batch, with --stop to stop the batch, or ' +
+             'with --resume to also resume indexing')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help='Maximum # Index.FindCuboids to run at once in a batch (default: {})'.format(BATCH_CONCURRENCY))
     parser.add_argument(
         '--stop',
         action='store_true',
         help='Stop indexing operation (will leave CuboidKeys queue untouched so indexing may be resumed)')
+    parser.add_argument(
+        '--stop-cuboid-supervisors',
+        action='store_true',
+        help='With --stop, also stop Index.CuboidSupervisors (indexing stops immediately, ' +
+             'cuboids they were indexing need to be reindexed)')
     parser.add_argument(
         '--resume',
         action='store_true',
@@ -342,7 +645,7 @@ def parse_args():
         parser.exit(
             1, 'Error: cannot specify --stop and --resume simultaneously')
 
-    if (args.lookup_key is None and not args.stop and not args.resume and
+    if (args.lookup_key is None and args.batch is None and not args.stop and not args.resume and
         (args.collection is None or args.experiment is None or args.channel is None)
     ):
         parser.print_usage()
@@ -359,8 +662,18 @@ def parse_args():
 if __name__ == '__main__':
     args = parse_args()
 
-    if args.stop:
-        stop_indexing(args.bosslet_config)
+    if args.batch is not None:
+        batch = IndexingBatch(args.bosslet_config, args.batch)
+        if args.stop:
+            print('Stopping batch Index.FindCuboids . . .')
+            batch.stop()
+            stop_indexing(args.bosslet_config, args.stop_cuboid_supervisors)
+        else:
+            if args.resume:
+                resume_indexing(args.bosslet_config)
+            batch.run(args.concurrency)
+    elif args.stop:
+        stop_indexing(args.bosslet_config, args.stop_cuboid_supervisors)
     elif args.resume:
         resume_indexing(args.bosslet_config)
     else:
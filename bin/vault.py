@@ -220,17 +220,24 @@ def vault_delete(vault, path = None):
         path = input("path: ")
     vault.delete(path)
 
-def vault_export(vault, output='-', path="secret/"):
+def vault_export(vault, output='-', path="secret/", *exclude):
     """A generic method for exporting data from Vault
 
-    Note: output data is Json encoded
+    Note: output data is Json encoded, or newline delimited Json encoded
+          (written as the data is read) if the output path ends with '.ndjson'
 
     Args:
         vault (Vault) : Vault connection to use
         output (string) : Output path to save the data ('-' for stdout)
         path (string) : Vault path to export data from
+        exclude (list[string]) : Vault path prefixes to not export
     """
-    rtn = vault.export(path)
+    if output.endswith('.ndjson'):
+        with open_(output, 'w') as fh:
+            vault.export_ndjson(path, fh, exclude)
+        return
+
+    rtn = vault.export(path, exclude)
 
     with open_(output, 'w') as fh:
         json.dump(rtn, fh, indent=3, sort_keys=True)
@@ -238,12 +245,17 @@ def vault_export(vault, output='-', path="secret/"):
 def vault_import(vault, input_='-'):
     """A generic method for importing data into Vault
 
-    Note: input data should be Json encoded
+    Note: input data should be Json encoded, or newline delimited Json encoded
+          if the input path ends with '.ndjson'
 
     Args:
         input_ (string) : Input path to read data from ('-' for stdin)
     """
     with open_(input_) as fh:
+        if input_.endswith('.ndjson'):
+            vault.import_ndjson(fh)
+            return
+
         exported = json.load(fh)
 
     vault.import_(exported)
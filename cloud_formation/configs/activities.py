@@ -35,7 +35,7 @@ from lib import utils
 from lib import aws
 from lib import constants as const
 from lib import stepfunctions as sfn
-from lib.lambdas import load_lambdas_on_s3, update_lambda_code
+from lib.lambdas import lambda_dirs, build_lambdas, update_lambda_code, freshen_lambda
 
 def STEP_FUNCTIONS(bosslet_config):
     names = bosslet_config.names
@@ -146,8 +146,7 @@ def create_config(bosslet_config, lookup=True):
     config.add_lambda("IngestLambda",
                       names.ingest_lambda.lambda_,
                       aws.role_arn_lookup(session, 'IngestQueueUpload'),
-                      const.INGEST_LAMBDA,
-                      handler="index.handler",
+                      handler="ingest_queue_upload.handler",
                       timeout=60 * 5,
                       runtime='python3.6',
                       memory=3008)
@@ -199,17 +198,23 @@ def create(bosslet_config):
     post_init(bosslet_config)
 
 def pre_init(bosslet_config):
-    """Build multilambda zip file and put in S3."""
-    load_lambdas_on_s3(bosslet_config)
+    """Build multilambda and ingest lambda zip files and put in S3."""
+    dirs = lambda_dirs(bosslet_config)
+    build_lambdas(bosslet_config, [dirs[bosslet_config.names.multi_lambda.lambda_],
+                                   dirs[bosslet_config.names.ingest_lambda.lambda_]])
 
 def update(bosslet_config):
-    if console.confirm('Build multilambda', default = True):
+    rebuild_lambdas = console.confirm('Build multilambda', default = True)
+    if rebuild_lambdas:
         pre_init(bosslet_config)
         update_lambda_code(bosslet_config)
 
     config = create_config(bosslet_config)
     config.update()
 
+    if rebuild_lambdas:
+        freshen_lambda(bosslet_config, bosslet_config.names.ingest_lambda.lambda_)
+
     post_update(bosslet_config)
 
 def post_init(bosslet_config):
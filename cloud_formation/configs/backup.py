@@ -85,7 +85,7 @@ def create_config(bosslet_config):
         BUCKET_DEPENDENCY = "BackupBucket"
 
     # Vault Backup
-    cmd = "/usr/local/bin/python3 ~/vault.py backup {}".format(bosslet_config.INTERNAL_DOMAIN)
+    cmd = "/usr/local/bin/python3 ~/vault.py backup {} {}".format(bosslet_config.INTERNAL_DOMAIN, s3_backup)
     pipeline = DataPipeline(log_uri = s3_logs, resource_role="backup")
     pipeline.add_shell_command("VaultBackup",
                                cmd,
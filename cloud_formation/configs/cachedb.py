@@ -34,7 +34,7 @@ from lib import aws
 from lib import constants as const
 from lib import utils
 from lib import console
-from lib.lambdas import load_lambdas_on_s3, freshen_lambda
+from lib.lambdas import lambda_dirs, build_lambdas, update_functions
 
 import botocore
 
@@ -415,8 +415,8 @@ def pre_init(bosslet_config):
     """Send spdb, bossutils, lambda, and lambda_utils to the lambda build
     server, build the lambda environment, and upload to S3.
     """
-    for lambda_name in get_lambdas(bosslet_config):
-        load_lambdas_on_s3(bosslet_config, lambda_name)
+    dirs = lambda_dirs(bosslet_config)
+    build_lambdas(bosslet_config, sorted({dirs[name] for name in get_lambdas(bosslet_config)}))
 
 
 def update(bosslet_config):
@@ -433,8 +433,7 @@ def update(bosslet_config):
     config.update()
 
     if rebuild_lambdas:
-        for lambda_name in get_lambdas(bosslet_config):
-            freshen_lambda(bosslet_config, lambda_name)
+        update_functions(bosslet_config, get_lambdas(bosslet_config))
 
     post_init(bosslet_config)
 
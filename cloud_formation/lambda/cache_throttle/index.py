@@ -12,14 +12,85 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
 import redis
 
+# Number of keys requested from each SCAN call
+SCAN_COUNT = 1000
+
+# Maximum number of keys deleted by a single UNLINK / DEL command
+DELETE_BATCH = 100
+
+# Seconds before the lambda times out to stop deleting keys
+TIME_BUFFER = 5
+
+def reset_keys(conn, match='*', cursor=0, dry_run=False, deadline=None):
+    """Delete all of the keys matching the pattern without blocking Redis
+
+    Keys are found using SCAN, which only looks at a small part of the keyspace
+    per call, and are deleted using pipelined UNLINK commands (or DEL if the
+    server doesn't support UNLINK) that each delete at most DELETE_BATCH keys.
+
+    Args:
+        conn (StrictRedis): Redis connection
+        match (str): Pattern of the keys to delete
+        cursor (int): SCAN cursor to start from, to continue a previous reset
+        dry_run (bool): If the matching keys should only be counted, not deleted
+        deadline (optional[float]): time.time() after which to stop deleting keys
+
+    Returns:
+        tuple(int, int): Number of keys deleted (or found, if a dry run) and the
+                         SCAN cursor to continue from (0 if all keys were reset).
+                         SCAN can return a key more than once, so the count is
+                         approximate.
+    """
+    major = int(conn.info('server')['redis_version'].split('.')[0])
+    delete = 'UNLINK' if major >= 4 else 'DEL'
+
+    count = 0
+    while True:
+        cursor, keys = conn.scan(cursor, match=match, count=SCAN_COUNT)
+        count += len(keys)
+
+        if len(keys) > 0 and not dry_run:
+            pipe = conn.pipeline(transaction=False)
+            for i in range(0, len(keys), DELETE_BATCH):
+                pipe.execute_command(delete, *keys[i:i + DELETE_BATCH])
+            pipe.execute()
+
+        if cursor == 0:
+            return count, 0
+
+        if deadline is not None and time.time() > deadline:
+            return count, cursor
+
 def handler(event, context):
-    print("Deleting data from {}".format(event['host']))
+    """Reset the Boss throttling metrics
+
+    Event:
+        host (str): Redis host
+        match (optional[str]): Pattern of the keys to delete (default: all keys)
+        cursor (optional[int]): SCAN cursor returned by a previous, unfinished, reset
+        dry_run (optional[bool]): Only count the keys that would be deleted
+    """
+    dry_run = event.get('dry_run', False)
+    print("{} data from {}".format("Counting" if dry_run else "Deleting", event['host']))
+
+    deadline = None
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - TIME_BUFFER
 
     conn = redis.StrictRedis(event['host'], 6379, 0)
-    keys = conn.keys()
-    if len(keys) > 0:
-        conn.delete(*keys)
+    start = time.time()
+    count, cursor = reset_keys(conn,
+                               match = event.get('match', '*'),
+                               cursor = event.get('cursor', 0),
+                               dry_run = dry_run,
+                               deadline = deadline)
+
+    print("{} {} keys in {:.2f} seconds".format("Found" if dry_run else "Deleted",
+                                                count, time.time() - start))
+    if cursor != 0:
+        print("Ran out of time, rerun with 'cursor': {} to continue".format(cursor))
 
-    print("Deleted keys: {}".format(keys))
+    return {'count': count, 'cursor': cursor}
@@ -0,0 +1,91 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the time Redis is blocked while resetting the throttle metrics
+
+Fills a local Redis with throttle counters and compares the longest single
+command, as recorded by the Redis SLOWLOG, of index.reset_keys() against
+the original KEYS followed by a single DEL of all keys.
+
+WARNING: Deletes all data in the given Redis database
+
+Run from this directory, with a local Redis server running:
+    python3 benchmark_cache_throttle.py [host] [keys]
+"""
+
+import sys
+import time
+
+import redis
+
+import index
+
+HOST = 'localhost'
+KEYS = 500000
+FILL_BATCH = 10000
+
+def fill(conn, keys):
+    """Create throttle counters like the ones created by the endpoint"""
+    pipe = conn.pipeline(transaction=False)
+    for i in range(keys):
+        pipe.set('throttle:user:{}:api:{}'.format(i % 1000, i), i)
+        if i % FILL_BATCH == FILL_BATCH - 1:
+            pipe.execute()
+    pipe.execute()
+
+def original_reset(conn):
+    """The original cache_throttle reset"""
+    keys = conn.keys()
+    if len(keys) > 0:
+        conn.delete(*keys)
+
+def measure(conn, reset, keys):
+    """Run the reset and return the total seconds, the longest command in
+    microseconds, and the name of that command"""
+    conn.flushdb()
+    fill(conn, keys)
+
+    conn.config_set('slowlog-log-slower-than', 0)
+    conn.config_set('slowlog-max-len', 1000000)
+    conn.slowlog_reset()
+
+    start = time.time()
+    reset(conn)
+    elapsed = time.time() - start
+
+    entries = conn.slowlog_get(1000000)
+    longest = max(entries, key=lambda entry: entry['duration'])
+    command = longest['command']
+    if isinstance(command, bytes):
+        command = command.decode()
+
+    return elapsed, longest['duration'], command.split(' ')[0]
+
+if __name__ == '__main__':
+    host = sys.argv[1] if len(sys.argv) > 1 else HOST
+    keys = int(sys.argv[2]) if len(sys.argv) > 2 else KEYS
+
+    conn = redis.StrictRedis(host, 6379, 0)
+    slowlog = conn.config_get('slowlog-*')
+    try:
+        original = measure(conn, original_reset, keys)
+        current = measure(conn, index.reset_keys, keys)
+    finally:
+        for key, value in slowlog.items():
+            conn.config_set(key, value)
+
+    print("Keys: {}".format(keys))
+    print("{:<20}{:>10}{:>22}{:>10}".format("", "seconds", "longest command (us)", "command"))
+    print("{:<20}{:>10.2f}{:>22}{:>10}".format("KEYS + DEL:", *original))
+    print("{:<20}{:>10.2f}{:>22}{:>10}".format("SCAN + UNLINK:", *current))
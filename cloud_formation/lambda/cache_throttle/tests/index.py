@@ -0,0 +1 @@
+../index.py
\ No newline at end of file
@@ -0,0 +1,115 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# index.py is a symbolic link to the lambda's index.py, so that it can be
+# imported without updating the scripts responsible for deploying the lambda code.
+
+import index
+import unittest
+from unittest.mock import MagicMock, patch
+
+def make_conn(pages, version='5.0.6'):
+    """Create a mock Redis connection
+
+    Args:
+        pages (list[list[str]]): Keys returned by each SCAN call, the last
+                                 call returns a cursor of 0
+        version (str): Redis server version
+
+    Returns:
+        MagicMock: The connection, with the pipeline as `conn.pipe`
+    """
+    conn = MagicMock()
+    conn.info.return_value = {'redis_version': version}
+    conn.scan.side_effect = [(0 if i == len(pages) - 1 else i + 1, keys)
+                             for i, keys in enumerate(pages)]
+    conn.pipe = conn.pipeline.return_value
+    return conn
+
+def keys(start, stop):
+    return ['metric_{}'.format(i) for i in range(start, stop)]
+
+class TestResetKeys(unittest.TestCase):
+    def deleted(self, conn):
+        """Get the (command, number of keys) of each delete command"""
+        return [(c[0][0], len(c[0]) - 1) for c in conn.pipe.execute_command.call_args_list]
+
+    def test_unlink(self):
+        conn = make_conn([keys(0, 10), keys(10, 20)])
+
+        count, cursor = index.reset_keys(conn)
+
+        self.assertEqual((count, cursor), (20, 0))
+        self.assertEqual(self.deleted(conn), [('UNLINK', 10), ('UNLINK', 10)])
+        self.assertEqual(conn.pipe.execute.call_count, 2)
+
+    def test_del_fallback(self):
+        conn = make_conn([keys(0, 10)], version='3.2.12')
+
+        index.reset_keys(conn)
+
+        self.assertEqual(self.deleted(conn), [('DEL', 10)])
+
+    def test_batches(self):
+        batch = index.DELETE_BATCH
+        conn = make_conn([keys(0, batch * 2 + 1)])
+
+        count, cursor = index.reset_keys(conn)
+
+        self.assertEqual(count, batch * 2 + 1)
+        self.assertEqual(self.deleted(conn), [('UNLINK', batch), ('UNLINK', batch), ('UNLINK', 1)])
+        # All batches from one SCAN call are sent in a single round trip
+        conn.pipe.execute.assert_called_once_with()
+
+        deleted = [k for c in conn.pipe.execute_command.call_args_list for k in c[0][1:]]
+        self.assertEqual(deleted, keys(0, batch * 2 + 1))
+
+    def test_empty_page(self):
+        conn = make_conn([[], keys(0, 5)])
+
+        count, cursor = index.reset_keys(conn, match='metric_*')
+
+        self.assertEqual((count, cursor), (5, 0))
+        self.assertEqual(conn.pipe.execute.call_count, 1)
+        conn.scan.assert_called_with(1, match='metric_*', count=index.SCAN_COUNT)
+
+    def test_dry_run(self):
+        conn = make_conn([keys(0, 10), keys(10, 20)])
+
+        count, cursor = index.reset_keys(conn, dry_run=True)
+
+        self.assertEqual((count, cursor), (20, 0))
+        conn.pipeline.assert_not_called()
+        conn.delete.assert_not_called()
+        conn.unlink.assert_not_called()
+
+    @patch.object(index.time, 'time', return_value=100)
+    def test_deadline(self, time):
+        conn = make_conn([keys(0, 10), keys(10, 20), keys(20, 30)])
+
+        count, cursor = index.reset_keys(conn, deadline=99)
+
+        # Stops after the first SCAN call, returning the cursor to continue from
+        self.assertEqual((count, cursor), (10, 1))
+        self.assertEqual(conn.scan.call_count, 1)
+        self.assertEqual(self.deleted(conn), [('UNLINK', 10)])
+
+    @patch.object(index.time, 'time', return_value=100)
+    def test_continue(self, time):
+        conn = make_conn([keys(10, 20)])
+
+        count, cursor = index.reset_keys(conn, cursor=1, deadline=101)
+
+        self.assertEqual((count, cursor), (10, 0))
+        conn.scan.assert_called_once_with(1, match='*', count=index.SCAN_COUNT)
@@ -1,15 +1,21 @@
 import boto3
 import json
 import time
+import random
 import hashlib
 import pprint
 import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 class FailedToSendMessages(Exception):
     pass
 
 SQS_BATCH_SIZE = 10
 SQS_RETRY_TIMEOUT = 15
+SQS_RETRY_COUNT = 3
+SQS_BACKOFF_BASE = 0.25 # seconds, doubled for each retry of an entry
+SQS_MAX_IN_FLIGHT = 1 # Number of concurrent batches, 1 uses the serial sender
+DEADLINE_MARGIN = 30 * 1000 # milliseconds of lambda time to keep in reserve
 
 def handler(args, context):
     """Populate the ingest upload SQS Queue with tile information
@@ -44,11 +50,17 @@ def handler(args, context):
 
             'z_chunk_size': 16,
             'MAX_NUM_ITEMS_PER_LAMBDA': 20000
-            'items_to_skip': 0
+            'items_to_skip': 0,
+
+            'max_in_flight': 1 # Optional, number of concurrent batches
         }
+        context: Lambda context object
 
     Returns:
-        int: Number of messages put into the queue
+        int: Number of messages put into the queue. When sending concurrently
+             the lambda may stop before its deadline with fewer than
+             MAX_NUM_ITEMS_PER_LAMBDA messages sent, the caller should then
+             relaunch with items_to_skip increased by the returned count
     """
     print("Starting to populate upload queue")
     pprint.pprint(args)
@@ -56,24 +68,18 @@ def handler(args, context):
     queue = boto3.resource('sqs').Queue(args['upload_queue'])
 
     msgs = create_messages(args)
-    sent = 0
-
-    while True:
-        batch = []
-        for i in range(SQS_BATCH_SIZE):
-            try:
-                batch.append({
-                    'Id': str(i),
-                    'MessageBody': next(msgs),
-                    'DelaySeconds': 0
-                })
-            except StopIteration:
-                break
 
-        if len(batch) == 0:
-            break
+    max_in_flight = args.get('max_in_flight', SQS_MAX_IN_FLIGHT)
+    if max_in_flight > 1:
+        return send_messages_concurrently(queue.meta.client,
+                                          queue.url,
+                                          msgs,
+                                          context,
+                                          max_in_flight)
 
-        retry = 3
+    sent = 0
+    for batch in create_batches(msgs):
+        retry = SQS_RETRY_COUNT
         while retry > 0:
             resp = queue.send_messages(Entries=batch)
             sent += len(resp['Successful'])
@@ -97,22 +103,352 @@ def handler(args, context):
     return sent
 
 
+def create_batches(msgs):
+    """Group messages into send_message_batch entries
+
+    Args:
+        msgs (iterator): Iterator of message bodies
+
+    Returns:
+        generator: Lists of up to SQS_BATCH_SIZE entries
+    """
+    while True:
+        batch = []
+        for i in range(SQS_BATCH_SIZE):
+            try:
+                batch.append({
+                    'Id': str(i),
+                    'MessageBody': next(msgs),
+                    'DelaySeconds': 0
+                })
+            except StopIteration:
+                break
+
+        if len(batch) == 0:
+            return
+
+        yield batch
+
+
+def send_messages_concurrently(client, queue_url, msgs, context=None, max_in_flight=8):
+    """Send messages with several batches in flight at once
+
+    All worker threads share the given SQS client. No new batches are started
+    once the lambda is within DEADLINE_MARGIN of its timeout, but batches
+    already in flight are allowed to finish. Because every started batch
+    either completes or raises, the returned count always covers a continuous
+    run of messages from the start of msgs.
+
+    Args:
+        client: Boto3 SQS client
+        queue_url (str): URL of the queue to send the messages to
+        msgs (iterator): Iterator of message bodies
+        context: Lambda context object, used to find the remaining execution time
+        max_in_flight (int): Maximum number of batches being sent at once
+
+    Returns:
+        int: Number of messages put into the queue
+
+    Raises:
+        FailedToSendMessages: If a batch could not be completely sent
+    """
+    def time_left():
+        if context is None:
+            return True
+        return context.get_remaining_time_in_millis() > DEADLINE_MARGIN
+
+    sent = 0
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        batches = create_batches(msgs)
+        while time_left():
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                sent += sum(f.result() for f in done)
+                continue
+
+            batch = next(batches, None)
+            if batch is None:
+                break
+
+            in_flight.add(executor.submit(send_batch, client, queue_url, batch))
+        else:
+            print("Approaching lambda timeout, not starting any new batches")
+
+        done, _ = wait(in_flight)
+        sent += sum(f.result() for f in done)
+
+    return sent
+
+
+def send_batch(client, queue_url, batch):
+    """Send a batch of messages, retrying entries that failed
+
+    Each entry keeps its own retry count and the delay before resending
+    grows exponentially with the number of times the entries have failed.
+
+    Args:
+        client: Boto3 SQS client
+        queue_url (str): URL of the queue to send the messages to
+        batch (list): List of send_message_batch entries
+
+    Returns:
+        int: Number of messages put into the queue
+
+    Raises:
+        FailedToSendMessages: If an entry failed because of a sender fault or
+                              ran out of retries
+    """
+    attempts = {entry['Id']: 0 for entry in batch}
+    sent = 0
+
+    while True:
+        resp = client.send_message_batch(QueueUrl=queue_url, Entries=batch)
+        sent += len(resp.get('Successful', []))
+
+        failed = resp.get('Failed', [])
+        if len(failed) == 0:
+            return sent
+
+        for f in failed:
+            attempts[f['Id']] += 1
+            if f.get('SenderFault') or attempts[f['Id']] > SQS_RETRY_COUNT:
+                print("Could not enqueue messages: {}".format(failed))
+                raise FailedToSendMessages(failed) # SFN will relaunch the activity
+
+        ids = [f['Id'] for f in failed]
+        batch = [b for b in batch if b['Id'] in ids]
+
+        attempt = max(attempts[id_] for id_ in ids)
+        delay = min(SQS_RETRY_TIMEOUT, SQS_BACKOFF_BASE * 2 ** attempt)
+        time.sleep(random.uniform(delay / 2, delay))
+
+
+def tile_dimensions(args):
+    """Number of tiles along each dimension of the ingest job
+
+    Note: Z is counted in individual tiles, which are grouped into chunks
+          of z_chunk_size tiles, with the final chunk possibly being partial
+
+    Args:
+        args (dict): Same arguments as handler()
+
+    Returns:
+        tuple[int, int, int, int]: Number of tiles in T, Z, Y, X
+    """
+    factor = lambda v: math.ceil((args[v + '_stop'] - args[v + '_start']) / args[v + '_tile_size'])
+    return (factor('t'), args['z_stop'] - args['z_start'], factor('y'), factor('x'))
+
+
+def tile_count(args):
+    """Total number of tiles in the ingest job
+
+    Args:
+        args (dict): Same arguments as handler()
+
+    Returns:
+        int: Number of tiles (messages) for the whole job
+    """
+    t, z, y, x = tile_dimensions(args)
+    return t * z * y * x
+
+
+def plan_shards(args, num_lambdas, max_items=None):
+    """Split the ingest job into even shards for parallel lambdas
+
+    Each shard is described by the items_to_skip and MAX_NUM_ITEMS_PER_LAMBDA
+    values to pass to a lambda so that together the lambdas enqueue every
+    tile exactly once. Shard sizes differ by at most one tile. Because
+    create_messages() can start at any linear tile index the shards do not
+    need to line up with the (possibly partial) final Z chunk.
+
+    Args:
+        args (dict): Same arguments as handler(), items_to_skip and
+                     MAX_NUM_ITEMS_PER_LAMBDA are ignored
+        num_lambdas (int): Number of lambdas to split the job between
+        max_items (optional[int]): Maximum number of tiles for a single lambda,
+                                   if needed more than num_lambdas shards are created
+
+    Returns:
+        tuple[int, list[tuple[int, int]]]: Total number of tiles and a list of
+                                           (items_to_skip, count) tuples
+    """
+    total = tile_count(args)
+
+    if max_items is not None:
+        num_lambdas = max(num_lambdas, math.ceil(total / max_items))
+    num_lambdas = max(1, min(num_lambdas, total))
+
+    size, extra = divmod(total, num_lambdas)
+    shards = []
+    skip = 0
+    for i in range(num_lambdas):
+        count = size + (1 if i < extra else 0)
+        if count > 0:
+            shards.append((skip, count))
+        skip += count
+
+    return total, shards
+
+
+def tile_index(args, index):
+    """Convert a linear tile index into per dimension indices
+
+    Tiles are ordered by T, Z chunk, Y, X, and then the tile within the
+    Z chunk. Every Z chunk except the last contains z_chunk_size tiles.
+
+    Args:
+        args (dict): Same arguments as handler()
+        index (int): Linear index of the tile within the message stream
+
+    Returns:
+        tuple[int, int, int, int, int]: Index of the T, Z chunk, Y, X, and
+                                        the tile's offset within the Z chunk
+    """
+    _, nz, ny, nx = tile_dimensions(args)
+    chunk = args['z_chunk_size']
+
+    ti, rem = divmod(index, nz * ny * nx)
+    zi, rem = divmod(rem, chunk * ny * nx)
+    num_tiles = min(chunk, nz - zi * chunk)
+    yi, rem = divmod(rem, num_tiles * nx)
+    xi, offset = divmod(rem, num_tiles)
+
+    return (ti, zi, yi, xi, offset)
+
+
+def tile_coordinate(args, index):
+    """Convert a linear tile index into the tile's coordinate
+
+    Args:
+        args (dict): Same arguments as handler()
+        index (int): Linear index of the tile within the message stream
+
+    Returns:
+        tuple[int, int, int, int, int]: Tile's t, z chunk start, y, x, and tile (z)
+    """
+    ti, zi, yi, xi, offset = tile_index(args, index)
+    z = args['z_start'] + zi * args['z_chunk_size']
+    return (args['t_start'] + ti * args['t_tile_size'],
+            z,
+            args['y_start'] + yi * args['y_tile_size'],
+            args['x_start'] + xi * args['x_tile_size'],
+            z + offset)
+
+
+def tile_coordinate_blocks(args, start, stop, block_size=65536):
+    """Vectorized version of tile_coordinate for a range of linear indices
+
+    Note: Requires NumPy, which is not part of the Lambda runtime
+
+    Args:
+        args (dict): Same arguments as handler()
+        start (int): First linear tile index
+        stop (int): Linear tile index to stop before
+        block_size (int): Maximum number of coordinates per block
+
+    Returns:
+        generator: NumPy int64 arrays of shape (N, 5) with columns
+                   t, z chunk start, y, x, and tile (z)
+    """
+    import numpy as np
+
+    _, nz, ny, nx = tile_dimensions(args)
+    chunk = args['z_chunk_size']
+
+    for block_start in range(start, stop, block_size):
+        index = np.arange(block_start, min(block_start + block_size, stop), dtype=np.int64)
+
+        ti, rem = np.divmod(index, nz * ny * nx)
+        zi, rem = np.divmod(rem, chunk * ny * nx)
+        num_tiles = np.minimum(chunk, nz - zi * chunk)
+        yi, rem = np.divmod(rem, num_tiles * nx)
+        xi, offset = np.divmod(rem, num_tiles)
+
+        block = np.empty((len(index), 5), dtype=np.int64)
+        block[:, 0] = args['t_start'] + ti * args['t_tile_size']
+        block[:, 1] = args['z_start'] + zi * chunk
+        block[:, 2] = args['y_start'] + yi * args['y_tile_size']
+        block[:, 3] = args['x_start'] + xi * args['x_tile_size']
+        block[:, 4] = block[:, 1] + offset
+        yield block
+
+
+def chunk_ranges(args, start, stop):
+    """Walk the chunks that contain the given range of linear tile indices
+
+    The starting position is computed directly from start and then each
+    following chunk is reached by incrementing the X, Y, Z chunk, and T
+    indices, instead of visiting every tile.
+
+    Args:
+        args (dict): Same arguments as handler()
+        start (int): First linear tile index
+        stop (int): Linear tile index to stop before
+
+    Returns:
+        generator: Tuples of (t, z, y, x, num_tiles, first, last) where
+                   z is the start of the Z chunk, num_tiles is the number
+                   of tiles in the Z chunk, and first / last are the offsets
+                   within the Z chunk of the tiles in the range
+    """
+    _, nz, ny, nx = tile_dimensions(args)
+    chunk = args['z_chunk_size']
+
+    ti, zi, yi, xi, offset = tile_index(args, start)
+    remaining = stop - start
+    while remaining > 0:
+        num_tiles = min(chunk, nz - zi * chunk)
+        count = min(num_tiles - offset, remaining)
+
+        yield (args['t_start'] + ti * args['t_tile_size'],
+               args['z_start'] + zi * chunk,
+               args['y_start'] + yi * args['y_tile_size'],
+               args['x_start'] + xi * args['x_tile_size'],
+               num_tiles,
+               offset,
+               offset + count)
+
+        remaining -= count
+        offset = 0
+
+        xi += 1
+        if xi == nx:
+            xi = 0
+            yi += 1
+            if yi == ny:
+                yi = 0
+                zi += 1
+                if zi * chunk >= nz:
+                    zi = 0
+                    ti += 1
+
+
 def create_messages(args):
     """Create all of the tile messages to be enqueued
 
+    Creates messages for up to MAX_NUM_ITEMS_PER_LAMBDA tiles, starting
+    items_to_skip tiles into the job.
+
     Args:
-        args (dict): Same arguments as populate_upload_queue()
+        args (dict): Same arguments as handler()
 
     Returns:
-        list: List of strings containing Json data
+        generator: Strings containing Json data
     """
 
-    # tile_size = lambda v: args[v + "_tile_size"]
-    # range_ = lambda v: range(args[v + '_start'], args[v + '_stop'], tile_size(v))
-
     # DP NOTE: generic version of
     # BossBackend.encode_chunk_key and BiossBackend.encode.tile_key
     # from ingest-client/ingestclient/core/backend.py
+    # The MD5 of the constant key prefix is reused for every tile key
+    # and the Json escaped version of the prefix is computed once
+    tile_prefix = '&'.join(map(str, [args['project_info'][0],
+                                     args['project_info'][1],
+                                     args['project_info'][2],
+                                     args['resolution']])) + '&'
+    tile_md5 = hashlib.md5(tile_prefix.encode())
+    tile_prefix = json.dumps(tile_prefix)[1:-1]
+
     def hashed_key(*args):
         base = '&'.join(map(str,args))
 
@@ -120,149 +456,38 @@ def create_messages(args):
         md5.update(base.encode())
         digest = md5.hexdigest()
 
-        return '&'.join([digest, base])
-
-
-    tile_size = lambda v: args[v + "_tile_size"]
-    
-    # CF  New algorithm follows
-
-    #  Goal is to PRE-COMPUTE the new starting values for T Z Y X , given # of tiles to skip
-    #  Having the starting values will be more efficient than iterating for every TZYX
-
-    # Tns:  T's new start position
-    # Zns:  Z's new start position
-    # Yns:  Y's new start position
-    # Xns:  X's new start position
-
-    #########################
-    # 
-    #  First, Let's create some Helper lambda functions 
-    #
-
-    # range helper function for X and Y dimensions
-    new_range = lambda v, vns, First : range(vns, args[v + '_stop'] , args[v + '_tile_size']) if First else range(args[v + '_start'], args[v + '_stop'] , args[v + '_tile_size'])
-    # range helper function for Z dimension
-    new_range_z = lambda zns, First : range(zns, args['z_stop'] , args['z_chunk_size']) if First else range(args['z_start'], args['z_stop'] , args['z_chunk_size'])
-    # range helper function for tiles
-    new_range_tile = lambda t2s,z,First,nt : range(z + t2s, z + nt) if First else range(z, z + nt)
-
-    # generic helper lambda func factoring tile_size (use ceiling)
-    factor_ = lambda v: math.ceil((args[v + '_stop'] - args[v + '_start']) / args[v + '_tile_size'])
-
-    # new start helper func (for tile_size cases)
-    ns = lambda v,n: args[v + '_start'] + args[v + '_tile_size'] * n
-    # new start helper func for special case Z (which uses chunk_size)
-    ns_z = lambda v,n: args[v + '_start'] + args[v + '_chunk_size'] * n
-
-    ##########################
-    #
-    # Now Let's start the actual calculations to compute the new ( Tns Znz Yns Xns ) values 
-    #
-
-    # first, factor in  (x, y, z dimensions)
-    Xf = factor_('x')
-    Yf = factor_('y')
-    Zf = args['z_stop'] - args['z_start']
-
-    # counter to keep track of # tiles to skip, used decrementally throughout the rest of the calcs below
-    items_to_skip = args['items_to_skip']
-
-    ############### T
-    # T pos, factoring in X, Y, Z
-    Tk = int(items_to_skip/(Xf*Yf*Zf))
-    #compute T's new start
-    Tns = ns('t',Tk)
-    #decr tiles to skip
-    items_to_skip -= Tk*Xf*Yf*Zf
-
-    ############### Z
-    # Z pos, factoring in X, Y
-    Zk = int(items_to_skip/(args['z_chunk_size']*Xf*Yf))
-    # compute Z's new start
-    Zns = ns_z('z',Zk)
-    # decr tiles to skip
-    items_to_skip -= Zk*args['z_chunk_size']*Xf*Yf
-
-    #set the number of tiles (to be used for X and Y calculations)
-    num_tiles = min(args['z_chunk_size'], args['z_stop'] - Zns)
-
-    ############### Y
-    # Y pos, factoring in X
-    Yk = int(items_to_skip/(num_tiles*Xf))
-    # compute Y's new start pos
-    Yns = ns('y',Yk)
-    # decr tiles to skip
-    items_to_skip -= Yk*num_tiles*Xf
-
-    ############### X
-    # X pos, factoring in num tiles
-    Xk = int(items_to_skip/num_tiles)
-    # compute X's new start pos
-    Xns = ns('x',Xk)
-    # decr tiles to skip
-    items_to_skip -= Xk*num_tiles
-
-
-    #######################################
-    # 
-    #  Now that we've computed the new start values (Tns, Zns, Yns, Xns) and the items_to_skip,
-    # ... let's begin our "efficient" LOOPING! 
-    #
-
-    #first, initialize vars 
-    num = 0 
-    bFirst = True
-    count_in_offset = 0    
-
-    for t in new_range('t', Tns, bFirst):
-        for z in new_range_z(Zns, bFirst):
-            #Factor in Z chunk size
-            num_of_tiles = min(args['z_chunk_size'], args['z_stop'] - z)
-
-            for y in new_range('y', Yns, bFirst):
-                for x in new_range('x', Xns, bFirst):
-
-                    for tile in new_range_tile(items_to_skip, z, bFirst, num_of_tiles):
-                        if bFirst:
-                            bFirst = False
-                        num += 1
-
-                        if count_in_offset == 0:
-                            print(" **** FINISHED SKIPPING tiles *** \n")
-
-                        chunk_x = int(x / tile_size('x'))
-                        chunk_y = int(y / tile_size('y'))
-                        chunk_z = int(z / args['z_chunk_size'])
-                        chunk_key = hashed_key(num_of_tiles,
-                                                args['project_info'][0],
-                                                args['project_info'][1],
-                                                args['project_info'][2],
-                                                args['resolution'],
-                                                chunk_x,
-                                                chunk_y,
-                                                chunk_z,
-                                                t)
-
-                        count_in_offset += 1
-                        if count_in_offset > args['MAX_NUM_ITEMS_PER_LAMBDA']:
-                            return  # end the generator
-
-                        tile_key = hashed_key(args['project_info'][0],
-                                                args['project_info'][1],
-                                                args['project_info'][2],
-                                                args['resolution'],
-                                                chunk_x,
-                                                chunk_y,
-                                                tile,
-                                                t)
-
-                        msg = {
-                            'job_id': args['job_id'],
-                            'upload_queue_arn': args['upload_queue'],
-                            'ingest_queue_arn': args['ingest_queue'],
-                            'chunk_key': chunk_key,
-                            'tile_key': tile_key,
-                        }
-
-                        yield json.dumps(msg)
+        return json.dumps('&'.join([digest, base]))
+
+    # Json encoded message, minus the closing brace, to append keys to
+    msg_prefix = json.dumps({
+        'job_id': args['job_id'],
+        'upload_queue_arn': args['upload_queue'],
+        'ingest_queue_arn': args['ingest_queue'],
+    })[:-1] + ', "chunk_key": '
+
+    start = args['items_to_skip']
+    stop = min(start + args['MAX_NUM_ITEMS_PER_LAMBDA'], tile_count(args))
+    print("Creating messages for tiles {} to {}".format(start, stop))
+
+    for t, z, y, x, num_tiles, first, last in chunk_ranges(args, start, stop):
+        chunk_x = x // args['x_tile_size']
+        chunk_y = y // args['y_tile_size']
+        chunk_z = z // args['z_chunk_size']
+        chunk_key = hashed_key(num_tiles,
+                               args['project_info'][0],
+                               args['project_info'][1],
+                               args['project_info'][2],
+                               args['resolution'],
+                               chunk_x,
+                               chunk_y,
+                               chunk_z,
+                               t)
+
+        prefix = msg_prefix + chunk_key + ', "tile_key": "'
+        for tile in range(z + first, z + last):
+            suffix = '{}&{}&{}&{}'.format(chunk_x, chunk_y, tile, t)
+
+            md5 = tile_md5.copy()
+            md5.update(suffix.encode())
+
+            yield prefix + md5.hexdigest() + '&' + tile_prefix + suffix + '"}'
@@ -0,0 +1,64 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of the ingest upload queue message generators
+
+Compares the messages per second of ingest_queue_upload.create_messages()
+against the original nested loop generator kept in the unit tests.
+
+Run from this directory: python3 benchmark_ingest_queue_upload.py
+"""
+
+import contextlib
+import io
+import time
+
+import ingest_queue_upload as iqu
+from test_ingest_queue_upload import create_expected_messages
+
+ARGS = {
+    "ingest_queue": "https://queue.amazonaws.com/...",
+    "upload_queue": "https://queue.amazonaws.com/...",
+    "job_id": 11,
+    "project_info": ["3", "3", "3"],
+    "resolution": 0,
+    "t_start": 0, "t_stop": 1, "t_tile_size": 1,
+    "z_start": 0, "z_stop": 100, "z_tile_size": 1,
+    "y_start": 0, "y_stop": 10240, "y_tile_size": 512,
+    "x_start": 0, "x_stop": 10240, "x_tile_size": 512,
+    "z_chunk_size": 16,
+    "items_to_skip": 0,
+    "MAX_NUM_ITEMS_PER_LAMBDA": 20000,
+}
+
+def rate(generator, args, repeat=3):
+    """Best messages per second out of `repeat` runs"""
+    best = 0
+    for _ in range(repeat):
+        # Silence the generators' progress output
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            count = sum(1 for _ in generator(args))
+            elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+    return best
+
+if __name__ == '__main__':
+    original = rate(create_expected_messages, ARGS)
+    current = rate(iqu.create_messages, ARGS)
+
+    print("Messages per lambda: {}".format(ARGS['MAX_NUM_ITEMS_PER_LAMBDA']))
+    print("Nested loop generator: {:>10.0f} msgs/sec".format(original))
+    print("create_messages():     {:>10.0f} msgs/sec".format(current))
+    print("Speedup:               {:>10.2f}x".format(current / original))
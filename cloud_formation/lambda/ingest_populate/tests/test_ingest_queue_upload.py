@@ -20,7 +20,10 @@ import ingest_queue_upload as iqu
 import hashlib
 import json
 import math
+import random
+import threading
 import unittest
+from unittest.mock import MagicMock, patch
 
 class TestIngestQueueUploadLambda(unittest.TestCase):
 
@@ -120,6 +123,65 @@ class TestIngestQueueUploadLambda(unittest.TestCase):
                                 # Verify set has no left over tiles.
                                 self.assertEqual(len(msg_set_copy), 0)
 
+    def test_same_message_stream_for_any_skip(self):
+        """
+        Verify that for every possible items_to_skip value create_messages()
+        produces exactly the same strings, in the same order, as the slice of
+        the message stream created by the original nested loop implementation.
+        """
+        rand = random.Random(1138)
+        for args in stream_args():
+            expected = list(create_expected_messages(args))
+            total = len(expected)
+            self.assertEqual(iqu.tile_count(args), total)
+
+            for skip in range(total):
+                count = rand.randint(1, total)
+                with self.subTest(args=args, skip=skip, count=count):
+                    skip_args = dict(args, items_to_skip=skip, MAX_NUM_ITEMS_PER_LAMBDA=count)
+                    actual = list(iqu.create_messages(skip_args))
+                    self.assertEqual(actual, expected[skip:skip + count])
+
+    def test_plan_shards(self):
+        for args in stream_args():
+            expected = list(create_expected_messages(args))
+
+            for num_lambdas in [1, 3, 7, len(expected) + 5]:
+                with self.subTest(args=args, num_lambdas=num_lambdas):
+                    total, shards = iqu.plan_shards(args, num_lambdas)
+                    self.assertEqual(total, len(expected))
+                    self.assertEqual(len(shards), min(num_lambdas, total))
+
+                    counts = [count for _, count in shards]
+                    self.assertLessEqual(max(counts) - min(counts), 1)
+
+                    actual = []
+                    for skip, count in shards:
+                        shard_args = dict(args, items_to_skip=skip, MAX_NUM_ITEMS_PER_LAMBDA=count)
+                        actual.extend(iqu.create_messages(shard_args))
+                    self.assertEqual(actual, expected)
+
+    def test_plan_shards_max_items(self):
+        args = next(stream_args())
+        total, shards = iqu.plan_shards(args, 2, max_items=5)
+
+        self.assertEqual(len(shards), math.ceil(total / 5))
+        self.assertTrue(all(count <= 5 for _, count in shards))
+        self.assertEqual(sum(count for _, count in shards), total)
+
+    def test_tile_coordinate_blocks(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("NumPy not installed")
+
+        for args in stream_args():
+            total = iqu.tile_count(args)
+            expected = [iqu.tile_coordinate(args, i) for i in range(3, total)]
+            blocks = iqu.tile_coordinate_blocks(args, 3, total, block_size=7)
+            actual = [tuple(row) for block in blocks for row in block.tolist()]
+            self.assertEqual(actual, expected)
+
     def generate_chunk_tile_key(self, msg_json):
         """
         Generate a key to track messages for testing.
@@ -138,6 +200,114 @@ class TestIngestQueueUploadLambda(unittest.TestCase):
         return "{} --- {}".format(chunk, tile)
 
 
+def stream_args():
+    """Small ingest jobs, with partial tiles and Z chunks and non zero starts"""
+    base = {
+        "ingest_queue": "https://queue.amazonaws.com/...",
+        "upload_queue": "https://queue.amazonaws.com/...",
+        "job_id": 11,
+        "project_info": ["3", "4", "5"],
+        "resolution": 0,
+        "x_tile_size": 512,
+        "y_tile_size": 512,
+        "t_tile_size": 1,
+        "z_tile_size": 1,
+        "z_chunk_size": 4,
+        "items_to_skip": 0,
+        "MAX_NUM_ITEMS_PER_LAMBDA": 500000,
+    }
+
+    for t_start, t_stop in [(0, 1), (2, 4)]:
+        for z_start, z_stop in [(0, 8), (3, 13)]:
+            for x_start, x_stop in [(0, 1024), (512, 2000)]:
+                yield dict(base,
+                           t_start=t_start, t_stop=t_stop,
+                           z_start=z_start, z_stop=z_stop,
+                           y_start=0, y_stop=1100,
+                           x_start=x_start, x_stop=x_stop)
+
+
+class FakeSQSClient(object):
+    """Thread safe stand in for the SQS client's send_message_batch
+
+    Args:
+        fail (dict): Mapping of message body to the number of times sending
+                     it should fail before succeeding
+        sender_fault (bool): If failures should be marked as sender faults
+    """
+    def __init__(self, fail={}, sender_fault=False):
+        self.fail = dict(fail)
+        self.sender_fault = sender_fault
+        self.bodies = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        resp = {'Successful': [], 'Failed': []}
+        with self.lock:
+            self.calls += 1
+            for entry in Entries:
+                if self.fail.get(entry['MessageBody'], 0) > 0:
+                    self.fail[entry['MessageBody']] -= 1
+                    resp['Failed'].append({'Id': entry['Id'],
+                                           'SenderFault': self.sender_fault,
+                                           'Code': 'InternalError'})
+                else:
+                    self.bodies.append(entry['MessageBody'])
+                    resp['Successful'].append({'Id': entry['Id']})
+        return resp
+
+
+@patch.object(iqu.time, 'sleep')
+class TestSendMessagesConcurrently(unittest.TestCase):
+
+    def msgs(self, count):
+        return ('msg{}'.format(i) for i in range(count))
+
+    def test_all_messages_sent(self, sleep):
+        client = FakeSQSClient()
+        sent = iqu.send_messages_concurrently(client, 'url', self.msgs(95), max_in_flight=4)
+
+        self.assertEqual(sent, 95)
+        self.assertEqual(client.calls, 10)
+        self.assertEqual(sorted(client.bodies), sorted(self.msgs(95)))
+        sleep.assert_not_called()
+
+    def test_failed_entries_retried(self, sleep):
+        client = FakeSQSClient(fail={'msg3': 2, 'msg17': 1})
+        sent = iqu.send_messages_concurrently(client, 'url', self.msgs(30), max_in_flight=3)
+
+        self.assertEqual(sent, 30)
+        self.assertEqual(sorted(client.bodies), sorted(self.msgs(30)))
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_retries_exhausted(self, sleep):
+        client = FakeSQSClient(fail={'msg5': iqu.SQS_RETRY_COUNT + 1})
+        with self.assertRaises(iqu.FailedToSendMessages):
+            iqu.send_messages_concurrently(client, 'url', self.msgs(30), max_in_flight=3)
+
+    def test_sender_fault_not_retried(self, sleep):
+        client = FakeSQSClient(fail={'msg5': 1}, sender_fault=True)
+        with self.assertRaises(iqu.FailedToSendMessages):
+            iqu.send_messages_concurrently(client, 'url', self.msgs(10), max_in_flight=3)
+        sleep.assert_not_called()
+
+    def test_stops_before_deadline(self, sleep):
+        client = FakeSQSClient()
+        context = MagicMock()
+        remaining = [iqu.DEADLINE_MARGIN + 1] * 4 + [iqu.DEADLINE_MARGIN]
+        context.get_remaining_time_in_millis.side_effect = remaining
+
+        msgs = self.msgs(100)
+        sent = iqu.send_messages_concurrently(client, 'url', msgs, context, max_in_flight=8)
+
+        # Sent messages are the start of the stream, so the next lambda
+        # can continue by skipping the returned count
+        self.assertEqual(sent, 40)
+        self.assertEqual(sorted(client.bodies), sorted(self.msgs(40)))
+        self.assertEqual(next(msgs), 'msg40')
+
+
 def create_expected_messages(args):
     """Create all of the expected tile messages to be enqueued
 
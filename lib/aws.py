@@ -26,6 +26,15 @@ import time
 import json
 import re
 import sys
+import csv
+import copy
+import queue
+import base64
+import decimal
+import threading
+import functools
+
+from boto3.dynamodb.types import TypeDeserializer, Binary
 
 from . import hosts
 from .utils import deprecated
@@ -39,6 +48,8 @@ def get_all(to_wrap, key):
                 (Filters=[...])
         items # => List of Reservations returned by describe_instances
 
+    Note: Use iter_all() if not all of the results are needed
+
     Args:
         to_wrap (method): AWS client method to execute to get results
         key (str): The dictionary key in the `to_wrap` response where results
@@ -51,17 +62,275 @@ def get_all(to_wrap, key):
                   response from AWS
     """
     def wrapper(*args, **kwargs):
-        rtn = []
+        return list(iter_all(to_wrap, key)(*args, **kwargs))
+    return wrapper
+
+def iter_all(to_wrap, key, page_size=None, page_size_key='MaxResults',
+             token='NextToken', next_token=None):
+    """Utility helper method for lazily iterating over all results from AWS
+
+    The next page of results is only requested once the caller has consumed
+    the current page, so stopping iteration early (e.g. returning the first
+    match) doesn't request the remaining pages.
+
+    Usage:
+        items = iter_all(session.client('ec2').describe_instances, 'Reservations',
+                         page_size=100)(Filters=[...])
+        for item in items: # => Reservations returned by describe_instances
+            ...
+
+    Args:
+        to_wrap (method): AWS client method to execute to get results
+        key (str): The dictionary key in the `to_wrap` response where results
+                   are stored
+        page_size (optional[int]): Maximum number of results AWS should return
+                                   per call, if not given the AWS default is used
+        page_size_key (str): The `to_wrap` argument that takes the page size
+        token (str): The `to_wrap` argument that takes the pagination token
+        next_token (optional[str]): The dictionary key in the `to_wrap` response where
+                                    the pagination token is stored, defaults to `token`
+
+    Returns:
+        function: Function that takes arguments for `to_wrap` and returns a generator
+                  that yields the values that were stored under `key` in each of
+                  the responses from AWS
+    """
+    if next_token is None:
+        next_token = token
+
+    def wrapper(*args, **kwargs):
+        if page_size is not None:
+            kwargs[page_size_key] = page_size
+
         while True:
             resp = to_wrap(*args, **kwargs)
-            rtn.extend(resp[key])
+            yield from resp[key]
+
+            if resp.get(next_token) is not None:
+                kwargs[token] = resp[next_token]
+            else:
+                return
+    return wrapper
+
+class LookupCache(object):
+    """Cache of AWS lookup results, with a time to live for each result
+
+    One cache is attached to each Boto3 session (and so each BossConfiguration)
+    by lookup_cache(). Results can be cached one at a time by the @cached
+    decorator or in bulk by lookups that can load related results with the
+    same API call.
+
+    Attributes:
+        ttl (int): Number of seconds a cached result is valid for
+        entries (dict): Mapping of (lookup name, args) to (expiration, result)
+        hits (int): Number of lookups answered from the cache (API calls saved)
+        misses (int): Number of lookups that had to call AWS
+    """
 
-            if 'NextToken' in resp and resp['NextToken'] is not None:
-                kwargs['NextToken'] = resp['NextToken']
+    TTL = 600
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get a cached result
+
+        Args:
+            key (tuple): Tuple of (lookup name, *args)
+
+        Returns:
+            tuple[bool, object]: If the key was cached and the cached result
+        """
+        with self.lock:
+            expiration, result = self.entries.get(key, (None, None))
+            if expiration is None or expiration < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            return True, result
+
+    def put(self, key, result, ttl=None):
+        """Cache a lookup result
+
+        Args:
+            key (tuple): Tuple of (lookup name, *args)
+            result (object): Lookup result
+            ttl (optional[int]): Number of seconds the result is valid for,
+                                 if different from the cache's ttl
+        """
+        with self.lock:
+            ttl = self.ttl if ttl is None else ttl
+            self.entries[key] = (time.monotonic() + ttl, result)
+
+    def invalidate(self, name=None):
+        """Remove cached results
+
+        Args:
+            name (optional[str]): Name of the lookup to remove the results of,
+                                  if not given all results are removed
+        """
+        with self.lock:
+            if name is None:
+                self.entries.clear()
             else:
-                return rtn
+                for key in list(self.entries.keys()):
+                    if key[0] == name:
+                        del self.entries[key]
+
+    def reset_stats(self):
+        """Reset the hit and miss counters
+
+        Returns:
+            tuple[int, int]: The hits and misses before the reset
+        """
+        with self.lock:
+            stats = (self.hits, self.misses)
+            self.hits = self.misses = 0
+            return stats
+
+def lookup_cache(session):
+    """Get the LookupCache attached to the given Boto3 session or BossConfiguration
+
+    Returns:
+        LookupCache|None: The cache or None if session is None
+    """
+    session = getattr(session, 'session', session) # Handle BossConfiguration
+    if session is None:
+        return None
+
+    cache = getattr(session, 'boss_lookup_cache', None)
+    if not isinstance(cache, LookupCache):
+        cache = session.boss_lookup_cache = LookupCache()
+    return cache
+
+def invalidate_lookups(session):
+    """Remove all cached lookup results, used after resources are created or deleted
+
+    Args:
+        session (Session|BossConfiguration): Session the cache is attached to
+    """
+    cache = lookup_cache(session)
+    if cache is not None:
+        cache.invalidate()
+
+def cached(lookup):
+    """Decorator that caches the results of a lookup function
+
+    The first argument of the lookup must be the Boto3 session or the
+    BossConfiguration, which the cache is attached to. The remaining
+    arguments form the cache key. None results are not cached, so that
+    resources that don't exist yet are looked up again.
+    """
+    @functools.wraps(lookup)
+    def wrapper(session, *args, **kwargs):
+        cache = lookup_cache(session)
+        if cache is None:
+            return lookup(session, *args, **kwargs)
+
+        key = (lookup.__name__, *args, *sorted(kwargs.items()))
+        found, result = cache.get(key)
+        if not found:
+            result = lookup(session, *args, **kwargs)
+            if result is not None:
+                cache.put(key, result)
+
+        # Prevent the caller from modifying the cached value
+        return copy.copy(result)
     return wrapper
 
+# Number of seconds machine_lookup_bulk() results are cached for. Shorter
+# than other lookups, as instances are replaced by auto scale groups
+MACHINE_LOOKUP_TTL = 60
+
+# Maximum number of values in a single describe_instances filter
+MACHINE_LOOKUP_BATCH = 200
+
+def _split_index(hostname):
+    """Split a '#.hostname' into (#, hostname), or (None, hostname) if there is no index"""
+    try:
+        idx, target = hostname.split('.', 1)
+        return int(idx), target # if it is not a valid number, then it is a hostname
+    except:
+        return None, hostname
+
+def machine_lookup_bulk(session, hostnames):
+    """Lookup the instances for many AWS instance names at once.
+
+    All of the hostnames are resolved with one describe_instances call (per
+    MACHINE_LOOKUP_BATCH hostnames) filtering on all of the names. Results are
+    cached on the session for MACHINE_LOOKUP_TTL seconds, so hostnames that
+    were already resolved are not looked up again.
+
+    To select a specific instance of a hostname with multiple instances,
+    prepend the hostname with "#." where '#' is the zero based index.
+        Example: 0.auth.integration.boss
+
+    Only running instances are returned, sorted by InstanceId.
+
+    Args:
+        session (Session) : Active Boto3 session
+        hostnames (list[string]) : Hostnames of the EC2 instances
+
+    Returns:
+        (dict) : Dictionary of hostname and list of tuples of (instance id,
+                 private IP, public IP) for the instances with that name.
+                 IPs are None if the instance doesn't have that address
+    """
+    cache = lookup_cache(session)
+
+    found = {}
+    missing = set()
+    for hostname in hostnames:
+        _, target = _split_index(hostname)
+        if target in found or target in missing:
+            continue
+
+        if cache is not None:
+            hit, instances = cache.get(('machine_lookup_bulk', target))
+            if hit:
+                found[target] = instances
+                continue
+        missing.add(target)
+
+    missing = sorted(missing)
+    client = session.client('ec2')
+    for i in range(0, len(missing), MACHINE_LOOKUP_BATCH):
+        batch = missing[i:i + MACHINE_LOOKUP_BATCH]
+        for target in batch:
+            found[target] = []
+
+        reservations = iter_all(client.describe_instances, 'Reservations', page_size=1000) \
+                               (Filters=[{"Name":"tag:Name", "Values":batch},
+                                         {"Name":"instance-state-name", "Values":["running"]}])
+        for reservation in reservations:
+            for instance in reservation['Instances']:
+                name = _find(instance.get('Tags', []), lambda x: x['Key'] == 'Name')
+                if name is None or name['Value'] not in found:
+                    continue
+                found[name['Value']].append((instance['InstanceId'],
+                                             instance.get('PrivateIpAddress'),
+                                             instance.get('PublicIpAddress')))
+
+        for target in batch:
+            found[target].sort()
+            if cache is not None:
+                cache.put(('machine_lookup_bulk', target), found[target], MACHINE_LOOKUP_TTL)
+
+    rtn = {}
+    for hostname in hostnames:
+        idx, target = _split_index(hostname)
+        instances = found[target]
+        if idx is not None:
+            instances = instances[idx:idx + 1]
+        rtn[hostname] = list(instances)
+    return rtn
+
 def machine_lookup_all(session, hostname, public_ip = True):
     """Lookup all of the IP addresses for a given AWS instance name.
 
@@ -77,19 +346,13 @@ def machine_lookup_all(session, hostname, public_ip = True):
     Returns:
         (list) : List of IP addresses
     """
-    client = session.client('ec2')
-    items = get_all(client.describe_instances, 'Reservations') \
-                    (Filters=[{"Name":"tag:Name", "Values":[hostname]},
-                              {"Name":"instance-state-name", "Values":["running"]}])
+    instances = machine_lookup_bulk(session, [hostname])[hostname]
 
     addresses = []
-    if len(items) > 0:
-        for i in items:
-            item = i['Instances'][0]
-            if 'PublicIpAddress' in item and public_ip:
-                addresses.append(item['PublicIpAddress'])
-            elif 'PrivateIpAddress' in item and not public_ip:
-                addresses.append(item['PrivateIpAddress'])
+    for id, private, public in instances:
+        address = public if public_ip else private
+        if address is not None:
+            addresses.append(address)
     return addresses
 
 def machine_lookup(session, hostname, public_ip = True):
@@ -111,37 +374,24 @@ def machine_lookup(session, hostname, public_ip = True):
     Returns:
         (string|None) : IP address or None if one could not be located.
     """
-
-    try:
-        idx, target = hostname.split('.', 1)
-        idx = int(idx) # if it is not a valid number, then it is a hostname
-        hostname = target
-    except:
+    idx, target = _split_index(hostname)
+    if idx is None:
         idx = 0
 
-    client = session.client('ec2')
-    item = get_all(client.describe_instances, 'Reservations') \
-                    (Filters=[{"Name":"tag:Name", "Values":[hostname]},
-                              {"Name":"instance-state-name", "Values":["running"]}])
+    instances = machine_lookup_bulk(session, [target])[target]
 
-    if len(item) == 0:
-        print("Could not find IP address for '{}'".format(hostname))
+    if len(instances) == 0:
+        print("Could not find IP address for '{}'".format(target))
+        return None
+    elif len(instances) <= idx:
+        print("Could not find IP address for '{}' index '{}'".format(target, idx))
         return None
     else:
-        item.sort(key = lambda i: i['Instances'][0]["InstanceId"])
-
-        if len(item) <= idx:
-            print("Could not find IP address for '{}' index '{}'".format(hostname, idx))
-            return None
-        else:
-            item = item[idx]['Instances'][0]
-            if 'PublicIpAddress' in item and public_ip:
-                return item['PublicIpAddress']
-            elif 'PrivateIpAddress' in item and not public_ip:
-                return item['PrivateIpAddress']
-            else:
-                print("Could not find IP address for '{}'".format(hostname))
-                return None
+        id, private, public = instances[idx]
+        address = public if public_ip else private
+        if address is None:
+            print("Could not find IP address for '{}'".format(target))
+        return address
 
 def rds_lookup(session, hostname):
     """Lookup the public DNS for a given AWS RDS instance name.
@@ -189,10 +439,11 @@ def asg_restart(session, hostname, timeout, callback=None):
     """
     client = session.client('ec2')
     resource = session.resource('ec2')
-    response = client.describe_instances(Filters=[{"Name":"tag:Name", "Values":[hostname]},
-                                                  {"Name":"instance-state-name", "Values":["running"]}])
+    reservations = iter_all(client.describe_instances, 'Reservations', page_size=1000) \
+                           (Filters=[{"Name":"tag:Name", "Values":[hostname]},
+                                     {"Name":"instance-state-name", "Values":["running"]}])
 
-    for reservation in response['Reservations']:
+    for reservation in reservations:
         for instance in reservation['Instances']:
             id = instance['InstanceId']
             print("Terminating {} instance {}".format(hostname, id))
@@ -218,17 +469,17 @@ def asg_name_lookup(session, hostname):
         return None
 
     client = session.client('autoscaling')
-    response = client.describe_auto_scaling_groups()
-    if len(response['AutoScalingGroups']) == 0:
-        return None
-    else:
-        # DP NOTE: Unfortunatly describe_auto_scaling_groups() doesn't allow filtering results
-        for g in response['AutoScalingGroups']:
-            t = _find(g['Tags'], lambda x: x['Key'] == 'Name')
-            if t and t['Value'] == hostname:
-                return g['AutoScalingGroupName']
-        return None
+    groups = iter_all(client.describe_auto_scaling_groups, 'AutoScalingGroups',
+                      page_size=100, page_size_key='MaxRecords')()
+
+    # DP NOTE: Unfortunatly describe_auto_scaling_groups() doesn't allow filtering results
+    for g in groups:
+        t = _find(g['Tags'], lambda x: x['Key'] == 'Name')
+        if t and t['Value'] == hostname:
+            return g['AutoScalingGroupName']
+    return None
 
+@cached
 def vpc_id_lookup(session, vpc_domain):
     """Lookup the Id for the VPC with the given domain name.
 
@@ -251,9 +502,14 @@ def vpc_id_lookup(session, vpc_domain):
         return response['Vpcs'][0]['VpcId']
 
 
+@cached
 def subnet_id_lookup(session, subnet_domain):
     """Lookup the Id for the Subnet with the given domain name.
 
+    Subnets are looked up using the subnet_index() of the VPC the subnet
+    belongs to, so that looking up the other subnets of the VPC doesn't
+    make additional API calls.
+
     Args:
         session (Session|None) : Boto3 session used to lookup information in AWS
 
@@ -266,6 +522,10 @@ def subnet_id_lookup(session, subnet_domain):
     if session is None:
         return None
 
+    if '.' in subnet_domain:
+        vpc_domain = subnet_domain.split('.', 1)[1]
+        return subnet_index(session, vpc_domain).get(subnet_domain)
+
     client = session.client('ec2')
     response = client.describe_subnets(Filters=[{"Name": "tag:Name", "Values": [subnet_domain]}])
     if len(response['Subnets']) == 0:
@@ -273,6 +533,35 @@ def subnet_id_lookup(session, subnet_domain):
     else:
         return response['Subnets'][0]['SubnetId']
 
+@cached
+def subnet_index(session, vpc_domain):
+    """Lookup the Ids of all Subnets named under the given VPC domain name.
+
+    All of the Subnets are loaded with a single (paginated) API call.
+
+    Args:
+        session (Session|None) : Boto3 session used to lookup information in AWS
+                                 If session is None no lookup is performed
+        vpc_domain (string) : Name of the VPC the Subnets belong to
+
+    Returns:
+        (dict|None) : Dictionary of Subnet Name and ID or None if session is None
+    """
+    if session is None:
+        return None
+
+    client = session.client('ec2')
+    subnets = get_all(client.describe_subnets, 'Subnets') \
+                     (Filters=[{"Name": "tag:Name", "Values": ["*." + vpc_domain]}])
+
+    rtn = {}
+    for subnet in subnets:
+        name = _find(subnet.get('Tags', []), lambda x: x['Key'] == 'Name')
+        if name is not None:
+            rtn[name['Value']] = subnet['SubnetId']
+    return rtn
+
+@cached
 def azs_lookup(bosslet_config, compatibility=None):
     """Lookup all of the Availablity Zones for the connected region.
 
@@ -299,6 +588,7 @@ def azs_lookup(bosslet_config, compatibility=None):
 
     return rtn
 
+@cached
 def ami_lookup(bosslet_config, ami_name, version = None):
     """Lookup the Id for the AMI with the given name.
 
@@ -388,6 +678,7 @@ def sg_lookup_all(session, vpc_id):
 
         return sgs
 
+@cached
 def sg_lookup(session, vpc_id, group_name):
     """Lookup the Id for the VPC Security Group with the given name.
 
@@ -403,15 +694,18 @@ def sg_lookup(session, vpc_id, group_name):
     if session is None:
         return None
 
-    client = session.client('ec2')
-    response = client.describe_security_groups(Filters=[{"Name": "vpc-id", "Values": [vpc_id]},
-                                                        {"Name": "tag:Name", "Values": [group_name]}])
-
-    if len(response['SecurityGroups']) == 0:
-        return None
-    else:
-        return response['SecurityGroups'][0]['GroupId']
+    # Load all of the security groups in the VPC with one call, as
+    # configs typically lookup several groups from the same VPC
+    rtn = None
+    cache = lookup_cache(session)
+    for name, group_id in sg_lookup_all(session, vpc_id).items():
+        if name == group_name:
+            rtn = group_id
+        elif cache is not None and name is not None:
+            cache.put(('sg_lookup', vpc_id, name), group_id)
+    return rtn
 
+@cached
 def rt_lookup(session, vpc_id, rt_name):
     """Lookup the Id for the VPC Route Table with the given name.
 
@@ -530,21 +824,14 @@ def instanceid_lookup(session, hostname):
         return None
 
     client = session.client('ec2')
-    response = client.describe_instances(
+    reservations = iter_all(client.describe_instances, 'Reservations', page_size=1000)(
         Filters=[{"Name": "tag:Name", "Values": [hostname]}])
 
-    item = response['Reservations']
-    if len(item) == 0:
-        return None
-    else:
-        item = item[0]['Instances']
-        if len(item) == 0:
-            return None
-        else:
-            item = item[0]
-            if 'InstanceId' in item:
-                return item['InstanceId']
-            return None
+    for reservation in reservations:
+        if len(reservation['Instances']) == 0:
+            continue
+        return reservation['Instances'][0].get('InstanceId')
+    return None
 
 
 def cert_arn_lookup(session, domain_name):
@@ -562,8 +849,9 @@ def cert_arn_lookup(session, domain_name):
         return None
 
     client = session.client('acm')
-    response = client.list_certificates()
-    for certs in response['CertificateSummaryList']:
+    summaries = iter_all(client.list_certificates, 'CertificateSummaryList',
+                         page_size=100, page_size_key='MaxItems')()
+    for certs in summaries:
         if certs['DomainName'] == domain_name:
             return certs['CertificateArn']
         if certs['DomainName'].startswith('*'):    # if it is a wildcard domain like "*.thebossdev.io"
@@ -589,22 +877,15 @@ def instance_public_lookup(session, hostname):
         return None
 
     client = session.client('ec2')
-    response = client.describe_instances(
+    reservations = iter_all(client.describe_instances, 'Reservations', page_size=1000)(
         Filters=[{"Name": "tag:Name", "Values": [hostname]},
                  {"Name": "instance-state-name", "Values": ["running"]}])
 
-    item = response['Reservations']
-    if len(item) == 0:
-        return None
-    else:
-        item = item[0]['Instances']
-        if len(item) == 0:
-            return None
-        else:
-            item = item[0]
-            if 'PublicDnsName' in item:
-                return item['PublicDnsName']
-            return None
+    for reservation in reservations:
+        if len(reservation['Instances']) == 0:
+            continue
+        return reservation['Instances'][0].get('PublicDnsName')
+    return None
 
 
 def cloudfront_public_lookup(session, hostname):
@@ -712,8 +993,7 @@ def sns_topic_lookup(session, topic_name):
         return None
 
     client = session.client('sns')
-    response = client.list_topics()
-    topics_list = response['Topics']
+    topics_list = iter_all(client.list_topics, 'Topics')()
     for topic in topics_list:
         arn_topic_name = topic["TopicArn"].split(':').pop()
         if arn_topic_name == topic_name:
@@ -737,6 +1017,11 @@ def sqs_delete_all(session, domain):
     for url in resp.get('QueueUrls', []):
         client.delete_queue(QueueUrl=url)
 
+    cache = lookup_cache(session)
+    if cache is not None:
+        cache.invalidate('sqs_lookup_url')
+
+@cached
 def sqs_lookup_url(session, queue_name):
     """Lookup up SQS url given a name.
 
@@ -1014,6 +1299,7 @@ def policy_delete_all(session, domain, path="/"):
                     client.detach_role_policy(RoleName=role['RoleName'], PolicyArn=ARN)
             client.delete_policy(PolicyArn=ARN)
 
+@cached
 def role_arn_lookup(session, role_name):
     """
     Returns the arn associated the the role name.
@@ -1035,6 +1321,7 @@ def role_arn_lookup(session, role_name):
     else:
         return response['Role']['Arn']
 
+@cached
 def instance_profile_arn_lookup(session, instance_profile_name):
     """
     Returns the arn associated the the role name.
@@ -1096,6 +1383,7 @@ def s3_bucket_delete(session, name, empty=False):
 
     bucket.delete()
 
+@cached
 def lambda_arn_lookup(session, lambda_name):
     """
     Returns the arn for a lambda given a lambda function name.
@@ -1116,16 +1404,215 @@ def lambda_arn_lookup(session, lambda_name):
     else:
         return response['Configuration']['FunctionArn']
 
-def dynamo_scan(session, table_name):
-    if session is None:
-        return None
-    
-    client = session.client("dynamodb")
-    response = aws.scan(TableName=table_name)
-    if response is None:
-        return None
-    else:
-        return response
+class RateLimiter(object):
+    """Limit the rate at which a resource, like DynamoDB read capacity units,
+    is consumed by multiple threads
+
+    Callers wait() before making a request and report the amount consumed by
+    the request, after it completes, using consume(). Requests are delayed
+    so that the average consumption doesn't exceed the rate.
+
+    If the amount is known before making the request, acquire() can be used
+    instead, which spaces out concurrent callers evenly.
+
+    Args:
+        rate (optional[float]): Units per second, or None for no limit
+    """
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.available = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Wait until the previously consumed units are paid back"""
+        if self.rate is None:
+            return
+
+        with self.lock:
+            delay = self.available - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def consume(self, units):
+        """Record that the given number of units were consumed"""
+        if self.rate is None:
+            return
+
+        with self.lock:
+            self.available = max(self.available, time.monotonic()) + units / self.rate
+
+    def acquire(self, units=1):
+        """Wait until the given number of units can be consumed and consume them"""
+        if self.rate is None:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.available, now)
+            self.available = start + units / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+DYNAMO_SCAN_SEGMENTS = 8
+
+def dynamo_scan(session, table_name, segments=DYNAMO_SCAN_SEGMENTS, workers=None,
+                attributes=None, read_capacity=None, page_size=None):
+    """Scan all of the items in a DynamoDB table using a parallel scan
+
+    The table is divided into `segments` segments that are scanned by
+    `workers` threads. Items are returned as they are read, so the whole
+    table is never held in memory. Items from different segments are
+    interleaved and not in any specific order.
+
+    Usage:
+        for item in aws.dynamo_scan(session, 'idIndex.example.boss',
+                                    attributes=['channel-id-key'],
+                                    read_capacity=100):
+            ...
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+        segments (int): Number of segments to divide the table into
+        workers (optional[int]): Number of concurrent scans, defaults to `segments`
+        attributes (optional[list[str]]): Names of the attributes to read, if not
+                                          given all attributes are read
+        read_capacity (optional[float]): Maximum read capacity units per second to
+                                         consume across all workers, if not given
+                                         the scan is not limited
+        page_size (optional[int]): Maximum number of items per scan request
+
+    Returns:
+        generator: Generator yielding items as dictionaries of Python values
+    """
+    if workers is None:
+        workers = segments
+
+    kwargs = {
+        'TableName': table_name,
+        'TotalSegments': segments,
+        'ReturnConsumedCapacity': 'TOTAL',
+    }
+    if attributes:
+        names = {'#a{}'.format(i): attr for i, attr in enumerate(attributes)}
+        kwargs['ProjectionExpression'] = ', '.join(names.keys())
+        kwargs['ExpressionAttributeNames'] = names
+    if page_size is not None:
+        kwargs['Limit'] = page_size
+
+    client = session.client('dynamodb')
+    limiter = RateLimiter(read_capacity)
+    deserializer = TypeDeserializer()
+
+    pending = queue.Queue()
+    for segment in range(segments):
+        pending.put(segment)
+
+    # Bounded so that workers don't read faster than the caller consumes items
+    pages = queue.Queue(maxsize = workers * 2)
+    stop = threading.Event()
+    DONE = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout = 1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan():
+        try:
+            while not stop.is_set():
+                try:
+                    segment = pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                args = dict(kwargs, Segment = segment)
+                while True:
+                    limiter.wait()
+                    resp = client.scan(**args)
+                    limiter.consume(resp.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+
+                    if not put(resp['Items']):
+                        return
+
+                    if 'LastEvaluatedKey' not in resp:
+                        break
+                    args['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+        except Exception as ex:
+            put(ex)
+        finally:
+            put(DONE)
+
+    threads = [threading.Thread(target = scan, daemon = True)
+               for _ in range(min(workers, segments))]
+    for thread in threads:
+        thread.start()
+
+    try:
+        running = len(threads)
+        while running > 0:
+            page = pages.get()
+            if page is DONE:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for item in page:
+                    yield {k: deserializer.deserialize(v) for k, v in item.items()}
+    finally:
+        # Stop the workers if the caller stopped iterating or there was an error
+        stop.set()
+
+def _dynamo_json(value):
+    """Convert DynamoDB values that are not Json serializable"""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key = str)
+    if isinstance(value, Binary):
+        return base64.b64encode(value.value).decode()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+def dynamo_scan_to_file(session, table_name, filename, format='ndjson', **kwargs):
+    """Scan all of the items in a DynamoDB table and save them to disk
+
+    Items are written as they are read. Numbers are written as integers or
+    floats, sets as lists, and binary data as base64 encoded strings.
+
+    Args:
+        session (Session): boto3.session.Session object
+        table_name (str): Name of the DynamoDB table
+        filename (str): File to write the items to
+        format (str): Either 'ndjson' (one Json object per line) or 'csv'.
+                      For 'csv' the columns are `attributes`, if given, or the
+                      attributes of the first item, other attributes are dropped
+        kwargs: Additional arguments passed to dynamo_scan()
+
+    Returns:
+        int: Number of items written
+    """
+    if format not in ('ndjson', 'csv'):
+        raise ValueError("Unsupported format '{}'".format(format))
+
+    count = 0
+    with open(filename, 'w', newline = '') as fh:
+        writer = None
+        for item in dynamo_scan(session, table_name, **kwargs):
+            if format == 'ndjson':
+                fh.write(json.dumps(item, sort_keys=True, default=_dynamo_json) + '\n')
+            else:
+                if writer is None:
+                    columns = kwargs.get('attributes') or sorted(item.keys())
+                    writer = csv.DictWriter(fh, columns, extrasaction = 'ignore')
+                    writer.writeheader()
+                writer.writerow({k: json.dumps(v, default=_dynamo_json) if not isinstance(v, str) else v
+                                 for k, v in item.items()})
+            count += 1
+    return count
 
 def dynamodb_delete_table(session, table_name, wait=True):
     """Deletes the given DynamoDB table, optionally waiting until it has been deleted
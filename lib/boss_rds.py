@@ -15,6 +15,9 @@
 import logging
 LOGGER = logging.getLogger(__name__)
 
+# Maximum number of lookup keys in a single `IN (...)` query
+LOOKUP_KEY_CHUNK = 1000
+
 def sql_tables(bosslet_config):
     """
     List all tables in sql.
@@ -187,21 +190,95 @@ def sql_get_names_from_lookup_keys(bosslet_config, lookup_keys):
                                       If a look up key is not found, empty strings
                                       will be returned for that key's corresponding tuple.
     """
-    names = []
     if len(lookup_keys) < 1:
         LOGGER.error('No lookup keys provided, aborting.')
-        return names
+        return []
 
-    query = 'SELECT collection_name, experiment_name, channel_name FROM lookup WHERE lookup_key = %(key)s'
-    with bosslet_config.call.connect_rds() as cursor:
-        for key in lookup_keys:
-            cursor.execute(query, { 'key': key })
-            rows = cursor.fetchall()
-            if(len(rows) > 0):
-                this_row = (rows[0][0], rows[0][1], rows[0][2])
-            else:
-                this_row = ('', '', '')
-            names.append(this_row)
-            LOGGER.info('key: {}, coll: {}, exp: {}, chan: {}'.format(key, this_row[0], this_row[1], this_row[2]))
-        
+    names = sql_get_names_by_lookup_key(bosslet_config, lookup_keys)
+    return [names[key] for key in lookup_keys]
+
+def sql_get_names_by_lookup_key(bosslet_config, lookup_keys, cursor=None, chunk_size=LOOKUP_KEY_CHUNK):
+    """
+    Gets collection/experiment/channel names for many lookup keys.
+
+    Duplicate keys are removed and the remaining keys are looked up using
+    one `IN (...)` query per `chunk_size` keys.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        lookup_keys (iterable[str]): Lookup keys to get col/exp/chan names for.
+                                     Expected format f'{col_id}&{exp_id}&{chan_id}'
+        cursor (optional[Cursor]): Existing database cursor to use, so that multiple
+                                   calls can share a connection
+        chunk_size (int): Maximum number of keys per query
+
+    Returns:
+        (dict[str, tuple(str, str, str)]): Dict of lookup key to tuple of collection/exp/chan
+                                           names. If a look up key is not found, empty strings
+                                           will be returned for that key's tuple.
+    """
+    keys = list(dict.fromkeys(lookup_keys))
+    if len(keys) < 1:
+        return {}
+
+    if cursor is None:
+        with bosslet_config.call.connect_rds() as cursor:
+            return sql_get_names_by_lookup_key(bosslet_config, keys, cursor, chunk_size)
+
+    names = {}
+    for i in range(0, len(keys), chunk_size):
+        chunk = keys[i:i + chunk_size]
+        query = 'SELECT lookup_key, collection_name, experiment_name, channel_name FROM lookup ' + \
+                'WHERE lookup_key IN ({})'.format(', '.join(['%s'] * len(chunk)))
+        cursor.execute(query, chunk)
+        for key, coll, exp, chan in cursor.fetchall():
+            names.setdefault(key, (coll, exp, chan))
+
+    missing = 0
+    for key in keys:
+        if key not in names:
+            names[key] = ('', '', '')
+            missing += 1
+
+    LOGGER.info('Found names for {} of {} lookup keys'.format(len(keys) - missing, len(keys)))
     return names
+
+def sql_get_lookup_keys_from_names(bosslet_config, channels, cursor=None, chunk_size=LOOKUP_KEY_CHUNK):
+    """
+    Gets the lookup keys for many collection/experiment/channel names.
+
+    Duplicate names are removed and the remaining names are looked up using
+    one `IN (...)` query per `chunk_size` channels.
+
+    Args:
+        bosslet_config (BossConfiguration): Bosslet configuration object
+        channels (iterable[tuple(str, str, str)]): Collection/exp/chan names to get lookup keys for
+        cursor (optional[Cursor]): Existing database cursor to use, so that multiple
+                                   calls can share a connection
+        chunk_size (int): Maximum number of channels per query
+
+    Returns:
+        (dict[tuple(str, str, str), str]): Dict of collection/exp/chan names to lookup key,
+                                           in the format f'{col_id}&{exp_id}&{chan_id}'.
+                                           Channels that are not found are not included.
+    """
+    channels = list(dict.fromkeys(tuple(channel) for channel in channels))
+    if len(channels) < 1:
+        return {}
+
+    if cursor is None:
+        with bosslet_config.call.connect_rds() as cursor:
+            return sql_get_lookup_keys_from_names(bosslet_config, channels, cursor, chunk_size)
+
+    keys = {}
+    for i in range(0, len(channels), chunk_size):
+        chunk = channels[i:i + chunk_size]
+        query = 'SELECT lookup_key, collection_name, experiment_name, channel_name FROM lookup ' + \
+                'WHERE (collection_name, experiment_name, channel_name) IN ({})'.format(
+                    ', '.join(['(%s, %s, %s)'] * len(chunk)))
+        cursor.execute(query, [name for channel in chunk for name in channel])
+        for key, coll, exp, chan in cursor.fetchall():
+            keys.setdefault((coll, exp, chan), key)
+
+    LOGGER.info('Found lookup keys for {} of {} channels'.format(len(keys), len(channels)))
+    return keys
@@ -22,6 +22,9 @@ Author:
 import os
 import time
 import json
+import fcntl
+import hashlib
+import tempfile
 from botocore.exceptions import ClientError
 
 from . import hosts
@@ -33,6 +36,14 @@ from . import constants as const
 from .migrations import MigrationManager
 from .exceptions import BossManageError, BossManageCanceled
 
+# Location of the content hashes of the last template and arguments
+# successfully created / updated for each bosslet's configs
+TEMPLATE_HASHES = const.repo_path('cloud_formation', 'templates', 'hashes.json')
+
+# Lock file held while TEMPLATE_HASHES is updated, as configs may be
+# created / updated by concurrent processes (cloudformation.py --parallel)
+TEMPLATE_HASHES_LOCK = TEMPLATE_HASHES + '.lock'
+
 def bool_str(val):
     """CloudFormation Template formatted boolean string.
 
@@ -66,6 +77,51 @@ class Ref(dict):
         # Force the format into a JSON compatible format
         return json.dumps(self)
 
+def canonical_json(data):
+    """Json encode data so that equal data always gives the same string"""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+def load_template_hash(key):
+    """Get the saved content hash for the given '<bosslet>/<config>' key
+
+    Returns:
+        str|None: The hash or None if there is no saved hash
+    """
+    try:
+        with open(TEMPLATE_HASHES, 'r') as fh:
+            return json.load(fh).get(key)
+    except (OSError, ValueError):
+        return None
+
+def save_template_hash(key, content_hash):
+    """Save the content hash for the given '<bosslet>/<config>' key
+
+    The file is updated while holding TEMPLATE_HASHES_LOCK and the new
+    contents are moved into place, so that concurrent processes don't
+    overwrite each other's hashes and readers never see a partial file
+    """
+    directory = os.path.dirname(TEMPLATE_HASHES)
+    os.makedirs(directory, exist_ok=True)
+
+    with open(TEMPLATE_HASHES_LOCK, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        try:
+            with open(TEMPLATE_HASHES, 'r') as fh:
+                hashes = json.load(fh)
+        except (OSError, ValueError):
+            hashes = {}
+
+        hashes[key] = content_hash
+
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as fh:
+            json.dump(hashes, fh, indent=4, sort_keys=True)
+        try:
+            os.replace(fh.name, TEMPLATE_HASHES)
+        except OSError:
+            os.remove(fh.name)
+            raise
+
 class Arg:
     """Class of static methods to create the CloudFormation template argument
     snippits.
@@ -350,6 +406,182 @@ class Arg:
 # In all other cases, it is up to the developer of new methods to decide if they
 # want to implement the function's arguments are CF template arguments or hardcoded
 # values.
+class StackWaiter(object):
+    """Wait for a CloudFormation stack operation by following its stack events
+
+    Only stack events newer than the last event seen are requested and
+    printed, along with how long each resource took once it finishes. When
+    no new events are seen the delay between requests grows exponentially,
+    up to MAX_DELAY, and resets once new events appear.
+
+    Attributes:
+        client: Boto3 CloudFormation client
+        stack_id (str): Unique Id of the stack, which can be used to
+                        describe the stack after it has been deleted
+        last_event (str|None): Id of the newest event that has been processed
+        started (dict): Mapping of logical resource id to the time the
+                        resource started its current operation
+        timings (list[tuple[str, str, float]]): Logical id, resource type, and
+                                                seconds each finished resource took
+    """
+
+    MIN_DELAY = 2
+    MAX_DELAY = 30
+    BACKOFF = 1.5
+
+    def __init__(self, client, name):
+        """
+        Args:
+            client: Boto3 CloudFormation client
+            name (str): Name of the stack
+
+        Raises:
+            BossManageError: If the stack doesn't exist
+        """
+        self.client = client
+
+        response = client.describe_stacks(StackName=name)
+        if len(response['Stacks']) == 0:
+            msg = "Stack '{}' doesn't exist".format(name)
+            raise BossManageError(msg)
+        self.stack_id = response['Stacks'][0]['StackId']
+
+        self.last_event = None
+        self.started = {}
+        self.timings = []
+
+    def status(self):
+        """Get the current stack status"""
+        response = self.client.describe_stacks(StackName=self.stack_id)
+        return response['Stacks'][0]['StackStatus']
+
+    def is_stack_event(self, event):
+        return event['PhysicalResourceId'] == self.stack_id
+
+    def new_events(self, process=None):
+        """Get the stack events that have not been seen yet
+
+        On the first call (when no events have been seen yet) only the
+        events since the most recent stack event with the status `process`
+        are returned, so that events from earlier operations are skipped.
+
+        Args:
+            process (optional[str]): In progress stack status of the operation being waited on
+
+        Returns:
+            list[dict]: Stack events, oldest first
+        """
+        events = []
+        newest = None
+        kwargs = {'StackName': self.stack_id}
+        found = False
+        while not found:
+            response = self.client.describe_stack_events(**kwargs)
+            if newest is None and len(response['StackEvents']) > 0:
+                newest = response['StackEvents'][0]['EventId']
+
+            for event in response['StackEvents']: # newest first
+                if event['EventId'] == self.last_event:
+                    found = True
+                    break
+
+                events.append(event)
+
+                if self.last_event is None and \
+                   self.is_stack_event(event) and \
+                   event['ResourceStatus'] == process:
+                    found = True
+                    break
+
+            if 'NextToken' not in response:
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+        if self.last_event is None and not found:
+            # The start of the operation wasn't found, only follow
+            # events from this point forward
+            events = []
+            self.last_event = newest
+
+        if len(events) > 0:
+            self.last_event = events[0]['EventId']
+
+        events.reverse()
+        return events
+
+    def process_event(self, event):
+        """Print the event and record how long the resource took"""
+        id_ = event['LogicalResourceId']
+        status = event['ResourceStatus']
+        timestamp = event['Timestamp']
+
+        msg = "{:%H:%M:%S} {:<40} {:<30}".format(timestamp, id_, status)
+
+        if status.endswith('_IN_PROGRESS'):
+            self.started.setdefault(id_, timestamp)
+        elif id_ in self.started:
+            seconds = (timestamp - self.started.pop(id_)).total_seconds()
+            if not self.is_stack_event(event):
+                self.timings.append((id_, event['ResourceType'], seconds))
+            msg += " {:>6.0f}s".format(seconds)
+
+        if event.get('ResourceStatusReason'):
+            msg += " " + event['ResourceStatusReason']
+
+        if status.endswith('_FAILED'):
+            console.fail(msg)
+        else:
+            print(msg)
+
+    def wait(self, process):
+        """Wait for the stack status to change from `process`
+
+        Args:
+            process (str): In progress stack status being waited on
+
+        Returns:
+            str: The new stack status
+        """
+        delay = self.MIN_DELAY
+        while True:
+            events = self.new_events(process)
+            for event in events:
+                self.process_event(event)
+
+            # Every stack status change creates a stack event, so the stack
+            # only needs to be described after one is seen
+            if any(self.is_stack_event(e) and e['ResourceStatus'] != process for e in events):
+                status = self.status()
+                if status != process:
+                    return status
+
+            if len(events) > 0:
+                delay = self.MIN_DELAY
+            else:
+                delay = min(delay * self.BACKOFF, self.MAX_DELAY)
+            time.sleep(delay)
+
+    def slowest(self, count=5):
+        """Get the resources that took the longest
+
+        Args:
+            count (int): Number of resources to return
+
+        Returns:
+            list[tuple[str, str, float]]: Logical id, resource type, and seconds
+        """
+        return sorted(self.timings, key=lambda t: t[2], reverse=True)[:count]
+
+    def print_summary(self, count=5):
+        """Print the resources that took the longest"""
+        slowest = self.slowest(count)
+        if len(slowest) == 0:
+            return
+
+        print("Slowest resources:")
+        for id_, type_, seconds in slowest:
+            print("    {:<40} {:<40} {:>6.0f}s".format(id_, type_, seconds))
+
 class CloudFormationConfiguration:
     """Configuration class that helps with building CloudFormation templates
     and launching them.
@@ -387,6 +619,8 @@ class CloudFormationConfiguration:
         self.vpc_domain = bosslet_config.INTERNAL_DOMAIN
         self.vpc_subnet = bosslet_config.NETWORK
 
+        self.resource_timings = []
+
 
     def _create_template(self, description="", indent=None):
         """Create the JSON CloudFormation template from the resources that have
@@ -428,6 +662,76 @@ class CloudFormationConfiguration:
         except ClientError:
             return None # Stack doesn't exist
 
+    def hash_key(self):
+        """Key used to save this config's content hash"""
+        return "{}/{}".format(self.vpc_domain, self.config)
+
+    def content_hash(self):
+        """Get a hash of the rendered template, arguments, and stack version
+
+        Returns:
+            str: SHA256 hex digest
+        """
+        content = {
+            'Template': json.loads(self._create_template()),
+            'Arguments': self.arguments,
+            'Version': self.stack_version,
+        }
+        return hashlib.sha256(canonical_json(content).encode()).hexdigest()
+
+    def is_unchanged(self, client):
+        """Check if the rendered template and arguments match the deployed stack
+
+        The template is compared against the stack's original template. The
+        arguments are compared against the stack's parameters, except for
+        NoEcho parameters whose values are hidden. If there are NoEcho
+        parameters, the saved content hash from the last create / update
+        has to match instead.
+
+        Args:
+            client: Boto3 CloudFormation client
+
+        Returns:
+            bool: If updating the stack would not change anything
+        """
+        if self.existing_version() != self.version():
+            return False
+
+        response = client.get_template(StackName = self.stack_name,
+                                       TemplateStage = 'Original')
+        deployed = response['TemplateBody']
+        if isinstance(deployed, str):
+            try:
+                deployed = json.loads(deployed)
+            except ValueError:
+                return False
+
+        if canonical_json(deployed) != canonical_json(json.loads(self._create_template())):
+            return False
+
+        response = client.describe_stacks(StackName = self.stack_name)
+        deployed = { p['ParameterKey']: p['ParameterValue']
+                     for p in response['Stacks'][0].get('Parameters', []) }
+
+        if set(deployed.keys()) != set(a['ParameterKey'] for a in self.arguments):
+            return False
+
+        hidden = False
+        for argument in self.arguments:
+            if argument['UsePreviousValue']:
+                continue
+
+            value = deployed[argument['ParameterKey']]
+            if value == '****':
+                hidden = True
+            elif value != argument['ParameterValue']:
+                return False
+
+        if hidden:
+            return load_template_hash(self.hash_key()) == self.content_hash()
+
+        return True
+
     def generate(self):
         """Generate the CloudFormation template and arguments files """
         cur_dir = os.path.dirname(os.path.realpath(__file__))
@@ -440,20 +744,26 @@ class CloudFormationConfiguration:
             json.dump(self.arguments, fh, indent=4)
 
     def _poll(self, client, name, action, process):
-        get_status = lambda r: r['Stacks'][0]['StackStatus']
-        response = client.describe_stacks(StackName=name)
-        if len(response['Stacks']) == 0:
-            msg = "Stack '{}' doesn't exist".format(name)
-            raise BossManageError(msg)
-        else:
-            print("Waiting for {} ".format(action), end="", flush=True)
-            while get_status(response) == process:
-                time.sleep(5)
-                print(".", end="", flush=True)
-                response = client.describe_stacks(StackName=name)
-            print(" done")
+        """Wait for the stack to leave the given in progress status
+
+        Args:
+            client: Boto3 CloudFormation client
+            name (str): Name of the stack
+            action (str): Name of the action being waited on, for display
+            process (str): In progress stack status being waited on
 
-            return get_status(response)
+        Returns:
+            str: The new stack status
+        """
+        waiter = StackWaiter(client, name)
+        print("Waiting for {}".format(action))
+        status = waiter.wait(process)
+        print("Finished {} with status {}".format(action, status))
+
+        self.resource_timings = waiter.timings
+        waiter.print_summary()
+
+        return status
 
     def _raise_error(self, status):
         """A common method for raising an error if create/update/delete didn't
@@ -511,16 +821,27 @@ class CloudFormationConfiguration:
 
             if status == 'CREATE_COMPLETE':
                 print("Created stack '{}'".format(self.stack_name))
+                save_template_hash(self.hash_key(), self.content_hash())
             else:
                 self._raise_error(status)
 
-    def update(self, wait = True):
+        # Resources created by the stack may now be found by lookups
+        aws.invalidate_lookups(self.session)
+
+    def update(self, wait = True, force = None):
         """Update the template this object represents in CloudFormation.
 
+        If the template and arguments match the deployed stack (see
+        is_unchanged()) the update is skipped without creating a change set.
+
+        Note: A skipped update doesn't update the stack's Commit tag
+
         Args:
             session (Session) : Boto3 session used to launch the configuration
             wait (bool) : If True, wait for the stack to be updated, printing
                           status information
+            force (optional[bool]) : If True, always update the stack, even if it is unchanged
+                                     Defaults to the bosslet_config.force_update value
 
         Returns:
             bool: If there were migrations applied
@@ -536,6 +857,14 @@ class CloudFormationConfiguration:
                 raise BossManageError(msg)
 
         client = self.session.client('cloudformation')
+
+        if force is None:
+            force = getattr(self.bosslet_config, 'force_update', False)
+
+        if not force and self.is_unchanged(client):
+            console.info("No changes to {} since it was last deployed, skipping update".format(self.stack_name))
+            return False
+
         migrations = MigrationManager(self.config, self.existing_version(), self.version())
 
         # Save the migration progress in case there is an exception in one
@@ -585,6 +914,7 @@ class CloudFormationConfiguration:
                 if response['Status'] != 'CREATE_COMPLETE':
                     if "didn't contain changes" in response['StatusReason']:
                         console.info("No changes detected, nothing to update")
+                        save_template_hash(self.hash_key(), self.content_hash())
                         return
 
                     print("ChangeSet status is {}".format(response['Status']))
@@ -638,6 +968,10 @@ class CloudFormationConfiguration:
             else:
                 self._raise_error(status)
 
+            save_template_hash(self.hash_key(), self.content_hash())
+
+        aws.invalidate_lookups(self.session)
+
         migrations.post_update(self.bosslet_config)
 
         os.remove(migration_progress)
@@ -675,6 +1009,8 @@ class CloudFormationConfiguration:
                 # Stack doesn't exist anymore
                 print(" done")
 
+        aws.invalidate_lookups(self.session)
+
     def get_failed_reasons(self):
         client = self.session.client("cloudformation")
 
@@ -862,6 +1198,7 @@ class CloudFormationConfiguration:
         """
         internal = []
         external = []
+        subnets = aws.subnet_index(self.session, self.vpc_domain) or {}
 
         for az, sub in aws.azs_lookup(self.bosslet_config, compatibility):
             name = sub.capitalize() + "InternalSubnet"
@@ -869,7 +1206,7 @@ class CloudFormationConfiguration:
                 internal.append(Ref(name))
             else:
                 domain = sub + "-internal." + self.vpc_domain
-                id = aws.subnet_id_lookup(self.session, domain)
+                id = subnets.get(domain)
                 if id is None:
                     print("Subnet {} doesn't exist, not using.".format(domain))
                 else:
@@ -881,7 +1218,7 @@ class CloudFormationConfiguration:
                 external.append(Ref(name))
             else:
                 domain = sub + "-external." + self.vpc_domain
-                id = aws.subnet_id_lookup(self.session, domain)
+                id = subnets.get(domain)
                 if id is None:
                     print("Subnet {} doesn't exist, not using.".format(domain))
                 else:
@@ -906,6 +1243,7 @@ class CloudFormationConfiguration:
         internal = []
 
         subnets = [x for x in hosts.SUBNETS if x.startswith('lambda')]
+        ids = aws.subnet_index(self.session, self.vpc_domain) or {}
 
         for i in range(len(subnets)):
             key = "LambdaSubnet{}".format(i)
@@ -913,7 +1251,7 @@ class CloudFormationConfiguration:
                 internal.append(Ref(key))
             else:
                 domain = subnets[i] + "." + self.vpc_domain
-                id = aws.subnet_id_lookup(self.session, domain)
+                id = ids.get(domain)
                 if id is None:
                     print("Subnet {} doesn't exist, not using.".format(domain))
                 else:
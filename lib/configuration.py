@@ -123,6 +123,8 @@ class BossConfiguration(object):
 
         # Handle keyword arguments
         self.disable_preview = kwargs.get('disable_preview')
+        self.force_update = kwargs.get('force_update', False)
+        self.force_build = kwargs.get('force_build', False)
 
         self.ami_version = self.get('AMI_VERSION')
         if kwargs.get('ami_version') is not None:
@@ -24,6 +24,8 @@ import shutil
 import colorama
 from colorama import Fore, Style
 
+from .exceptions import BossManageError
+
 colorama.init()
 
 def _colorize(*style_msg, **kwargs):
@@ -81,6 +83,11 @@ def confirm(message, default = False, timeout = None):
     
     Returns:
         returns True if user confirms with yes
+
+    Raises:
+        BossManageError: If stdin is closed (like in a worker process) and the
+                         default answer is no, so that a missing user doesn't
+                         decline the prompt
     """
     if not sys.stdout.isatty():
         # If stdout is piped (often meaning that no user is available for a
@@ -110,6 +117,11 @@ def confirm(message, default = False, timeout = None):
     except TimeoutError:
         print(" (timeout)") # since user didn't hit <enter>
         return default
+    except EOFError:
+        print(" (no input)") # stdin is closed, like in a worker process
+        if not default:
+            raise BossManageError("No input available to answer '{}'".format(message))
+        return default
     finally:
         if timeout is not None:
             signal.alarm(0)
@@ -13,10 +13,12 @@
 # limitations under the License.
 
 import time
+import atexit
 import logging
+import threading
 
 from urllib.request import urlopen, HTTPError
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from mysql import connector
 from . import exceptions
 from . import aws
@@ -63,6 +65,10 @@ class ExternalCalls:
         self.session = bosslet_config.session
         self.keypair_file = bosslet_config.ssh_key
 
+        # Resolve the bastion and vault instances with one API call
+        aws.machine_lookup_bulk(self.session, [self.names.bastion.dns,
+                                               self.names.vault.dns])
+
         bastion_ip = aws.machine_lookup(self.session, self.names.bastion.dns)
 
         self.bastions = [ SSHTarget(self.keypair_file, bastion_ip) ]
@@ -79,6 +85,12 @@ class ExternalCalls:
         # keep track of previous connections to limit the need for looking up IP addresses
         self.connections = {}
 
+        # pooled endpoint RDS connection, see rds_connection()
+        self.rds = None
+        self.rds_context = None
+        self.rds_lock = threading.RLock()
+        atexit.register(self.close_rds)
+
     @contextmanager
     def vault(self):
         class ContextVault(object):
@@ -166,34 +178,96 @@ class ExternalCalls:
 
         return self.connections[key].tunnel()
 
+    def rds_connection(self):
+        """Get the pooled connection to the endpoint boss rds
+
+        The SSH tunnel and MySQL connection are opened on first use and then
+        reused by later calls, until close_rds() is called or the process exits.
+        The connection is checked before being returned and is reopened if
+        it (or the SSH tunnel) is no longer working.
+
+        Returns:
+            mysql.connector.MySQLConnection
+        """
+        with self.rds_lock:
+            if self.rds is not None:
+                try:
+                    self.rds.ping()
+                    return self.rds
+                except connector.Error as ex:
+                    logging.info('Pooled RDS connection failed ({}), reconnecting'.format(ex))
+                    self.close_rds()
+
+            DB_HOST_NAME = self.names.endpoint_db.rds
+            logging.debug("DB Hostname is: {}".format(DB_HOST_NAME))
+
+            logging.info('Getting MySQL parameters from Vault (slow) . . .')
+            with self.vault() as vault:
+                mysql_params = vault.read('secret/endpoint/django/db')
+
+            logging.info('Tunneling to DB (slow) . . .')
+            with ExitStack() as stack:
+                local_port = stack.enter_context(self.tunnel(DB_HOST_NAME, mysql_params['port'], 'rds'))
+                sql = connector.connect(
+                    user=mysql_params['user'], password=mysql_params['password'],
+                    port=local_port, database=mysql_params['name']
+                )
+                stack.callback(sql.close)
+
+                # Only keep the tunnel open if the connection was successful
+                self.rds_context = stack.pop_all()
+                self.rds = sql
+
+            return self.rds
+
+    def close_rds(self):
+        """Close the pooled endpoint boss rds connection and SSH tunnel, if open"""
+        with self.rds_lock:
+            context, self.rds_context, self.rds = self.rds_context, None, None
+            if context is not None:
+                try:
+                    context.close()
+                except Exception as ex:
+                    logging.debug('Error closing RDS connection: {}'.format(ex))
+
     @contextmanager
     def connect_rds(self):
         """
         Context manager with established connection to endpoint boss rds
         Prompts vault to grab credentials
 
+        The connection is pooled (see rds_connection()), each context gets a
+        new cursor and ends the transaction when finished, so that changes
+        are not left uncommitted between contexts.
+
         Returns:
             cursor object context
         """
-        DB_HOST_NAME = self.names.endpoint_db.rds
-        logging.debug("DB Hostname is: {}".format(DB_HOST_NAME))
-
-        logging.info('Getting MySQL parameters from Vault (slow) . . .')
-        with self.vault() as vault:
-            mysql_params = vault.read('secret/endpoint/django/db')
-
-        logging.info('Tunneling to DB (slow) . . .')
-        with self.tunnel(DB_HOST_NAME, mysql_params['port'], 'rds') as local_port:
+        with self.rds_lock:
+            sql = self.rds_connection()
+            cursor = sql.cursor()
             try:
-                sql = connector.connect(
-                    user=mysql_params['user'], password=mysql_params['password'], 
-                    port=local_port, database=mysql_params['name']
-                )
-                cursor = sql.cursor()
                 yield cursor
             finally:
                 cursor.close()
-                sql.close()
+                sql.rollback()
+
+    @contextmanager
+    def rds_pool(self):
+        """
+        Context manager for batch work that opens the pooled endpoint boss rds
+        connection at the start and closes it at the end, instead of at process exit
+
+        Usage:
+            with bosslet_config.call.rds_pool():
+                for resource in resources:
+                    boss_rds.sql_resource_lookup_key(bosslet_config, resource)
+        """
+        try:
+            self.rds_connection()
+            yield
+        finally:
+            self.close_rds()
 
     def check_vault(self, timeout, exception=True):
         """Vault status check to see if Vault is accessible
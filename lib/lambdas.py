@@ -12,14 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from lib.exceptions import BossManageError
+from lib.exceptions import BossManageError, CircularDependencyError
 from lib.ssh import SSHConnection, SSHTarget
 from lib import utils
 from lib import constants as const
 from lib import zip
 from lib import console
 
-import botocore
+import botocore.exceptions
 import configparser
 import yaml
 import glob
@@ -30,6 +30,11 @@ import shlex
 import shutil
 import pwd
 import pathlib
+import random
+import fcntl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Location of settings files for ndingest.
 NDINGEST_SETTINGS_FOLDER = const.repo_path('salt_stack', 'salt', 'ndingest', 'files', 'ndingest.git', 'settings')
@@ -37,6 +42,33 @@ NDINGEST_SETTINGS_FOLDER = const.repo_path('salt_stack', 'salt', 'ndingest', 'fi
 # Template used for ndingest settings.ini generation.
 NDINGEST_SETTINGS_TEMPLATE = NDINGEST_SETTINGS_FOLDER + '/settings.ini.apl'
 
+# Lambda code zips that have been built (or are being built) during this execution
+# DP NOTE: Shared between the threads of build_lambdas(), access with BUILT_ZIPS_LOCK
+BUILT_ZIPS = []
+BUILT_ZIPS_LOCK = threading.Lock()
+
+# Default number of lambda code zips build_lambdas() builds at the same time
+BUILD_WORKERS = 4
+
+# Currently any Docker CLI compatible container setup can be used (like podman)
+# A container is started for each runtime and reused for all of the builds using that runtime
+CONTAINER_START_CMD = '{EXECUTABLE} run --detach --rm --env AWS_* --volume {HOST_DIR}:/var/task/ --entrypoint sleep lambci/lambda:build-{RUNTIME} infinity'
+CONTAINER_EXEC_CMD = '{EXECUTABLE} exec {CONTAINER} {CMD}'
+CONTAINER_STOP_CMD = '{EXECUTABLE} stop {CONTAINER}'
+
+# Not all lambda build containers have build_lambda.py's dependencies (like
+# non-python runtimes), so they are installed once when the container is started
+# DP NOTE: using --user in case the container doesn't run as root
+CONTAINER_SETUP_CMD = 'python3 -m pip install --user boto3 PyYaml'
+
+BUILD_CMD = 'python3 {PREFIX}/build_lambda.py {DOMAIN} {BUCKET} {STAGING}'
+
+# The lambda build server's build_lambda.py only accepts the domain and bucket
+# and always uses ~/staging/<domain>.zip, so builds on it are run one at a time,
+# across threads and cloudformation.py --parallel processes, using REMOTE_BUILD_LOCK
+REMOTE_BUILD_CMD = 'python3 {PREFIX}/build_lambda.py {DOMAIN} {BUCKET}'
+REMOTE_BUILD_LOCK = os.path.join(tempfile.gettempdir(), 'boss-manage-lambda-build-server.lock')
+
 def load_lambda_config(lambda_dir):
     """Load the lambda.yml config file
 
@@ -110,6 +142,7 @@ def lambda_dirs(bosslet_config):
         n.copy_cuboid_lambda.lambda_: 'multi_lambda',
         n.dynamo_lambda.lambda_: 'dynamodb-lambda-autoscale',
         n.cache_throttle.lambda_: 'cache_throttle',
+        n.ingest_lambda.lambda_: 'ingest_populate',
     }
 
 def code_zip(bosslet_config, lambda_config):
@@ -187,27 +220,280 @@ def s3_config(bosslet_config, lambda_name, lambda_handler):
 def update_lambda_code(bosslet_config):
     """Update all lambdas that use the multilambda zip file.
 
+    Lambdas that don't exist (are part of configs that are not launched)
+    are skipped.
+
     Args:
         bosslet_config: Bosslet configuration object
     """
-    names = bosslet_config.names
-    uses_multilambda = [k for k, v in lambda_dirs(bosslet_config).items()
-                          if v == 'multi_lambda']
-    config = load_lambda_config('multi_lambda')
-    client = bosslet_config.session.client('lambda')
-    for lambda_name in uses_multilambda:
+    update_functions(bosslet_config,
+                     zip_functions(bosslet_config)['multi_lambda'],
+                     ignore_missing = True)
+
+def zip_functions(bosslet_config):
+    """Create a mapping of lambda directory to the lambdas that use its code zip
+
+    Args:
+        bosslet_config: Bosslet configuration object
+
+    Returns:
+        dict: Mapping of lambda directory to sorted list of unique lambda names
+    """
+    index = {}
+    for lambda_name, lambda_dir in lambda_dirs(bosslet_config).items():
+        index.setdefault(lambda_dir, set()).add(lambda_name)
+    return { lambda_dir: sorted(names) for lambda_dir, names in index.items() }
+
+# Number of lambda functions update_functions() updates at the same time
+UPDATE_WORKERS = 8
+
+# Number of times, and the starting delay in seconds, to retry a throttled
+# or conflicting (another update in progress) Lambda API call
+UPDATE_RETRIES = 6
+UPDATE_BACKOFF = 1
+
+# Seconds between checks of a function's LastUpdateStatus and the maximum
+# number of seconds to wait for the update to finish
+UPDATE_POLL = 2
+UPDATE_TIMEOUT = 300
+
+# Lambda API errors that are retried by update_functions()
+RETRY_ERRORS = ('TooManyRequestsException',
+                'ThrottlingException',
+                'ResourceConflictException')
+
+def _retry(func, *args, **kwargs):
+    """Call a Lambda API method, retrying throttling and conflict errors
+    with jittered exponential backoff
+    """
+    delay = UPDATE_BACKOFF
+    for attempt in range(UPDATE_RETRIES + 1):
         try:
-            resp = client.update_function_code(
-                FunctionName=lambda_name,
-                S3Bucket=bosslet_config.LAMBDA_BUCKET,
-                S3Key=code_zip(bosslet_config, config['name']),
-                Publish=True)
-            print(resp)
+            return func(*args, **kwargs)
         except botocore.exceptions.ClientError as ex:
-            print('Error updating {}: {}'.format(lambda_name, ex))
+            code = ex.response['Error']['Code']
+            if code not in RETRY_ERRORS or attempt == UPDATE_RETRIES:
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
 
-BUILT_ZIPS = []
-def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
+def _wait_for_update(client, lambda_name):
+    """Wait for a function's LastUpdateStatus to be Successful
+
+    Raises:
+        BossManageError: If the update failed or didn't finish in UPDATE_TIMEOUT seconds
+    """
+    for _ in range(0, UPDATE_TIMEOUT, UPDATE_POLL):
+        resp = _retry(client.get_function_configuration, FunctionName = lambda_name)
+        status = resp.get('LastUpdateStatus', 'Successful') # Not returned by older APIs
+        if status == 'Successful':
+            return resp
+        elif status == 'Failed':
+            raise BossManageError("Update failed: {}".format(resp.get('LastUpdateStatusReason')))
+        time.sleep(UPDATE_POLL)
+
+    raise BossManageError("Update didn't finish in {} seconds".format(UPDATE_TIMEOUT))
+
+def update_function(bosslet_config, lambda_name, lambda_config, layer_arns = None, client = None):
+    """Update a lambda's code from its code zip in S3 and publish a new version
+
+    The new version is published once the function's LastUpdateStatus is Successful
+
+    Args:
+        bosslet_config: Bosslet configuration object
+        lambda_name (str): Name of the lambda function
+        lambda_config (dict): Lambda configuration data of the lambda's code zip
+        layer_arns (optional[list[str]]): Layer version ARNs to point the lambda at
+        client (optional[Lambda.Client]): Lambda client to use. Required when called
+                                          from multiple threads, as creating clients
+                                          from the shared boto3 Session is not thread safe
+    """
+    if client is None:
+        client = bosslet_config.session.client('lambda')
+
+    resp = _retry(client.update_function_code,
+                  FunctionName = lambda_name,
+                  S3Bucket = bosslet_config.LAMBDA_BUCKET,
+                  S3Key = code_zip(bosslet_config, lambda_config))
+    _wait_for_update(client, lambda_name)
+    console.info("Updated {} function code".format(lambda_name))
+
+    if layer_arns:
+        _retry(client.update_function_configuration,
+               FunctionName = lambda_name,
+               Layers = layer_arns)
+        _wait_for_update(client, lambda_name)
+        console.info("Updated {} layer references".format(lambda_name))
+
+    _retry(client.publish_version,
+           FunctionName = lambda_name,
+           CodeSha256 = resp['CodeSha256'])
+
+def update_functions(bosslet_config, lambda_names, ignore_missing = False, workers = UPDATE_WORKERS):
+    """Tell the given lambdas to reload their code from S3, updating them concurrently
+
+    Args:
+        bosslet_config: Bosslet configuration object
+        lambda_names (list[str]): Names of the lambda functions to update
+        ignore_missing (bool): If lambdas that don't exist should be skipped,
+                               instead of being an error
+        workers (int): Maximum number of lambdas to update at the same time
+
+    Raises:
+        BossManageError: If there was a problem updating any of the lambdas
+    """
+    all_dirs = lambda_dirs(bosslet_config)
+    configs = {}
+    layers = {}
+    for lambda_dir in set(all_dirs[name] for name in lambda_names):
+        configs[lambda_dir] = load_lambda_config(lambda_dir)
+        if configs[lambda_dir].get('layers'):
+            layers[lambda_dir] = get_layer_arns(bosslet_config, configs[lambda_dir]['layers'])
+
+    # Clients are thread safe, but creating them from the shared Session is not
+    client = bosslet_config.session.client('lambda')
+
+    def update(lambda_name):
+        lambda_dir = all_dirs[lambda_name]
+        update_function(bosslet_config, lambda_name, configs[lambda_dir], layers.get(lambda_dir), client)
+
+    failed = []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = { executor.submit(update, name): name for name in sorted(set(lambda_names)) }
+        for future in futures:
+            lambda_name = futures[future]
+            try:
+                future.result()
+            except botocore.exceptions.ClientError as ex:
+                if ignore_missing and ex.response['Error']['Code'] == 'ResourceNotFoundException':
+                    console.warning("Lambda {} doesn't exist, skipping".format(lambda_name))
+                else:
+                    failed.append("{}: {}".format(lambda_name, ex))
+            except Exception as ex:
+                failed.append("{}: {}".format(lambda_name, ex))
+
+    if len(failed) > 0:
+        raise BossManageError("Problem updating lambda code", causes = failed)
+
+class BuildContainers(object):
+    """Warm lambda build containers, one per lambda runtime
+
+    Containers are started the first time a runtime is used and are reused by
+    all of the following builds, so that each build doesn't pay for starting
+    a new container and installing build_lambda.py's dependencies. The
+    dependencies are installed while holding the lock, before any build can
+    use the container.
+
+    Args:
+        executable (str): Docker CLI compatible container command
+        env_extras (dict): Extra environmental variables to start the containers with
+    """
+    def __init__(self, executable, env_extras):
+        self.executable = executable
+        self.env_extras = env_extras
+        self.containers = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def container(self, runtime):
+        """Get the ID of the container for the given runtime, starting it if needed"""
+        with self.lock:
+            if runtime not in self.containers:
+                console.debug("Starting lambda build container for {}".format(runtime))
+                cmd = CONTAINER_START_CMD.format(EXECUTABLE = self.executable,
+                                                 HOST_DIR = const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files'),
+                                                 RUNTIME = runtime)
+                env = os.environ.copy()
+                env.update(self.env_extras)
+                proc = subprocess.run(shlex.split(cmd),
+                                      env = env,
+                                      check = True,
+                                      stdout = subprocess.PIPE,
+                                      universal_newlines = True)
+                container = proc.stdout.strip()
+
+                try:
+                    utils.run(CONTAINER_EXEC_CMD.format(EXECUTABLE = self.executable,
+                                                        CONTAINER = container,
+                                                        CMD = CONTAINER_SETUP_CMD))
+                except Exception:
+                    utils.run(CONTAINER_STOP_CMD.format(EXECUTABLE = self.executable,
+                                                        CONTAINER = container),
+                              checkreturn = False)
+                    raise
+
+                self.containers[runtime] = container
+
+            return self.containers[runtime]
+
+    def run(self, runtime, cmd):
+        """Run the given command in the container for the given runtime
+
+        Raises:
+            Exception: If the command's return code is not zero
+        """
+        utils.run(CONTAINER_EXEC_CMD.format(EXECUTABLE = self.executable,
+                                            CONTAINER = self.container(runtime),
+                                            CMD = cmd))
+
+    def close(self):
+        """Stop all of the containers"""
+        for container in self.containers.values():
+            utils.run(CONTAINER_STOP_CMD.format(EXECUTABLE = self.executable,
+                                                CONTAINER = container),
+                      checkreturn = False)
+        self.containers = {}
+
+def build_env(bosslet_config, container_executable):
+    """Get the environmental variables that provide the AWS Region and Credentials
+    (for S3 upload) to build_lambda.py
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambda will be deployed into
+        container_executable (str|None): Container command, if builds are run in a container
+
+    Returns:
+        dict: Dictionary of extra environmental variables
+    """
+    env_extras = { 'AWS_REGION': bosslet_config.REGION,
+                   'AWS_DEFAULT_REGION': bosslet_config.REGION }
+
+    if bosslet_config.PROFILE is not None:
+        if container_executable is None:
+            env_extras['AWS_PROFILE'] = bosslet_config.PROFILE
+        else:
+            # Cannot set the profile as the container will not have the credentials file
+            # So extract the underlying keys and provide those instead
+            creds = bosslet_config.session.get_credentials()
+            env_extras['AWS_ACCESS_KEY_ID'] = creds.access_key
+            env_extras['AWS_SECRET_ACCESS_KEY'] = creds.secret_key
+
+    return env_extras
+
+def lambda_layers(lambda_dir):
+    """Get the layers that need to be built before the given lambda
+
+    Args:
+        lambda_dir (str): Name of the directory in `cloud_formation/lambda/` that
+                          contains the `lambda.yml` configuration file for the lambda
+
+    Returns:
+        list[str]: Names of the layer directories
+    """
+    layers = load_lambda_config(lambda_dir).get('layers') or []
+    for layer in layers:
+        # Layer names should end with `layer`
+        if not layer.endswith('layer'):
+            console.warning("Layer '{}' doesn't conform to naming conventions".format(layer))
+    return layers
+
+def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None, force = None):
     """Package up the lambda files and send them through the lambda build process
     where the lambda code zip is produced and uploaded to S3
 
@@ -219,6 +505,9 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     NOTE: If lambda_name and lambda_dir are both None then lambda_dir is set to
           'multi_lambda' for backwards compatibility
 
+    NOTE: If the hash of the files that would be zipped matches the 'build-hash'
+          of the existing code zip in S3 the build is skipped, unless forced
+
     Args:
         bosslet_config (BossConfiguration): Configuration object of the stack the
                                             lambda will be deployed into
@@ -226,6 +515,8 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
                            lambda directory that contains the lambda's code
         lambda_dir (str): Name of the directory in `cloud_formation/lambda/` that
                           contains the `lambda.yml` configuration file for the lambda
+        force (optional[bool]): If True, always build the lambda code zip, even if it
+                                is unchanged. Defaults to the bosslet_config.force_build value
 
     Raises:
         BossManageError: If there was a problem with building the lambda code zip or
@@ -243,25 +534,129 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
             console.error("Cannot build a lambda that doesn't use a code zip file")
             return None
 
-    # To prevent rubuilding a lambda code zip multiple times during an individual execution memorize what has been built
-    if lambda_dir in BUILT_ZIPS:
-        console.debug('Lambda code {} has already be build recently, skipping...'.format(lambda_dir))
-        return
-    BUILT_ZIPS.append(lambda_dir)
+    build_lambdas(bosslet_config, [lambda_dir], force = force)
+
+def build_lambdas(bosslet_config, dirs, force = None, workers = BUILD_WORKERS):
+    """Build the code zips for the given lambda directories and the layers they use
+
+    Lambdas and layers are built concurrently, with each lambda only started
+    once the layers it uses have been built. If the builds are run in a
+    container (LAMBDA_BUILD_CONTAINER) one container is reused for all
+    builds of the same runtime. Builds on a lambda build server (LAMBDA_SERVER)
+    are run one at a time.
+
+    After the first failure no new builds are started and once the running
+    builds have finished an error is raised.
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambdas will be deployed into
+        dirs (list[str]): Names of the directories in `cloud_formation/lambda/`
+                          that contain the `lambda.yml` configuration files
+        force (optional[bool]): If True, always build the lambda code zips, even if they
+                                are unchanged. Defaults to the bosslet_config.force_build value
+        workers (int): Maximum number of lambdas to build at the same time
+
+    Raises:
+        BossManageError: If there was a problem with building a lambda code zip or
+                         uploading it to the given S3 bucket
+        CircularDependencyError: If the lambda layers depend on each other
+    """
+    # Resolve the lambda / layer dependency graph
+    blockers = {}
+    pending = list(dirs)
+    while len(pending) > 0:
+        lambda_dir = pending.pop()
+        if lambda_dir not in blockers:
+            blockers[lambda_dir] = set(lambda_layers(lambda_dir))
+            pending.extend(blockers[lambda_dir])
+
+    # To prevent rebuilding a lambda code zip multiple times during an individual execution memorize what has been built
+    with BUILT_ZIPS_LOCK:
+        for lambda_dir in list(blockers.keys()):
+            if lambda_dir in BUILT_ZIPS:
+                console.debug('Lambda code {} has already be build recently, skipping...'.format(lambda_dir))
+                del blockers[lambda_dir]
+        BUILT_ZIPS.extend(blockers.keys())
+
+    for layers in blockers.values():
+        layers.intersection_update(blockers.keys())
+
+    container_executable = os.environ.get('LAMBDA_BUILD_CONTAINER')
+    if container_executable is not None and bosslet_config.LAMBDA_SERVER is None:
+        containers = BuildContainers(container_executable,
+                                     build_env(bosslet_config, container_executable))
+    else:
+        containers = None
+
+    # Clients are thread safe, but creating them from the shared Session is not
+    s3 = bosslet_config.session.client('s3')
+
+    failed = []
+    with ThreadPoolExecutor(workers) as executor:
+        try:
+            running = {}
+            while len(blockers) > 0 or len(running) > 0:
+                if len(failed) == 0:
+                    for lambda_dir in [d for d, layers in blockers.items() if len(layers) == 0]:
+                        del blockers[lambda_dir]
+                        future = executor.submit(build_lambda, bosslet_config, lambda_dir, force, containers, s3)
+                        running[future] = lambda_dir
+
+                if len(running) == 0:
+                    break # Nothing can be started
+
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    lambda_dir = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        console.fail("Building {}".format(lambda_dir))
+                        failed.append("{}: {}".format(lambda_dir, ex))
+                    else:
+                        for layers in blockers.values():
+                            layers.discard(lambda_dir)
+        finally:
+            if containers is not None:
+                containers.close()
+
+    if len(failed) > 0:
+        causes = failed
+        if len(blockers) > 0:
+            causes.append("Not built: {}".format(", ".join(sorted(blockers.keys()))))
+        raise BossManageError("Problem building lambda code zips", causes = causes)
+    elif len(blockers) > 0:
+        raise CircularDependencyError(*sorted(blockers.keys())[:2])
+
+def build_lambda(bosslet_config, lambda_dir, force = None, containers = None, s3 = None):
+    """Build a single lambda code zip and upload it to S3
+
+    NOTE: The lambda's layers must already be built, use build_lambdas()
 
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambda will be deployed into
+        lambda_dir (str): Name of the directory in `cloud_formation/lambda/` that
+                          contains the `lambda.yml` configuration file for the lambda
+        force (optional[bool]): If True, always build the lambda code zip, even if it
+                                is unchanged. Defaults to the bosslet_config.force_build value
+        containers (BuildContainers|None): Warm containers to run the build in, if
+                                           LAMBDA_BUILD_CONTAINER is set
+        s3 (optional[S3.Client]): S3 client used to check if the lambda is already
+                                  built. Required when called from multiple threads,
+                                  as creating clients from the shared boto3 Session
+                                  is not thread safe
+
+    Raises:
+        BossManageError: If there was a problem with building the lambda code zip or
+                         uploading it to the given S3 bucket
+    """
     lambda_dir = pathlib.Path(const.repo_path('cloud_formation', 'lambda', lambda_dir))
     lambda_config = lambda_dir / 'lambda.yml'
     with lambda_config.open() as fh:
         lambda_config = yaml.full_load(fh.read())
 
-    if lambda_config.get('layers'):
-        for layer in lambda_config['layers']:
-            # Layer names should end with `layer`
-            if not layer.endswith('layer'):
-                console.warning("Layer '{}' doesn't conform to naming conventions".format(layer))
-
-            load_lambdas_on_s3(bosslet_config, lambda_dir=layer)
-
     console.debug("Building {} lambda code zip".format(lambda_dir))
 
     domain = bosslet_config.INTERNAL_DOMAIN
@@ -270,11 +665,12 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     tempname.close()
     console.debug('Using temp zip file: {}'.format(zipname))
 
-    cwd = os.getcwd()
+    # The optional `compression_level` lambda.yml key selects the zlib level
+    builder = zip.ZipBuilder(lambda_config.get('compression_level', zip.DEFAULT_COMPRESSION))
 
     # Copy the lambda files into the zip
     for filename in lambda_dir.glob('*'):
-        zip.write_to_zip(str(filename), zipname, arcname=filename.name)
+        builder.add(filename, filename.name)
 
     # Copy the other files that should be included
     if lambda_config.get('include'):
@@ -282,24 +678,31 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
             dst = lambda_config['include'][src]
             src_path, src_file = src.rsplit('/', 1)
 
-            os.chdir(const.repo_path(src_path))
-
             # Generate dynamic configuration files, as needed
             if src_file == 'ndingest.git':
                 with open(NDINGEST_SETTINGS_TEMPLATE, 'r') as tmpl:
                     # Generate settings.ini file for ndingest.
                     create_ndingest_settings(bosslet_config, tmpl)
 
-            zip.write_to_zip(src_file, zipname, arcname=dst)
-            os.chdir(cwd)
+            builder.add(const.repo_path(src_path, src_file), dst)
 
-    # Currently any Docker CLI compatible container setup can be used (like podman)
-    CONTAINER_CMD = '{EXECUTABLE} run --rm -it --env AWS_* --volume {HOST_DIR}:/var/task/ lambci/lambda:build-{RUNTIME} {CMD}'
+    if force is None:
+        force = getattr(bosslet_config, 'force_build', False)
+
+    if not force and is_built(bosslet_config, lambda_config, builder.manifest_hash(), s3):
+        console.info("No changes to {} lambda code since it was last built, skipping build".format(lambda_config['name']))
+        return
+
+    builder.write(zipname)
+
+    # Each local / container build uses its own staging name so that multiple
+    # lambdas can be built at the same time (see REMOTE_BUILD_CMD for LAMBDA_SERVER)
+    staging_name = lambda_dir.name + '-' + domain
 
-    BUILD_CMD = 'python3 {PREFIX}/build_lambda.py {DOMAIN} {BUCKET}'
     BUILD_ARGS = {
         'DOMAIN': domain,
         'BUCKET': bosslet_config.LAMBDA_BUCKET,
+        'STAGING': staging_name,
     }
 
     # DP NOTE: not sure if this should be in the bosslet_config, as it is more about the local dev
@@ -309,11 +712,10 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
     lambda_build_server = bosslet_config.LAMBDA_SERVER
     if lambda_build_server is None:
         staging_target = pathlib.Path(const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files', 'staging'))
-        if not staging_target.exists():
-            staging_target.mkdir()
+        staging_target.mkdir(exist_ok=True)
 
         console.debug("Copying build zip to {}".format(staging_target))
-        staging_zip = staging_target / (domain + '.zip')
+        staging_zip = staging_target / (staging_name + '.zip')
         try:
             zipname.rename(staging_zip)
         except OSError:
@@ -321,37 +723,24 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
             # Using the shell version, as using copy +  chmod doesn't always work depending on the filesystem
             utils.run('mv {} {}'.format(zipname, staging_zip), shell=True)
 
-        # Provide the AWS Region and Credentials (for S3 upload) via environmental variables
-        env_extras = { 'AWS_REGION': bosslet_config.REGION,
-                       'AWS_DEFAULT_REGION': bosslet_config.REGION }
-
-        if container_executable is None:
-            BUILD_ARGS['PREFIX'] = const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files')
-            CMD = BUILD_CMD.format(**BUILD_ARGS)
-
-            if bosslet_config.PROFILE is not None:
-                env_extras['AWS_PROFILE'] = bosslet_config.PROFILE
-
-            console.info("calling build lambda on localhost")
-        else:
-            BUILD_ARGS['PREFIX'] = '/var/task'
-            CMD = BUILD_CMD.format(**BUILD_ARGS)
-            CMD = CONTAINER_CMD.format(EXECUTABLE = container_executable,
-                                       HOST_DIR = const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files'),
-                                       RUNTIME = lambda_config['runtime'],
-                                       CMD = CMD)
-
-            if bosslet_config.PROFILE is not None:
-                # Cannot set the profile as the container will not have the credentials file
-                # So extract the underlying keys and provide those instead
-                creds = bosslet_config.session.get_credentials()
-                env_extras['AWS_ACCESS_KEY_ID'] = creds.access_key
-                env_extras['AWS_SECRET_ACCESS_KEY'] = creds.secret_key
-
-            console.info("calling build lambda in {}".format(container_executable))
-
         try:
-            utils.run(CMD, env_extras=env_extras)
+            if container_executable is None:
+                BUILD_ARGS['PREFIX'] = const.repo_path('salt_stack', 'salt', 'lambda-dev', 'files')
+                CMD = BUILD_CMD.format(**BUILD_ARGS)
+
+                console.info("calling build lambda on localhost")
+                utils.run(CMD, env_extras=build_env(bosslet_config, container_executable))
+            else:
+                BUILD_ARGS['PREFIX'] = '/var/task'
+                CMD = BUILD_CMD.format(**BUILD_ARGS)
+
+                console.info("calling build lambda in {}".format(container_executable))
+                if containers is None:
+                    with BuildContainers(container_executable,
+                                         build_env(bosslet_config, container_executable)) as containers:
+                        containers.run(lambda_config['runtime'], CMD)
+                else:
+                    containers.run(lambda_config['runtime'], CMD)
         except Exception as ex:
             raise BossManageError("Problem building {} lambda code zip: {}".format(lambda_dir, ex))
         finally:
@@ -359,7 +748,7 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
 
     else:
         BUILD_ARGS['PREFIX'] = '~'
-        CMD = BUILD_CMD.format(**BUILD_ARGS)
+        CMD = REMOTE_BUILD_CMD.format(**BUILD_ARGS)
 
         lambda_build_server_key = bosslet_config.LAMBDA_SERVER_KEY
         lambda_build_server_key = utils.keypair_to_file(lambda_build_server_key)
@@ -367,18 +756,46 @@ def load_lambdas_on_s3(bosslet_config, lambda_name = None, lambda_dir = None):
         bastions = [bosslet_config.outbound_bastion] if bosslet_config.outbound_bastion else []
         ssh = SSHConnection(ssh_target, bastions)
 
-        console.debug("Copying build zip to lambda-build-server")
-        target_file = '~/staging/{}.zip'.format(domain)
-        ret = ssh.scp(zipname, target_file, upload=True)
-        console.debug("scp return code: " + str(ret))
+        with open(REMOTE_BUILD_LOCK, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
 
-        os.remove(zipname)
+            console.debug("Copying build zip to lambda-build-server")
+            target_file = '~/staging/{}.zip'.format(domain)
+            ret = ssh.scp(zipname, target_file, upload=True)
+            console.debug("scp return code: " + str(ret))
+
+            os.remove(zipname)
+
+            console.info("calling build lambda on lambda-build-server")
+            ret = ssh.cmd(CMD)
 
-        console.info("calling build lambda on lambda-build-server")
-        ret = ssh.cmd(CMD)
         if ret != 0:
             raise BossManageError("Problem building {} lambda code zip: Return code: {}".format(lambda_dir, ret))
 
+def is_built(bosslet_config, lambda_config, build_hash, s3 = None):
+    """Check if the lambda code zip in S3 was built from the given files
+
+    Args:
+        bosslet_config (BossConfiguration): Configuration object of the stack the
+                                            lambda will be deployed into
+        lambda_config (dict): Parsed lambda.yml of the lambda
+        build_hash (str): Hash of the files that would be zipped, from
+                          ZipBuilder.manifest_hash()
+        s3 (optional[S3.Client]): S3 client to use, instead of creating one
+
+    Returns:
+        bool: If the existing code zip has the same 'build-hash' metadata
+    """
+    if s3 is None:
+        s3 = bosslet_config.session.client('s3')
+    try:
+        resp = s3.head_object(Bucket = bosslet_config.LAMBDA_BUCKET,
+                              Key = code_zip(bosslet_config, lambda_config))
+    except botocore.exceptions.ClientError:
+        return False # Doesn't exist yet or cannot be read, so build it
+
+    return resp['Metadata'].get('build-hash') == build_hash
+
 def create_ndingest_settings(bosslet_config, fp):
     """Create the settings.ini file for ndingest.
 
@@ -415,24 +832,7 @@ def freshen_lambda(bosslet_config, lambda_name):
     Useful when developing and small changes need to be made to a lambda function, 
     but a full rebuild of the entire zip file isn't required.
     """
-    lambda_dir = lambda_dirs(bosslet_config)[lambda_name]
-    lambda_config = load_lambda_config(lambda_dir)
-
-    zip_name = code_zip(bosslet_config, lambda_config)
-
-    client = bosslet_config.session.client('lambda')
-    resp = client.update_function_code(
-        FunctionName=lambda_name,
-        S3Bucket=bosslet_config.LAMBDA_BUCKET,
-        S3Key=zip_name,
-        Publish=True)
-    console.info("Updated {} function code".format(lambda_name))
-
-    if lambda_config.get('layers'):
-        layer_arns = get_layer_arns(bosslet_config, lambda_config['layers'])
-        resp = client.update_function_configuration(FunctionName=full_name,
-                                                    Layers=layer_arns)
-        console.info("Updated {} layer references".format(lambda_name))
+    update_functions(bosslet_config, [lambda_name])
 
 def download_lambda_zip(bosslet_config, lambda_name, path):
     """
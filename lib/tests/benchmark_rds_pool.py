@@ -0,0 +1,151 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the pooled endpoint RDS connection used by lib/boss_rds
+
+Times N boss_rds lookups made through ExternalCalls.connect_rds(), which
+reuses one SSH tunnel and MySQL connection, against the original
+connect_rds() that opened a new tunnel and connection for every lookup.
+
+The database is a local SQLite stand-in for MySQL, and the Vault read,
+SSH tunnel setup and MySQL connection setup are simulated with sleeps.
+
+Run from the repository root: python3 lib/tests/benchmark_rds_pool.py [N]
+"""
+
+import contextlib
+import os
+import sqlite3
+import sys
+import time
+from unittest.mock import MagicMock, patch
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import boss_rds
+from lib import external
+from lib.external import ExternalCalls
+
+LOOKUPS = 20
+FRAMES = 10 # Coordinate frames in the stand-in database
+VAULT_LATENCY = 0.2 # Seconds to read the MySQL parameters from Vault
+TUNNEL_LATENCY = 0.5 # Seconds to establish the SSH tunnel through the bastion
+CONNECT_LATENCY = 0.1 # Seconds to establish the MySQL connection
+QUERY_LATENCY = 0.01 # Seconds per query round trip
+
+class StandInConnection(object):
+    """MySQL connection stand-in backed by an in memory SQLite database"""
+    def __init__(self, **kwargs):
+        time.sleep(CONNECT_LATENCY)
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute('CREATE TABLE coordinate_frame (id INTEGER, name TEXT)')
+        self.db.executemany('INSERT INTO coordinate_frame VALUES (?, ?)',
+                            [(i, 'frame{}'.format(i)) for i in range(FRAMES)])
+        self.db.commit()
+
+    def cursor(self):
+        return StandInCursor(self.db.cursor())
+
+    def ping(self):
+        time.sleep(QUERY_LATENCY)
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+class StandInCursor(object):
+    def __init__(self, cursor):
+        self.cursor_ = cursor
+
+    def execute(self, query, args=()):
+        time.sleep(QUERY_LATENCY)
+        self.cursor_.execute(query.replace('%s', '?'), args)
+
+    def fetchall(self):
+        return self.cursor_.fetchall()
+
+    def close(self):
+        self.cursor_.close()
+
+class StandInVault(object):
+    def read(self, path):
+        time.sleep(VAULT_LATENCY)
+        return {'user': 'boss', 'password': 'boss', 'port': 3306, 'name': 'boss'}
+
+@contextlib.contextmanager
+def vault():
+    yield StandInVault()
+
+@contextlib.contextmanager
+def tunnel(target, port, type_):
+    time.sleep(TUNNEL_LATENCY)
+    yield 3306
+
+def create_call():
+    """Create an ExternalCalls without looking up the bastion and vault instances"""
+    call = ExternalCalls.__new__(ExternalCalls)
+    call.names = MagicMock()
+    call.rds = None
+    call.rds_context = None
+    call.rds_lock = external.threading.RLock()
+    call.vault = vault
+    call.tunnel = tunnel
+    return call
+
+@contextlib.contextmanager
+def original_connect_rds(call):
+    """The connect_rds() that opened a new tunnel and connection for every call"""
+    with call.vault() as vault:
+        mysql_params = vault.read('secret/endpoint/django/db')
+
+    with call.tunnel(call.names.endpoint_db.rds, mysql_params['port'], 'rds') as local_port:
+        try:
+            sql = external.connector.connect(
+                user=mysql_params['user'], password=mysql_params['password'],
+                port=local_port, database=mysql_params['name']
+            )
+            cursor = sql.cursor()
+            yield cursor
+        finally:
+            cursor.close()
+            sql.close()
+
+def measure(pooled, lookups):
+    bosslet_config = MagicMock()
+    bosslet_config.call = create_call()
+    if not pooled:
+        bosslet_config.call.connect_rds = lambda: original_connect_rds(bosslet_config.call)
+
+    start = time.time()
+    for i in range(lookups):
+        boss_rds.sql_coordinate_frame_lookup_key(bosslet_config, 'frame{}'.format(i % FRAMES))
+    bosslet_config.call.close_rds()
+    return time.time() - start
+
+if __name__ == '__main__':
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else LOOKUPS
+
+    with patch.object(external.connector, 'connect', StandInConnection):
+        original = measure(False, lookups)
+        pooled = measure(True, lookups)
+
+    print("Lookups: {}".format(lookups))
+    print("{:<28}{:>10}".format("", "seconds"))
+    print("{:<28}{:>10.2f}".format("Connection per lookup:", original))
+    print("{:<28}{:>10.2f}".format("Pooled connection:", pooled))
+    print("Speedup: {:.1f}x".format(original / pooled))
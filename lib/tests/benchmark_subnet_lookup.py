@@ -0,0 +1,147 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark of the EC2 API calls made when looking up a config's subnets
+
+Counts the describe_subnets calls made by find_all_subnets() and
+find_all_lambda_subnets() when rendering the configs that use them,
+against the original one call per subnet name lookup, using a stubbed
+EC2 client with a simulated round trip latency.
+
+Run from the repository root: python3 lib/tests/benchmark_subnet_lookup.py
+"""
+
+import contextlib
+import fnmatch
+import io
+import os
+import sys
+from unittest.mock import MagicMock
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import aws
+from lib import hosts
+from lib.cloudformation import CloudFormationConfiguration
+
+DOMAIN = 'test.boss'
+AZS = 'abcde'
+LATENCY = 0.05 # Seconds per simulated API call
+PAGE_SIZE = 25 # Subnets per describe_subnets page
+
+# The find_all_*subnets() calls made by each config
+RENDERS = {
+    'core': [('subnets', 'asg')],
+    'api': [('subnets', None), ('subnets', 'asg')],
+    'cachedb': [('subnets', None), ('subnets', 'lambda'), ('lambda', None)],
+    'activities': [('subnets', None), ('subnets', 'asg'), ('lambda', None)],
+    'idindexing': [('lambda', None)],
+}
+
+class StubEC2(object):
+    """EC2 client that counts the describe calls made"""
+    def __init__(self):
+        self.calls = {}
+        self.subnets = [{'SubnetId': 'subnet-{}'.format(i),
+                         'Tags': [{'Key': 'Name', 'Value': name + '.' + DOMAIN}]}
+                        for i, name in enumerate(hosts.SUBNETS)]
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def describe_availability_zones(self):
+        self.count('describe_availability_zones')
+        return {'AvailabilityZones': [{'ZoneName': 'us-east-1' + az} for az in AZS]}
+
+    def describe_subnets(self, Filters, NextToken=None):
+        self.count('describe_subnets')
+        pattern = Filters[0]['Values'][0]
+        matches = [s for s in self.subnets
+                   if fnmatch.fnmatchcase(s['Tags'][0]['Value'], pattern)]
+
+        start = int(NextToken or 0)
+        stop = start + PAGE_SIZE
+        resp = {'Subnets': matches[start:stop]}
+        if stop < len(matches):
+            resp['NextToken'] = str(stop)
+        return resp
+
+class StubSession(object):
+    def __init__(self):
+        self.ec2 = StubEC2()
+
+    def client(self, service):
+        return self.ec2
+
+def bosslet_config(session):
+    config = MagicMock()
+    config.INTERNAL_DOMAIN = DOMAIN
+    config.AVAILABILITY_ZONE_USAGE = {'lambda': ['a', 'b'], 'asg': ['a', 'b', 'c']}
+    config.session = session
+    return config
+
+def original_subnet_id_lookup(session, subnet_domain):
+    """The per name subnet_id_lookup() that find_all_*subnets() used before"""
+    client = session.client('ec2')
+    response = client.describe_subnets(Filters=[{"Name": "tag:Name", "Values": [subnet_domain]}])
+    if len(response['Subnets']) == 0:
+        return None
+    else:
+        return response['Subnets'][0]['SubnetId']
+
+def render_original(session):
+    """Resolve the same subnet names as render(), one name at a time"""
+    config = bosslet_config(session)
+    for name, renders in RENDERS.items():
+        for method, compatibility in renders:
+            if method == 'subnets':
+                for _, az in aws.azs_lookup.__wrapped__(config, compatibility):
+                    original_subnet_id_lookup(session, az + '-internal.' + DOMAIN)
+                    original_subnet_id_lookup(session, az + '-external.' + DOMAIN)
+            else:
+                for subnet in hosts.SUBNETS:
+                    if subnet.startswith('lambda'):
+                        original_subnet_id_lookup(session, subnet + '.' + DOMAIN)
+
+def render(session):
+    """Call find_all_*subnets() like each config does when it is rendered"""
+    config = bosslet_config(session)
+    for name, renders in RENDERS.items():
+        cf = CloudFormationConfiguration(name, config)
+        for method, compatibility in renders:
+            if method == 'subnets':
+                cf.find_all_subnets(compatibility)
+            else:
+                cf.find_all_lambda_subnets()
+
+def measure(func):
+    session = StubSession()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(session)
+    calls = sum(session.ec2.calls.values())
+    return session.ec2.calls.get('describe_subnets', 0), calls
+
+if __name__ == '__main__':
+    original_subnets, original_calls = measure(render_original)
+    current_subnets, current_calls = measure(render)
+
+    print("Configs rendered: {}".format(", ".join(RENDERS)))
+    print("{:<28}{:>10}{:>10}{:>16}".format("", "subnets", "total", "est. seconds"))
+    print("{:<28}{:>10}{:>10}{:>16.2f}".format("Per name lookups:", original_subnets,
+                                               original_calls, original_calls * LATENCY))
+    print("{:<28}{:>10}{:>10}{:>16.2f}".format("VPC subnet index:", current_subnets,
+                                               current_calls, current_calls * LATENCY))
+    print("API calls saved: {}".format(original_calls - current_calls))
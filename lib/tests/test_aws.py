@@ -0,0 +1,284 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import patch, MagicMock
+import tempfile
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import aws
+
+def tags(name):
+    return [{'Key': 'Name', 'Value': name}]
+
+class FakeSession(object):
+    """Session that returns the same MagicMock EC2 client for every call"""
+    def __init__(self):
+        self.ec2 = MagicMock()
+        self.ec2.describe_vpcs.return_value = {'Vpcs': [{'VpcId': 'vpc-1'}]}
+        self.ec2.describe_subnets.return_value = {'Subnets': [
+            {'SubnetId': 'subnet-a', 'Tags': tags('a-internal.test.boss')},
+            {'SubnetId': 'subnet-b', 'Tags': tags('b-internal.test.boss')},
+        ]}
+        self.ec2.describe_security_groups.return_value = {'SecurityGroups': [
+            {'GroupId': 'sg-1', 'Tags': tags('internal.test.boss')},
+            {'GroupId': 'sg-2', 'Tags': tags('ssh.test.boss')},
+        ]}
+
+    def client(self, service):
+        return self.ec2
+
+class TestLookupCache(unittest.TestCase):
+    def test_cached_lookup(self):
+        session = FakeSession()
+
+        self.assertEqual(aws.vpc_id_lookup(session, 'test.boss'), 'vpc-1')
+        self.assertEqual(aws.vpc_id_lookup(session, 'test.boss'), 'vpc-1')
+
+        self.assertEqual(session.ec2.describe_vpcs.call_count, 1)
+        self.assertEqual(aws.lookup_cache(session).reset_stats(), (1, 1))
+
+    def test_none_not_cached(self):
+        session = FakeSession()
+        session.ec2.describe_vpcs.return_value = {'Vpcs': []}
+
+        self.assertIsNone(aws.vpc_id_lookup(session, 'test.boss'))
+        self.assertIsNone(aws.vpc_id_lookup(session, 'test.boss'))
+
+        self.assertEqual(session.ec2.describe_vpcs.call_count, 2)
+
+    def test_expired(self):
+        session = FakeSession()
+
+        with patch.object(aws.time, 'monotonic', return_value=0):
+            aws.vpc_id_lookup(session, 'test.boss')
+        with patch.object(aws.time, 'monotonic', return_value=aws.LookupCache.TTL + 1):
+            aws.vpc_id_lookup(session, 'test.boss')
+
+        self.assertEqual(session.ec2.describe_vpcs.call_count, 2)
+
+    def test_invalidate(self):
+        session = FakeSession()
+
+        aws.vpc_id_lookup(session, 'test.boss')
+        aws.invalidate_lookups(session)
+        aws.vpc_id_lookup(session, 'test.boss')
+
+        self.assertEqual(session.ec2.describe_vpcs.call_count, 2)
+
+    def test_bulk_subnets(self):
+        session = FakeSession()
+
+        self.assertEqual(aws.subnet_id_lookup(session, 'a-internal.test.boss'), 'subnet-a')
+        self.assertEqual(aws.subnet_id_lookup(session, 'b-internal.test.boss'), 'subnet-b')
+
+        self.assertEqual(session.ec2.describe_subnets.call_count, 1)
+        filters = session.ec2.describe_subnets.call_args[1]['Filters']
+        self.assertEqual(filters[0]['Values'], ['*.test.boss'])
+
+    def test_subnet_index_pages(self):
+        session = FakeSession()
+        session.ec2.describe_subnets.side_effect = [
+            {'Subnets': [{'SubnetId': 'subnet-a', 'Tags': tags('a-internal.test.boss')}],
+             'NextToken': 'page2'},
+            {'Subnets': [{'SubnetId': 'subnet-b', 'Tags': tags('b-internal.test.boss')},
+                         {'SubnetId': 'subnet-c'}]},
+        ]
+
+        index = aws.subnet_index(session, 'test.boss')
+
+        self.assertEqual(index, {'a-internal.test.boss': 'subnet-a',
+                                 'b-internal.test.boss': 'subnet-b'})
+        self.assertEqual(session.ec2.describe_subnets.call_count, 2)
+        self.assertEqual(aws.subnet_id_lookup(session, 'b-internal.test.boss'), 'subnet-b')
+        self.assertEqual(session.ec2.describe_subnets.call_count, 2)
+
+    def test_bulk_security_groups(self):
+        session = FakeSession()
+
+        self.assertEqual(aws.sg_lookup(session, 'vpc-1', 'ssh.test.boss'), 'sg-2')
+        self.assertEqual(aws.sg_lookup(session, 'vpc-1', 'internal.test.boss'), 'sg-1')
+        self.assertIsNone(aws.sg_lookup(session, 'vpc-1', 'missing.test.boss'))
+
+        self.assertEqual(session.ec2.describe_security_groups.call_count, 2)
+
+    def test_no_session(self):
+        self.assertIsNone(aws.vpc_id_lookup(None, 'test.boss'))
+        self.assertIsNone(aws.lookup_cache(None))
+
+class TestIterAll(unittest.TestCase):
+    def pages(self, *pages):
+        responses = []
+        for i, page in enumerate(pages):
+            resp = {'Items': page}
+            if i + 1 < len(pages):
+                resp['NextToken'] = str(i + 1)
+            responses.append(resp)
+        return MagicMock(side_effect=responses)
+
+    def test_all_pages(self):
+        method = self.pages([1, 2], [], [3])
+
+        self.assertEqual(list(aws.iter_all(method, 'Items')(Arg='a')), [1, 2, 3])
+        self.assertEqual(aws.get_all(self.pages([1], [2]), 'Items')(), [1, 2])
+
+        method.assert_called_with(Arg='a', NextToken='2')
+
+    def test_lazy(self):
+        method = self.pages([1, 2], [3, 4], [5])
+
+        items = aws.iter_all(method, 'Items', page_size=2)()
+        self.assertEqual(method.call_count, 0)
+        self.assertEqual(next(items), 1)
+        self.assertEqual(next(items), 2)
+        self.assertEqual(method.call_count, 1)
+        method.assert_called_with(MaxResults=2)
+
+    def test_marker(self):
+        method = MagicMock(side_effect=[{'Items': [1], 'NextMarker': 'm'},
+                                        {'Items': [2]}])
+
+        items = aws.iter_all(method, 'Items', token='Marker', next_token='NextMarker')()
+
+        self.assertEqual(list(items), [1, 2])
+        method.assert_called_with(Marker='m')
+
+
+def reservation(id, name='auth.test.boss', public=True):
+    instance = {'InstanceId': id, 'PrivateIpAddress': id + '-private', 'Tags': tags(name)}
+    if public:
+        instance['PublicIpAddress'] = id + '-public'
+    return {'Instances': [instance]}
+
+class TestMachineLookup(unittest.TestCase):
+    def session(self, *pages):
+        session = MagicMock()
+        session.client.return_value.describe_instances.side_effect = pages
+        return session
+
+    def test_bulk(self):
+        session = self.session(
+            {'Reservations': [reservation('i-3'), reservation('i-1', 'vault.test.boss')],
+             'NextToken': 't'},
+            {'Reservations': [reservation('i-2', public=False)]},
+        )
+        hosts = ['auth.test.boss', '1.auth.test.boss', 'vault.test.boss', 'missing.test.boss']
+
+        instances = aws.machine_lookup_bulk(session, hosts)
+
+        self.assertEqual(instances, {
+            'auth.test.boss': [('i-2', 'i-2-private', None), ('i-3', 'i-3-private', 'i-3-public')],
+            '1.auth.test.boss': [('i-3', 'i-3-private', 'i-3-public')],
+            'vault.test.boss': [('i-1', 'i-1-private', 'i-1-public')],
+            'missing.test.boss': [],
+        })
+        describe = session.client.return_value.describe_instances
+        self.assertEqual(describe.call_count, 2)
+        filters = describe.call_args[1]['Filters']
+        self.assertEqual(filters[0]['Values'], ['auth.test.boss', 'missing.test.boss', 'vault.test.boss'])
+
+    def test_cached(self):
+        session = self.session({'Reservations': [reservation('i-3'), reservation('i-1')]})
+
+        self.assertEqual(aws.machine_lookup(session, '1.auth.test.boss', public_ip=False), 'i-3-private')
+        self.assertEqual(aws.machine_lookup(session, 'auth.test.boss'), 'i-1-public')
+        self.assertEqual(aws.machine_lookup_all(session, 'auth.test.boss'), ['i-1-public', 'i-3-public'])
+        self.assertIsNone(aws.machine_lookup(session, '2.auth.test.boss'))
+
+        self.assertEqual(session.client.return_value.describe_instances.call_count, 1)
+
+    def test_expired(self):
+        session = self.session({'Reservations': [reservation('i-1')]},
+                               {'Reservations': [reservation('i-2')]})
+
+        with patch.object(aws.time, 'monotonic', return_value=0):
+            self.assertEqual(aws.machine_lookup(session, 'auth.test.boss'), 'i-1-public')
+        with patch.object(aws.time, 'monotonic', return_value=aws.MACHINE_LOOKUP_TTL + 1):
+            self.assertEqual(aws.machine_lookup(session, 'auth.test.boss'), 'i-2-public')
+
+class TestDynamoScan(unittest.TestCase):
+    def session(self, pages):
+        """Session whose DynamoDB client returns the given list of pages for each segment"""
+        def scan(**kwargs):
+            idx = kwargs.get('ExclusiveStartKey', 0)
+            resp = {
+                'Items': [{'key': {'N': str(kwargs['Segment'] * 100 + i)}} for i in pages[idx]],
+                'ConsumedCapacity': {'CapacityUnits': 1.0},
+            }
+            if idx + 1 < len(pages):
+                resp['LastEvaluatedKey'] = idx + 1
+            return resp
+
+        session = MagicMock()
+        session.client.return_value.scan.side_effect = scan
+        return session
+
+    def test_scan(self):
+        session = self.session([[1, 2], [3]])
+        items = sorted(item['key'] for item in aws.dynamo_scan(session, 'table', segments=3, workers=2))
+        self.assertEqual(items, [1, 2, 3, 101, 102, 103, 201, 202, 203])
+
+        scan = session.client.return_value.scan
+        self.assertEqual(scan.call_count, 6)
+        self.assertEqual({c[1]['TotalSegments'] for c in scan.call_args_list}, {3})
+
+    def test_attributes(self):
+        session = self.session([[1]])
+        list(aws.dynamo_scan(session, 'table', segments=1, attributes=['key', 'size']))
+
+        kwargs = session.client.return_value.scan.call_args[1]
+        self.assertEqual(kwargs['ProjectionExpression'], '#a0, #a1')
+        self.assertEqual(kwargs['ExpressionAttributeNames'], {'#a0': 'key', '#a1': 'size'})
+
+    def test_error(self):
+        session = MagicMock()
+        session.client.return_value.scan.side_effect = Exception('throttled')
+        with self.assertRaises(Exception):
+            list(aws.dynamo_scan(session, 'table', segments=2))
+
+    def test_rate_limiter(self):
+        with patch.object(aws.time, 'monotonic', return_value=100), \
+             patch.object(aws.time, 'sleep') as sleep:
+            limiter = aws.RateLimiter(10)
+            limiter.consume(5)
+            limiter.wait()
+            sleep.assert_called_once_with(0.5)
+
+    def test_rate_limiter_acquire(self):
+        with patch.object(aws.time, 'monotonic', return_value=100), \
+             patch.object(aws.time, 'sleep') as sleep:
+            limiter = aws.RateLimiter(4)
+            limiter.acquire()
+            limiter.acquire()
+            limiter.acquire()
+            self.assertEqual([c[0][0] for c in sleep.call_args_list], [0.25, 0.5])
+
+    def test_to_file(self):
+        session = self.session([[1, 2]])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'items.ndjson')
+            count = aws.dynamo_scan_to_file(session, 'table', filename, segments=1)
+            self.assertEqual(count, 2)
+            with open(filename) as fh:
+                self.assertEqual(fh.read(), '{"key": 1}\n{"key": 2}\n')
+
+            filename = os.path.join(tmp, 'items.csv')
+            aws.dynamo_scan_to_file(session, 'table', filename, format='csv', segments=1)
+            with open(filename) as fh:
+                self.assertEqual(fh.read().splitlines(), ['key', '1', '2'])
@@ -0,0 +1,87 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import MagicMock
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import boss_rds
+
+LOOKUP = {
+    '1&1&1': ('coll', 'exp', 'chan1'),
+    '1&1&2': ('coll', 'exp', 'chan2'),
+    '1&2&3': ('coll', 'exp2', 'chan3'),
+}
+
+class FakeCursor(object):
+    """Cursor that answers `lookup_key IN (...)` queries from LOOKUP"""
+    def __init__(self):
+        self.queries = []
+
+    def execute(self, query, args):
+        self.queries.append(args)
+        self.rows = [(key,) + LOOKUP[key] for key in args if key in LOOKUP]
+
+    def fetchall(self):
+        return self.rows
+
+class TestNamesFromLookupKeys(unittest.TestCase):
+    def setUp(self):
+        self.cursor = FakeCursor()
+        self.bosslet_config = MagicMock()
+        self.bosslet_config.call.connect_rds.return_value.__enter__.return_value = self.cursor
+
+    def test_chunked(self):
+        keys = ['1&1&1', '1&2&3', '1&1&1', '9&9&9', '1&1&2']
+        names = boss_rds.sql_get_names_by_lookup_key(self.bosslet_config, keys, chunk_size=2)
+
+        self.assertEqual(names, dict(LOOKUP, **{'9&9&9': ('', '', '')}))
+        self.assertEqual(self.cursor.queries, [['1&1&1', '1&2&3'], ['9&9&9', '1&1&2']])
+
+    def test_list(self):
+        keys = ['1&1&2', '9&9&9', '1&1&2']
+        names = boss_rds.sql_get_names_from_lookup_keys(self.bosslet_config, keys)
+
+        self.assertEqual(names, [LOOKUP['1&1&2'], ('', '', ''), LOOKUP['1&1&2']])
+        self.assertEqual(len(self.cursor.queries), 1)
+
+    def test_existing_cursor(self):
+        names = boss_rds.sql_get_names_by_lookup_key(self.bosslet_config, ['1&1&1'], self.cursor)
+
+        self.assertEqual(names, {'1&1&1': LOOKUP['1&1&1']})
+        self.bosslet_config.call.connect_rds.assert_not_called()
+
+class TestLookupKeysFromNames(unittest.TestCase):
+    def test_chunked(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [('1&1&1', 'coll', 'exp', 'chan1'), ('1&1&2', 'coll', 'exp', 'chan2')],
+            [],
+        ]
+        channels = [('coll', 'exp', 'chan1'), ('coll', 'exp', 'chan2'),
+                    ('coll', 'exp', 'chan1'), ('coll', 'exp', 'missing')]
+
+        keys = boss_rds.sql_get_lookup_keys_from_names(None, channels, cursor, chunk_size=2)
+
+        self.assertEqual(keys, {('coll', 'exp', 'chan1'): '1&1&1',
+                                ('coll', 'exp', 'chan2'): '1&1&2'})
+        self.assertEqual(cursor.execute.call_count, 2)
+        query, args = cursor.execute.call_args_list[0][0]
+        self.assertIn('IN ((%s, %s, %s), (%s, %s, %s))', query)
+        self.assertEqual(args, ['coll', 'exp', 'chan1', 'coll', 'exp', 'chan2'])
@@ -0,0 +1,254 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import json
+import tempfile
+import multiprocessing
+from unittest.mock import patch, MagicMock
+from datetime import datetime, timedelta
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import cloudformation
+from lib.cloudformation import StackWaiter, CloudFormationConfiguration, Arg
+
+STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/CoreTestBoss/1'
+START = datetime(2019, 1, 1)
+
+class FakeClient(object):
+    """CloudFormation client that reveals one batch of events per sleep
+
+    Args:
+        batches (list[list[tuple]]): Batches of (logical id, status, seconds
+                                     since START) events
+        history (list[tuple]): Events from before the operation started
+        page_size (int): Number of events per describe_stack_events page
+    """
+    def __init__(self, batches, history=[], page_size=2):
+        self.batches = list(batches)
+        self.events = [] # newest first
+        self.page_size = page_size
+        self.calls = {'describe_stacks': 0, 'describe_stack_events': 0}
+        self.add(history)
+        self.reveal()
+
+    def add(self, batch):
+        for id_, status, seconds in batch:
+            self.events.insert(0, {
+                'EventId': str(len(self.events)),
+                'LogicalResourceId': id_,
+                'PhysicalResourceId': STACK_ID if id_ == 'CoreTestBoss' else id_ + '-physical',
+                'ResourceType': 'AWS::CloudFormation::Stack' if id_ == 'CoreTestBoss' else 'AWS::EC2::Instance',
+                'ResourceStatus': status,
+                'Timestamp': START + timedelta(seconds=seconds),
+            })
+
+    def reveal(self, *args):
+        if self.batches:
+            self.add(self.batches.pop(0))
+
+    def describe_stacks(self, StackName):
+        self.calls['describe_stacks'] += 1
+        status = [e['ResourceStatus'] for e in self.events
+                  if e['PhysicalResourceId'] == STACK_ID][0]
+        return {'Stacks': [{'StackId': STACK_ID, 'StackStatus': status}]}
+
+    def describe_stack_events(self, StackName, NextToken=0):
+        self.calls['describe_stack_events'] += 1
+        page = self.events[NextToken:NextToken + self.page_size]
+        resp = {'StackEvents': page}
+        if NextToken + self.page_size < len(self.events):
+            resp['NextToken'] = NextToken + self.page_size
+        return resp
+
+class TestStackWaiter(unittest.TestCase):
+    history = [('CoreTestBoss', 'CREATE_IN_PROGRESS', -100),
+               ('CoreTestBoss', 'CREATE_COMPLETE', -90)]
+
+    batches = [[('CoreTestBoss', 'UPDATE_IN_PROGRESS', 0),
+                ('Vault', 'UPDATE_IN_PROGRESS', 1),
+                ('Auth', 'UPDATE_IN_PROGRESS', 2)],
+               [],
+               [],
+               [('Auth', 'UPDATE_COMPLETE', 32)],
+               [('Vault', 'UPDATE_COMPLETE', 301),
+                ('CoreTestBoss', 'UPDATE_COMPLETE', 302)]]
+
+    def wait(self, client):
+        with patch('lib.cloudformation.time.sleep', side_effect=client.reveal) as sleep, \
+             patch('builtins.print'):
+            waiter = StackWaiter(client, 'CoreTestBoss')
+            status = waiter.wait('UPDATE_IN_PROGRESS')
+        return waiter, status, [c[0][0] for c in sleep.call_args_list]
+
+    def test_wait(self):
+        client = FakeClient(self.batches, self.history)
+        waiter, status, delays = self.wait(client)
+
+        self.assertEqual(status, 'UPDATE_COMPLETE')
+        self.assertEqual(waiter.slowest(), [('Vault', 'AWS::EC2::Instance', 300.0),
+                                            ('Auth', 'AWS::EC2::Instance', 30.0)])
+        # One describe for the stack id and one after the final stack event
+        self.assertEqual(client.calls['describe_stacks'], 2)
+
+    def test_backoff(self):
+        client = FakeClient(self.batches, self.history)
+        waiter, status, delays = self.wait(client)
+
+        self.assertEqual(delays[0], StackWaiter.MIN_DELAY)
+        self.assertGreater(delays[1], delays[0])
+        self.assertGreater(delays[2], delays[1])
+        self.assertEqual(delays[3], StackWaiter.MIN_DELAY)
+
+    def test_history_skipped(self):
+        client = FakeClient(self.batches, self.history)
+        waiter, status, delays = self.wait(client)
+
+        # The first CREATE_IN_PROGRESS / CREATE_COMPLETE are not counted
+        self.assertNotIn('CoreTestBoss', waiter.started)
+        self.assertEqual(len(waiter.timings), 2)
+
+    def test_start_not_found(self):
+        # Multiple pages of history that don't include the operation's start
+        history = [('CoreTestBoss', 'CREATE_IN_PROGRESS', -100),
+                   ('Vault', 'CREATE_IN_PROGRESS', -99),
+                   ('Auth', 'CREATE_IN_PROGRESS', -98),
+                   ('Auth', 'CREATE_COMPLETE', -92),
+                   ('Vault', 'CREATE_COMPLETE', -91),
+                   ('CoreTestBoss', 'CREATE_COMPLETE', -90)]
+        client = FakeClient([[], [('Auth', 'UPDATE_COMPLETE', 32)]], history)
+        waiter = StackWaiter(client, 'CoreTestBoss')
+
+        self.assertEqual(waiter.new_events('UPDATE_IN_PROGRESS'), [])
+        self.assertEqual(client.calls['describe_stack_events'], 3)
+
+        client.reveal()
+        events = waiter.new_events('UPDATE_IN_PROGRESS')
+        self.assertEqual([(e['LogicalResourceId'], e['ResourceStatus']) for e in events],
+                         [('Auth', 'UPDATE_COMPLETE')])
+
+class TestIsUnchanged(unittest.TestCase):
+    def config(self, password='secret'):
+        bosslet_config = MagicMock()
+        bosslet_config.INTERNAL_DOMAIN = 'test.boss'
+        bosslet_config.force_update = False
+        bosslet_config.names.__getitem__.return_value.stack = 'CoreTestBoss'
+
+        config = CloudFormationConfiguration('core', bosslet_config)
+        config.add_arg(Arg.String('Name', 'value'))
+        config.add_arg(Arg.Password('Password', password))
+        config.resources['Queue'] = {'Type': 'AWS::SQS::Queue'}
+        return config
+
+    def client(self, config, template=None, parameters=None):
+        if template is None:
+            template = json.loads(config._create_template())
+        if parameters is None:
+            parameters = {'Name': 'value', 'Password': '****'}
+
+        client = MagicMock()
+        client.get_template.return_value = {'TemplateBody': template}
+        client.describe_stacks.return_value = {'Stacks': [{
+            'Tags': [{'Key': 'StackVersion', 'Value': '1'}],
+            'Parameters': [{'ParameterKey': k, 'ParameterValue': v}
+                           for k, v in parameters.items()],
+        }]}
+        config.session.client.return_value = client
+        return client
+
+    @patch('lib.cloudformation.load_template_hash')
+    def test_unchanged(self, load_template_hash):
+        config = self.config()
+        client = self.client(config)
+        load_template_hash.return_value = config.content_hash()
+
+        self.assertTrue(config.is_unchanged(client))
+        load_template_hash.assert_called_with('test.boss/core')
+
+    @patch('lib.cloudformation.load_template_hash')
+    def test_template_changed(self, load_template_hash):
+        config = self.config()
+        client = self.client(config, template={'Resources': {}})
+        load_template_hash.return_value = config.content_hash()
+
+        self.assertFalse(config.is_unchanged(client))
+
+    @patch('lib.cloudformation.load_template_hash')
+    def test_argument_changed(self, load_template_hash):
+        config = self.config()
+        client = self.client(config, parameters={'Name': 'old', 'Password': '****'})
+        load_template_hash.return_value = config.content_hash()
+
+        self.assertFalse(config.is_unchanged(client))
+
+    @patch('lib.cloudformation.load_template_hash')
+    def test_hidden_argument_changed(self, load_template_hash):
+        config = self.config()
+        client = self.client(config)
+        load_template_hash.return_value = self.config('new secret').content_hash()
+
+        self.assertFalse(config.is_unchanged(client))
+
+    @patch('lib.cloudformation.load_template_hash')
+    def test_update_skipped(self, load_template_hash):
+        config = self.config()
+        client = self.client(config)
+        load_template_hash.return_value = config.content_hash()
+
+        with patch('lib.cloudformation.console'):
+            self.assertFalse(config.update())
+
+        client.create_change_set.assert_not_called()
+        client.update_stack.assert_not_called()
+
+class TestSaveTemplateHash(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'hashes.json')
+        patches = [patch.object(cloudformation, 'TEMPLATE_HASHES', path),
+                   patch.object(cloudformation, 'TEMPLATE_HASHES_LOCK', path + '.lock')]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def test_save(self):
+        cloudformation.save_template_hash('test.boss/core', 'a')
+        cloudformation.save_template_hash('test.boss/api', 'b')
+        cloudformation.save_template_hash('test.boss/core', 'c')
+
+        self.assertEqual(cloudformation.load_template_hash('test.boss/core'), 'c')
+        self.assertEqual(cloudformation.load_template_hash('test.boss/api'), 'b')
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['hashes.json', 'hashes.json.lock'])
+
+    def test_concurrent_processes(self):
+        def save(config):
+            for i in range(20):
+                cloudformation.save_template_hash('test.boss/' + config, str(i))
+
+        ctx = multiprocessing.get_context('fork')
+        configs = ['core', 'api', 'redis', 'cachedb']
+        procs = [ctx.Process(target=save, args=(config,)) for config in configs]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+        for config in configs:
+            self.assertEqual(cloudformation.load_template_hash('test.boss/' + config), '19')
@@ -0,0 +1,88 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import patch, MagicMock
+import contextlib
+import threading
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import external
+from lib.external import ExternalCalls
+
+class TestConnectRDS(unittest.TestCase):
+    def setUp(self):
+        self.tunnels = []
+
+        @contextlib.contextmanager
+        def tunnel(target, port, type_):
+            self.tunnels.append('open')
+            yield 1234
+            self.tunnels.append('closed')
+
+        vault = MagicMock()
+        vault.return_value.__enter__.return_value.read.return_value = {
+            'user': 'user', 'password': 'password', 'port': 3306, 'name': 'boss'
+        }
+
+        # Create the object without looking up the bastion and vault instances
+        self.call = ExternalCalls.__new__(ExternalCalls)
+        self.call.names = MagicMock()
+        self.call.rds = None
+        self.call.rds_context = None
+        self.call.rds_lock = threading.RLock()
+        self.call.vault = vault
+        self.call.tunnel = tunnel
+
+        patcher = patch.object(external.connector, 'connect')
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reused(self):
+        for _ in range(3):
+            with self.call.connect_rds() as cursor:
+                cursor.execute('SELECT 1')
+
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertEqual(self.tunnels, ['open'])
+        self.assertEqual(self.connect.return_value.rollback.call_count, 3)
+
+        self.call.close_rds()
+        self.assertEqual(self.tunnels, ['open', 'closed'])
+        self.connect.return_value.close.assert_called_once_with()
+
+    def test_reconnect(self):
+        with self.call.connect_rds():
+            pass
+
+        self.connect.return_value.ping.side_effect = external.connector.InterfaceError()
+        with self.call.connect_rds():
+            pass
+
+        self.assertEqual(self.connect.call_count, 2)
+        self.assertEqual(self.tunnels, ['open', 'closed', 'open'])
+
+    def test_pool_context(self):
+        with self.call.rds_pool():
+            with self.call.connect_rds():
+                pass
+            self.assertEqual(self.tunnels, ['open'])
+
+        self.assertEqual(self.tunnels, ['open', 'closed'])
+        self.assertIsNone(self.call.rds)
@@ -0,0 +1,190 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import threading
+from unittest.mock import patch, MagicMock
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import lambdas
+from lib.exceptions import BossManageError, CircularDependencyError
+
+LAYERS = {
+    'multi_lambda': ['spdb_layer'],
+    'ingest_populate': ['spdb_layer', 'boto_layer'],
+    'cache_throttle': [],
+    'spdb_layer': [],
+    'boto_layer': [],
+}
+
+@patch.object(lambdas, 'BUILT_ZIPS', new_callable=list)
+@patch.object(lambdas, 'lambda_layers', side_effect=lambda d: LAYERS[d])
+class TestBuildLambdas(unittest.TestCase):
+    def setUp(self):
+        self.bosslet_config = MagicMock()
+        self.bosslet_config.LAMBDA_SERVER = 'build-server'
+        self.lock = threading.Lock()
+        self.finished = []
+
+    def build(self, failing=()):
+        def build_lambda(bosslet_config, lambda_dir, force, containers, s3):
+            self.assertIs(s3, self.bosslet_config.session.client.return_value)
+            for layer in LAYERS[lambda_dir]:
+                self.assertIn(layer, self.finished)
+            if lambda_dir in failing:
+                raise BossManageError("Return code: 1")
+            with self.lock:
+                self.finished.append(lambda_dir)
+        return patch.object(lambdas, 'build_lambda', side_effect=build_lambda)
+
+    def test_layers_first(self, layers, built):
+        with self.build():
+            lambdas.build_lambdas(self.bosslet_config,
+                                  ['multi_lambda', 'ingest_populate', 'cache_throttle'])
+
+        self.assertEqual(sorted(self.finished), sorted(LAYERS.keys()))
+        self.assertEqual(sorted(built), sorted(LAYERS.keys()))
+        self.bosslet_config.session.client.assert_called_once_with('s3')
+
+    def test_already_built(self, layers, built):
+        built.extend(['spdb_layer', 'multi_lambda'])
+        self.finished.extend(built)
+
+        with self.build():
+            lambdas.build_lambdas(self.bosslet_config, ['multi_lambda', 'ingest_populate'])
+
+        self.assertEqual(sorted(self.finished[2:]), ['boto_layer', 'ingest_populate'])
+
+    def test_failed_layer(self, layers, built):
+        with self.build(failing=['spdb_layer']):
+            with self.assertRaises(BossManageError) as ctx:
+                lambdas.build_lambdas(self.bosslet_config, ['multi_lambda', 'cache_throttle'])
+
+        self.assertIn('spdb_layer: Return code: 1', ctx.exception.causes)
+        self.assertIn('Not built: multi_lambda', ctx.exception.causes)
+        self.assertNotIn('multi_lambda', self.finished)
+
+    def test_circular(self, layers, built):
+        layers.side_effect = lambda d: {'a_layer': ['b_layer'], 'b_layer': ['a_layer']}[d]
+
+        with self.build():
+            with self.assertRaises(CircularDependencyError):
+                lambdas.build_lambdas(self.bosslet_config, ['a_layer'])
+
+@patch.object(lambdas.utils, 'run')
+@patch.object(lambdas.subprocess, 'run')
+class TestBuildContainers(unittest.TestCase):
+    def test_setup_once(self, start, run):
+        start.return_value.stdout = 'container-id\n'
+        containers = lambdas.BuildContainers('docker', {})
+
+        threads = [threading.Thread(target=containers.run, args=('python3.7', 'build'))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        start.assert_called_once()
+        cmds = [c[0][0] for c in run.call_args_list]
+        self.assertEqual(cmds[0], 'docker exec container-id ' + lambdas.CONTAINER_SETUP_CMD)
+        self.assertEqual(cmds[1:], ['docker exec container-id build'] * 4)
+
+    def test_setup_failed(self, start, run):
+        start.return_value.stdout = 'container-id\n'
+        run.side_effect = [Exception("Return code: 1"), 0]
+        containers = lambdas.BuildContainers('docker', {})
+
+        with self.assertRaises(Exception):
+            containers.container('python3.7')
+
+        run.assert_called_with('docker stop container-id', checkreturn=False)
+        self.assertEqual(containers.containers, {})
+
+def client_error(code):
+    return lambdas.botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': code}},
+                                                   'UpdateFunctionCode')
+
+@patch.object(lambdas.time, 'sleep')
+@patch.object(lambdas, 'load_lambda_config', return_value={'name': 'multilambda'})
+@patch.object(lambdas, 'lambda_dirs', return_value={'a': 'multi_lambda',
+                                                    'b': 'multi_lambda',
+                                                    'c': 'multi_lambda',
+                                                    'throttle': 'cache_throttle'})
+class TestUpdateFunctions(unittest.TestCase):
+    def setUp(self):
+        self.bosslet_config = MagicMock()
+        self.bosslet_config.INTERNAL_DOMAIN = 'test.boss'
+        self.client = self.bosslet_config.session.client.return_value
+        self.client.update_function_code.return_value = {'CodeSha256': 'sha'}
+        self.client.get_function_configuration.return_value = {'LastUpdateStatus': 'Successful'}
+
+    def test_zip_functions(self, dirs, config, sleep):
+        self.assertEqual(lambdas.zip_functions(self.bosslet_config),
+                         {'multi_lambda': ['a', 'b', 'c'], 'cache_throttle': ['throttle']})
+
+    def test_throttled(self, dirs, config, sleep):
+        self.client.update_function_code.side_effect = [client_error('TooManyRequestsException'),
+                                                        {'CodeSha256': 'sha'}]
+
+        lambdas.update_functions(self.bosslet_config, ['a', 'a'])
+
+        self.assertEqual(self.client.update_function_code.call_count, 2)
+        self.client.update_function_code.assert_called_with(FunctionName='a',
+                                                            S3Bucket=self.bosslet_config.LAMBDA_BUCKET,
+                                                            S3Key='multilambda.test.boss.zip')
+        self.client.publish_version.assert_called_once_with(FunctionName='a', CodeSha256='sha')
+
+    def test_publish_after_successful(self, dirs, config, sleep):
+        self.client.get_function_configuration.side_effect = [{'LastUpdateStatus': 'InProgress'},
+                                                              {'LastUpdateStatus': 'Successful'}]
+
+        lambdas.update_functions(self.bosslet_config, ['a'])
+
+        self.assertEqual(self.client.get_function_configuration.call_count, 2)
+        self.client.publish_version.assert_called_once_with(FunctionName='a', CodeSha256='sha')
+
+    def test_update_lambda_code(self, dirs, config, sleep):
+        def update(FunctionName, **kwargs):
+            if FunctionName == 'b':
+                raise client_error('ResourceNotFoundException')
+            return {'CodeSha256': 'sha'}
+        self.client.update_function_code.side_effect = update
+
+        lambdas.update_lambda_code(self.bosslet_config)
+
+        published = sorted(c[1]['FunctionName'] for c in self.client.publish_version.call_args_list)
+        self.assertEqual(published, ['a', 'c'])
+
+    def test_single_client(self, dirs, config, sleep):
+        lambdas.update_functions(self.bosslet_config, ['a', 'b', 'c'])
+
+        self.bosslet_config.session.client.assert_called_once_with('lambda')
+        self.assertEqual(self.client.publish_version.call_count, 3)
+
+    def test_failed(self, dirs, config, sleep):
+        self.client.get_function_configuration.return_value = {'LastUpdateStatus': 'Failed',
+                                                               'LastUpdateStatusReason': 'Bad zip'}
+
+        with self.assertRaises(BossManageError) as ctx:
+            lambdas.update_functions(self.bosslet_config, ['a', 'throttle'])
+
+        self.assertEqual(ctx.exception.causes, ['a: Update failed: Bad zip',
+                                                'throttle: Update failed: Bad zip'])
+        self.client.publish_version.assert_not_called()
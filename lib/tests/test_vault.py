@@ -0,0 +1,98 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import patch
+import io
+import json
+import threading
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib.vault import Vault
+
+class FakeClient(object):
+    """In memory version of the hvac.Client methods used by Vault export / import"""
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+        self.lock = threading.Lock()
+
+    def read(self, path):
+        with self.lock:
+            self.reads.append(path)
+        return {'data': self.data[path]} if path in self.data else None
+
+    def list(self, path):
+        keys = set()
+        for key in self.data:
+            if key.startswith(path):
+                key = key[len(path):]
+                keys.add(key.split('/', 1)[0] + ('/' if '/' in key else ''))
+        return {'data': {'keys': sorted(keys)}} if keys else None
+
+    def write(self, path, **kwargs):
+        with self.lock:
+            self.data[path] = kwargs
+
+DATA = {
+    'secret/a': {'password': 'a'},
+    'secret/a/b': {'password': 'ab'},
+    'secret/a/c/d': {'password': 'acd'},
+    'secret/e': {'password': 'e'},
+}
+
+class TestVaultExport(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient(dict(DATA))
+        self.vault = Vault(None, proxy = False)
+        patcher = patch.object(Vault, 'connect', return_value = self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_export(self):
+        self.assertEqual(self.vault.export('secret/'), DATA)
+
+    def test_export_single_read(self):
+        self.vault.export('secret')
+        self.assertEqual(sorted(self.client.reads),
+                         ['secret', 'secret/a', 'secret/a/b', 'secret/a/c', 'secret/a/c/d', 'secret/e'])
+
+    def test_export_exclude(self):
+        data = self.vault.export('secret/', exclude = ['secret/a/'])
+        self.assertEqual(data, {'secret/a': {'password': 'a'},
+                                'secret/e': {'password': 'e'}})
+        self.assertNotIn('secret/a/b', self.client.reads)
+
+    def test_ndjson_round_trip(self):
+        fh = io.StringIO()
+        self.assertEqual(self.vault.export_ndjson('secret/', fh), 4)
+
+        lines = [json.loads(line) for line in fh.getvalue().splitlines()]
+        self.assertEqual({line['path']: line['data'] for line in lines}, DATA)
+
+        self.client.data = {}
+        fh.seek(0)
+        self.assertEqual(self.vault.import_ndjson(fh), 4)
+        self.assertEqual(self.client.data, DATA)
+
+    def test_import_update(self):
+        self.vault.import_({'secret/a': {'username': 'a'},
+                            'secret/f': {'password': 'f'}}, update = True)
+        self.assertEqual(self.client.data['secret/a'], {'password': 'a', 'username': 'a'})
+        self.assertEqual(self.client.data['secret/f'], {'password': 'f'})
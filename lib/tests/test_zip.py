@@ -0,0 +1,122 @@
+# Copyright 2019 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import hashlib
+import tempfile
+import zipfile
+import threading
+from unittest.mock import patch
+import os, sys
+
+# Allow unit test files to import the target library modules
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.normpath(os.path.join(cur_dir, '..', '..'))
+sys.path.append(parent_dir)
+
+from lib import zip
+from lib.zip import ZipBuilder, FIXED_DATE_TIME
+
+class TestZipBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'pkg', '.git'))
+        self.write('pkg/module.py', 'print("module")\n' * 100)
+        self.write('pkg/.git/HEAD', 'ref')
+        self.write('handler.py', 'def handler(): pass\n')
+        os.symlink('handler.py', os.path.join(self.src, 'link.py'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        with open(os.path.join(self.src, name), 'w') as fh:
+            fh.write(data)
+
+    def build(self, name):
+        builder = ZipBuilder(workers=2)
+        builder.add(os.path.join(self.src, 'pkg'), 'lib/pkg')
+        builder.add(os.path.join(self.src, 'link.py'), 'link.py')
+        builder.add(os.path.join(self.src, 'handler.py'), 'handler.py')
+
+        zippath = os.path.join(self.tmp.name, name)
+        builder.write(zippath)
+        return zippath
+
+    def test_contents(self):
+        cwd = os.getcwd()
+        with zipfile.ZipFile(self.build('lambda.zip')) as fzip:
+            self.assertIsNone(fzip.testzip())
+            self.assertEqual(fzip.namelist(),
+                             ['handler.py', 'lib/pkg/', 'lib/pkg/module.py', 'link.py'])
+            self.assertEqual(fzip.read('lib/pkg/module.py'), b'print("module")\n' * 100)
+            self.assertEqual(fzip.read('link.py'), b'handler.py')
+            self.assertEqual(fzip.getinfo('link.py').external_attr >> 28, 0xA)
+            self.assertEqual(fzip.getinfo('handler.py').date_time, FIXED_DATE_TIME)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_deterministic(self):
+        first = self.build('first.zip')
+        os.utime(os.path.join(self.src, 'handler.py'), (0, 0))
+        second = self.build('second.zip')
+
+        with open(first, 'rb') as a, open(second, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+    def test_read_ahead(self):
+        for i in range(50):
+            self.write('file{:02}.py'.format(i), str(i))
+
+        lock = threading.Lock()
+        counts = {'read': 0, 'written': 0, 'max': 0}
+
+        builder = ZipBuilder(workers=2)
+        read = builder._read
+        def _read(entry):
+            with lock:
+                counts['read'] += 1
+                counts['max'] = max(counts['max'], counts['read'] - counts['written'])
+            return read(entry)
+
+        writestr = zipfile.ZipFile.writestr
+        def _writestr(fzip, *args, **kwargs):
+            with lock:
+                counts['written'] += 1
+            return writestr(fzip, *args, **kwargs)
+
+        builder.add(self.src, 'src')
+        with patch.object(builder, '_read', side_effect=_read), \
+             patch.object(zipfile.ZipFile, 'writestr', _writestr):
+            builder.write(os.path.join(self.tmp.name, 'lambda.zip'))
+
+        self.assertEqual(counts['written'], len(builder.manifest))
+        # The entry being written plus the entries read ahead of it
+        self.assertLessEqual(counts['max'], 2 * zip.READ_AHEAD + 1)
+
+    def test_manifest_hash(self):
+        # Hash of the unzipped files, as calculated by build_lambda.py
+        expected = hashlib.sha1()
+        for name, data in [('./handler.py', b'def handler(): pass\n'),
+                           ('./lib/pkg/module.py', b'print("module")\n' * 100),
+                           ('./link.py', b'handler.py')]:
+            line = '{}  {}\n'.format(hashlib.sha1(data).hexdigest(), name)
+            expected.update(line.encode('utf-8'))
+
+        builder = ZipBuilder()
+        builder.add(os.path.join(self.src, 'link.py'), 'link.py')
+        builder.add(os.path.join(self.src, 'pkg'), 'lib/pkg')
+        builder.add(os.path.join(self.src, 'handler.py'), 'handler.py')
+
+        self.assertEqual(builder.manifest_hash(), expected.hexdigest())
@@ -17,6 +17,8 @@ import glob
 import hvac
 import json
 import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pprint import pprint
 import traceback
 
@@ -29,6 +31,9 @@ VAULT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "vaul
 POLICY_DIR = os.path.join(VAULT_DIR, "policies")
 PRIVATE_DIR = os.path.join(VAULT_DIR, "private")
 
+# Number of concurrent Vault requests made by export / import
+VAULT_WORKERS = 16
+
 class Vault(object):
     def __init__(self, machine, ip = None, proxy = True):
         # If the machine is X.vault.vpc.boss remove the X.
@@ -53,6 +58,8 @@ class Vault(object):
         else:
             self.proxy = {} # DP XXX: {} or None???
 
+        self.session = None
+
     def path(self, filename):
         """Get the complete file path for given machine's private file.
         Args:
@@ -68,8 +75,19 @@ class Vault(object):
 
         return path
 
+    def http_session(self):
+        """Get the HTTP session shared by all connections to this Vault, so that
+        connections are reused, with enough connections for VAULT_WORKERS threads
+        """
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize = VAULT_WORKERS)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        return self.session
+
     def connect(self, read_token = None):
-        client = hvac.Client(url=self.url, proxies=self.proxy)
+        client = hvac.Client(url=self.url, proxies=self.proxy, session=self.http_session())
 
         if read_token is not None:
             token_file = self.path(read_token)
@@ -468,47 +486,169 @@ class Vault(object):
         client = self.connect(VAULT_TOKEN)
         client.delete(path)
 
-    def export(self, path):
+    def export(self, path, exclude = (), workers = VAULT_WORKERS):
         """A generic method for reading all of the paths and keys from Vault.
 
         Args:
             path (string) : Vault path to dump data from
+            exclude (list[string]) : Vault path prefixes to not export
+            workers (int) : Number of concurrent Vault requests
+
+        Returns:
+            dict : Dict of Vault path and dict of key / values stored at the path
+        """
+        return dict(self.export_iter(path, exclude, workers))
+
+    def export_iter(self, path, exclude = (), workers = VAULT_WORKERS):
+        """Read all of the paths and keys from Vault, listing and reading paths concurrently.
+
+        Each path is read once, even if data is stored at both key and paths under key.
+
+        Args:
+            path (string) : Vault path to dump data from
+            exclude (list[string]) : Vault path prefixes to not export
+            workers (int) : Number of concurrent Vault requests
+
+        Returns:
+            generator : Generator yielding tuples of (Vault path, dict of key / values)
+                        as they are read, in no specific order
         """
         if path[-1] != '/':
             path += '/'
 
-        rtn = {}
+        def excluded(key):
+            return any(key.startswith(prefix) for prefix in exclude)
+
+        def read(key):
+            results = client.read(key)
+            return None if results is None else results['data']
+
+        def list_(key):
+            results = client.list(key)
+            return [] if results is None else results['data']['keys']
 
         # DP NOTE: not using self.read becuase of the different token needed
         client = self.connect(VAULT_TOKEN)
-        results =  client.read(path[:-1])
-        if results is not None:
-            rtn[path[:-1]] = results['data']
-
-        results = client.list(path)
-        for key in results['data']['keys']:
-            key = path + key
-            if key[-1] == '/':
-                data = self.export(key)
-                rtn.update(data)
-            else:
-                # DP NOTE: This will currently do a duplicate read if
-                #          data is stored at key and in paths under
-                #          key
-                #          To prevent this, check to see if (key + '/') is in keys
-                data = self.read(key)
-                rtn[key] = data['data']
+        with ThreadPoolExecutor(workers) as executor:
+            running = {}
+            if not excluded(path[:-1]):
+                running[executor.submit(read, path[:-1])] = ('read', path[:-1])
+            running[executor.submit(list_, path)] = ('list', path)
+
+            while len(running) > 0:
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    action, key = running.pop(future)
+                    result = future.result()
+
+                    if action == 'read':
+                        if result is not None:
+                            yield key, result
+                        continue
+
+                    keys = [key + k for k in result]
+                    for k in keys:
+                        if excluded(k):
+                            continue
+                        elif k[-1] == '/':
+                            running[executor.submit(list_, k)] = ('list', k)
+                            # Data can also be stored at the directory's path
+                            if k[:-1] not in keys and not excluded(k[:-1]):
+                                running[executor.submit(read, k[:-1])] = ('read', k[:-1])
+                        else:
+                            running[executor.submit(read, k)] = ('read', k)
+
+    def export_ndjson(self, path, fh, exclude = (), workers = VAULT_WORKERS):
+        """Export all of the paths and keys from Vault as newline delimited JSON
+
+        Each line is a Json object {"path": <Vault path>, "data": <dict of key / values>}
+        and is written as soon as the path is read.
+
+        Args:
+            path (string) : Vault path to dump data from
+            fh (file) : File object to write the NDJSON data to
+            exclude (list[string]) : Vault path prefixes to not export
+            workers (int) : Number of concurrent Vault requests
+
+        Returns:
+            int : Number of Vault paths exported
+        """
+        start = time.time()
+        count = 0
+        for key, data in self.export_iter(path, exclude, workers):
+            fh.write(json.dumps({'path': key, 'data': data}, sort_keys=True) + '\n')
+            count += 1
 
-        return rtn
+        print("Exported {} paths in {:.2f} seconds".format(count, time.time() - start))
+        return count
 
-    def import_(self, exported, update=False):
+    def import_(self, exported, update=False, workers = VAULT_WORKERS):
         """A generic method for writing / updating data in multiple paths in Vault.
 
         Args:
             exported (dict): Dict of Vault path and dict of key / values to store at the path
             update (bool): If an Update should be done or if a Write should be done
+            workers (int) : Number of concurrent Vault requests
         """
-        for path in exported:
-            kv = exported[path]
-            fn = self.update if update else self.write
-            fn(path, **kv)
+        return self.import_iter(exported.items(), update, workers)
+
+    def import_iter(self, exported, update=False, workers = VAULT_WORKERS):
+        """Write / update data in multiple paths in Vault concurrently.
+
+        At most 2 * workers paths are held in memory at a time.
+
+        Args:
+            exported (iterable): Iterable of tuples of (Vault path, dict of key / values)
+            update (bool): If an Update should be done or if a Write should be done
+            workers (int) : Number of concurrent Vault requests
+
+        Returns:
+            int : Number of Vault paths imported
+        """
+        client = self.connect(VAULT_TOKEN)
+
+        def write(path, kv):
+            if update:
+                existing = client.read(path)
+                if existing is not None:
+                    kv = dict(existing['data'], **kv)
+            client.write(path, **kv)
+
+        count = 0
+        with ThreadPoolExecutor(workers) as executor:
+            running = set()
+            for path, kv in exported:
+                if len(running) >= workers * 2:
+                    done, running = wait(running, return_when = FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                running.add(executor.submit(write, path, kv))
+                count += 1
+
+            for future in running:
+                future.result()
+
+        return count
+
+    def import_ndjson(self, fh, update=False, workers = VAULT_WORKERS):
+        """Import newline delimited JSON data created by export_ndjson() into Vault
+
+        Args:
+            fh (file) : File object to read the NDJSON data from
+            update (bool): If an Update should be done or if a Write should be done
+            workers (int) : Number of concurrent Vault requests
+
+        Returns:
+            int : Number of Vault paths imported
+        """
+        def entries():
+            for line in fh:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry['path'], entry['data']
+
+        start = time.time()
+        count = self.import_iter(entries(), update, workers)
+
+        print("Imported {} paths in {:.2f} seconds".format(count, time.time() - start))
+        return count
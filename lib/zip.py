@@ -14,7 +14,11 @@
 
 import os
 import shutil
+import hashlib
+import itertools
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 def zip_directory(directory, name = "lambda"):
     target = os.path.join(tempfile.mkdtemp(), name)
@@ -81,3 +85,163 @@ def write_to_zip(path, zippath, append=True, arcname=None):
         write_zip_file(path, fzip, arcname)
     fzip.close()
 
+
+
+# Timestamp given to every entry written by ZipBuilder, so that the archive
+# only depends on the contents of the files (the earliest date zip supports)
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Default zlib compression level used by ZipBuilder
+DEFAULT_COMPRESSION = 6
+
+# Default number of threads ZipBuilder uses to read files
+DEFAULT_WORKERS = 4
+
+# Number of files each ZipBuilder thread reads ahead of the entry being written
+READ_AHEAD = 2
+
+class ZipBuilder(object):
+    """Build a zip archive from a manifest of files in a single pass
+
+    Entries are collected using add() and then written by write(), which
+    opens the zip archive once, reads a bounded number of files ahead in
+    parallel, and writes the entries sorted by name with a fixed timestamp
+    and normalized permissions. Identical inputs produce byte identical zip
+    archives.
+
+    Paths are used as given, the current working directory is never changed.
+
+    Args:
+        compresslevel (int): zlib compression level (0 - 9) to use
+        workers (int|None): Number of threads used to read files,
+                            defaults to DEFAULT_WORKERS
+    """
+
+    def __init__(self, compresslevel=DEFAULT_COMPRESSION, workers=None):
+        self.compresslevel = compresslevel
+        self.workers = workers or DEFAULT_WORKERS
+        self.manifest = {} # arcname -> path
+
+    def add(self, path, arcname=None):
+        """Add a file, directory or symlink to the manifest
+
+        Directories are added recursively, skipping any '.git' directories.
+        Symlinks are stored as links and not followed.
+
+        Args:
+            path (str): Path to the file, directory, or symlink to add
+            arcname (str|None): Name to give the file or directory in the zip archive,
+                                defaults to path
+        """
+        path = str(path)
+        if arcname is None:
+            arcname = path
+
+        self.manifest[arcname] = path
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path):
+                dst = arcname + root[len(path):]
+
+                if '.git' in dirs:
+                    dirs.remove('.git')
+                for name in dirs + files:
+                    self.manifest[os.path.join(dst, name)] = os.path.join(root, name)
+
+    def manifest_hash(self):
+        """Calculate the hash of the files in the manifest without building the zip
+
+        The hash matches the hash build_lambda.py calculates for the unzipped
+        files: the SHA1 of the sorted `sha1sum` output for each file (symlinks
+        are unzipped as files containing the link target), so it can be compared
+        with the 'build-hash' metadata of an existing lambda code zip.
+
+        Returns:
+            str: Hex digest of the manifest hash
+        """
+        lines = []
+        for arcname, path in self.manifest.items():
+            if os.path.islink(path):
+                data = os.readlink(path).encode('utf-8')
+            elif os.path.isdir(path):
+                continue
+            else:
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+
+            name = './' + self._arcname(arcname)
+            lines.append((name.encode('utf-8'), hashlib.sha1(data).hexdigest()))
+
+        digest = hashlib.sha1()
+        for name, file_hash in sorted(lines):
+            digest.update(file_hash.encode('utf-8') + b'  ' + name + b'\n')
+        return digest.hexdigest()
+
+    @staticmethod
+    def _arcname(arcname):
+        """Normalize an arcname to the form stored in the zip archive"""
+        return arcname.replace(os.sep, '/').lstrip('/')
+
+    def _read(self, entry):
+        """Create the ZipInfo and read the data for a single manifest entry
+
+        Args:
+            entry (tuple[str, str]): Tuple of (arcname, path)
+
+        Returns:
+            tuple[ZipInfo, bytes]: ZipInfo with the fixed timestamp, file mode,
+                                   and compression type set and the data for
+                                   the entry
+        """
+        arcname, path = entry
+        arcname = self._arcname(arcname)
+
+        if os.path.islink(path):
+            data = os.readlink(path).encode('utf-8')
+            mode = 0o120755
+        elif os.path.isdir(path):
+            arcname += '/'
+            data = b''
+            mode = 0o40755
+        else:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            executable = os.stat(path).st_mode & 0o111
+            mode = 0o100755 if executable else 0o100644
+
+        zinfo = zipfile.ZipInfo(arcname, FIXED_DATE_TIME)
+        zinfo.create_system = 3 # Unix, so external_attr contains the file mode
+        zinfo.external_attr = mode << 16
+        if arcname.endswith('/'):
+            zinfo.external_attr |= 0x10 # MS-DOS directory flag
+
+        if data and not os.path.islink(path):
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+        else:
+            zinfo.compress_type = zipfile.ZIP_STORED
+
+        return zinfo, data
+
+    def write(self, zippath):
+        """Write all of the entries in the manifest into a new zip archive
+
+        Args:
+            zippath (str): Path to the zip archive to create, any existing
+                           file is overwritten
+        """
+        entries = iter(sorted(self.manifest.items()))
+
+        with ThreadPoolExecutor(self.workers) as executor, \
+             zipfile.ZipFile(str(zippath), 'w') as fzip:
+            # The following files are read while the current one is compressed
+            # (zlib releases the GIL while compressing). Only READ_AHEAD files
+            # per worker are read ahead, so the whole manifest is never in memory
+            pending = deque()
+            for entry in itertools.islice(entries, self.workers * READ_AHEAD):
+                pending.append(executor.submit(self._read, entry))
+
+            while len(pending) > 0:
+                zinfo, data = pending.popleft().result()
+                for entry in itertools.islice(entries, 1):
+                    pending.append(executor.submit(self._read, entry))
+
+                fzip.writestr(zinfo, data, compresslevel=self.compresslevel)
@@ -19,16 +19,35 @@
 # * AWS Authentication configuration
 # * AWS secret backend configuration
 #
+# Backups are incremental. Each backup directory contains
+# * index.json: the policies and AWS configuration, the content hash of every
+#               secret/ path, and the chain of backup directories, starting
+#               with the last full backup, needed to restore the secrets
+# * secrets.json: the data of the secret/ paths that changed since the
+#                 previous backup in the chain (all paths for a full backup)
+#
+# Older backups containing a single export.json file can still be restored
+#
 # NOTE: Restore expects to restore into a Vault that has already been configured
 #       (using lib/vault.py:Vault.configure) so that the different backends are
 #       ready for data
 
 from bossutils.vault import Vault
+import boto3
+import hashlib
+import re
 import sys
 import os
 import json
 
-def export(v, path):
+# Number of incremental backups after a full backup before the next full backup
+# Keeps the restore chain well under the backup bucket's 180 day expiration
+FULL_BACKUP_INTERVAL = 8
+
+# Format of the backup directory names ('YYYY-ww')
+BACKUP_DIRECTORY = re.compile(r'^\d{4}-\d{2}$')
+
+def export(v, path, read_path=True):
     """Recursive function for exporting all paths and data"""
     # DP NOTE: Taken from lib/vault.py:Vault.export
     if path[-1] != '/':
@@ -36,15 +55,17 @@ def export(v, path):
 
     rtn = {}
 
-    results =  v.client.read(path[:-1])
-    if results is not None:
-        rtn[path[:-1]] = results['data']
+    if read_path:
+        results =  v.client.read(path[:-1])
+        if results is not None:
+            rtn[path[:-1]] = results['data']
 
     results = v.client.read(path + "?list=true")
-    for key in results['data']['keys']:
-        key = path + key
+    keys = [path + key for key in results['data']['keys']]
+    for key in keys:
         if key[-1] == '/':
-            data = export(v, key)
+            # Don't read data stored at key twice
+            data = export(v, key, key[:-1] not in keys)
             rtn.update(data)
         else:
             data = v.client.read(key)
@@ -52,10 +73,165 @@ def export(v, path):
 
     return rtn
 
+def content_hash(data):
+    """Hash of the data stored at a Vault path, used to detect changes"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+class BackupBucket(object):
+    """Access to the other backups stored in the backup S3 bucket
+
+    Args:
+        s3_backup (string) : S3 URI of the current backup directory
+                             (s3://bucket/YYYY-ww)
+    """
+    def __init__(self, s3_backup):
+        bucket, self.directory = s3_backup[len('s3://'):].rstrip('/').split('/', 1)
+        self.bucket = boto3.resource('s3').Bucket(bucket)
+
+    def load(self, directory, filename):
+        """Load a Json file from the Vault backup in the given backup directory"""
+        key = '{}/vault/{}'.format(directory, filename)
+        return json.loads(self.bucket.Object(key).get()['Body'].read().decode())
+
+    def directories(self):
+        """List the backup directories that contain an incremental Vault backup
+
+        Returns:
+            list[string] : Sorted list of backup directory names
+        """
+        client = self.bucket.meta.client
+        paginator = client.get_paginator('list_objects_v2')
+        rtn = []
+        for page in paginator.paginate(Bucket = self.bucket.name, Delimiter = '/'):
+            for prefix in page.get('CommonPrefixes', []):
+                directory = prefix['Prefix'].rstrip('/')
+                if not BACKUP_DIRECTORY.match(directory):
+                    continue
+
+                key = directory + '/vault/index.json'
+                resp = client.list_objects_v2(Bucket = self.bucket.name, Prefix = key)
+                if resp.get('KeyCount', 0) > 0:
+                    rtn.append(directory)
+        return sorted(rtn)
+
+    def latest_index(self, before = None):
+        """Load the index of the most recent incremental Vault backup
+
+        Args:
+            before (string|None) : Only look at backup directories before this one
+
+        Returns:
+            dict|None : Index data or None if there is no incremental backup
+        """
+        directories = [d for d in self.directories() if before is None or d < before]
+        return self.load(directories[-1], 'index.json') if directories else None
+
+def backup(v, output_dir, bucket):
+    """Backup Vault, only saving the secrets that changed since the previous backup
+
+    Args:
+        v (Vault) : Vault connection
+        output_dir (string) : Local directory to write the backup files to
+        bucket (BackupBucket) : Backup bucket containing the previous backup
+    """
+    index = {
+        'policies': {},
+        'aws-auth': {},
+        'aws': {},
+    }
+
+    # Backup policies
+    for policy in v.client.list_policies():
+        index['policies'][policy] = v.client.read('/sys/policy/' + policy)['rules']
+
+    # Backup secrets
+    secrets = export(v, 'secret/')
+    index['secrets'] = {path: content_hash(data) for path, data in secrets.items()}
+
+    previous = bucket.latest_index(before = bucket.directory)
+    if previous is None or len(previous['chain']) >= FULL_BACKUP_INTERVAL:
+        print("Full backup of {} secrets".format(len(secrets)))
+        index['chain'] = [bucket.directory]
+    else:
+        index['chain'] = previous['chain'] + [bucket.directory]
+        secrets = {path: data
+                   for path, data in secrets.items()
+                   if previous['secrets'].get(path) != index['secrets'][path]}
+        print("Incremental backup of {} changed secrets".format(len(secrets)))
+
+    # Backup AWS secret backend roles
+    # DP ???: are these now automatically generated for ingest jobs?
+    #         if so, should they even be backed up?
+    prefix = '/aws/roles'
+    for role in v.client.read(prefix + '?list=true')['data']['keys']:
+        index['aws'][role] = v.client.read(prefix + '/' + role)['data']['policy']
+
+    # Backup AWS auth backend roles
+    prefix = '/auth/aws/role'
+    for role in v.client.read(prefix + '?list=true')['data']['keys']:
+        d = v.client.read(prefix + '/' + role)['data']
+
+        index['aws-auth'][role] = {
+                'auth_type': d['auth_type'],
+                'bound_iam_role_arn': d['bound_iam_role_arn'],
+                'policies': ', '.join(d['policies'])
+        }
+
+    with open(os.path.join(output_dir, 'secrets.json'), 'w') as fh:
+        json.dump(secrets, fh, indent=3, sort_keys=True)
+
+    with open(os.path.join(output_dir, 'index.json'), 'w') as fh:
+        json.dump(index, fh, indent=3, sort_keys=True)
+
+def load_backup(input_dir, bucket):
+    """Load an incremental backup by applying the chain of changes to the full backup
+
+    Args:
+        input_dir (string) : Local directory containing the backup files
+        bucket (BackupBucket) : Backup bucket containing the rest of the chain
+
+    Returns:
+        tuple : Tuple of the data to restore (in the format of the older export.json)
+                and the list of secret/ paths to delete
+    """
+    with open(os.path.join(input_dir, 'index.json'), 'r') as fh:
+        index = json.load(fh)
+
+    secrets = {}
+    for directory in index['chain'][:-1]:
+        print("Loading changes from backup {}".format(directory))
+        secrets.update(bucket.load(directory, 'secrets.json'))
+
+    with open(os.path.join(input_dir, 'secrets.json'), 'r') as fh:
+        secrets.update(json.load(fh))
+
+    # Drop paths that were deleted during the chain
+    secrets = {path: secrets[path] for path in index['secrets']}
+    for path in secrets:
+        if content_hash(secrets[path]) != index['secrets'][path]:
+            raise Exception("Data for {} doesn't match the backup index".format(path))
+
+    data = {
+        'policies': index['policies'],
+        'secrets': secrets,
+        'aws-auth': index['aws-auth'],
+        'aws': index['aws'],
+    }
+
+    # DP NOTE: The latest backup's index is used as the list of paths in Vault,
+    #          instead of walking all of Vault, so paths created after the
+    #          latest backup are not deleted
+    latest = bucket.latest_index()
+    existing = [] if latest is None else [path for path in latest['secrets']
+                                                if path not in secrets]
+
+    return data, existing
+
 if __name__ == "__main__":
-    # usage (backup|restore) domain
+    # usage (backup|restore) domain s3://bucket/directory
     a = sys.argv[1]
     d = sys.argv[2]
+    bucket = BackupBucket(sys.argv[3])
 
     with open("/etc/boss/boss.config", "w") as fh:
         fh.write("""[system]
@@ -69,45 +245,18 @@ token =
     v = Vault()
 
     if a == "backup":
-        f = os.path.join(os.environ['OUTPUT1_STAGING_DIR'], 'export.json')
-        data = {
-            'policies': {},
-            'secrets': {},
-            'aws-auth': {},
-            'aws': {},
-        }
-
-        # Backup policies
-        for policy in v.client.list_policies():
-            data['policies'][policy] = v.client.read('/sys/policy/' + policy)['rules']
-
-        # Backup secrets
-        data['secrets'] = export(v, 'secret/')
-
-        # Backup AWS secret backend roles
-        # DP ???: are these now automatically generated for ingest jobs?
-        #         if so, should they even be backed up?
-        prefix = '/aws/roles'
-        for role in v.client.read(prefix + '?list=true')['data']['keys']:
-            data['aws'][role] = v.client.read(prefix + '/' + role)['data']['policy']
-
-        # Backup AWS auth backend roles
-        prefix = '/auth/aws/role'
-        for role in v.client.read(prefix + '?list=true')['data']['keys']:
-            d = v.client.read(prefix + '/' + role)['data']
-
-            data['aws-auth'][role] = {
-                    'auth_type': d['auth_type'],
-                    'bound_iam_role_arn': d['bound_iam_role_arn'],
-                    'policies': ', '.join(d['policies'])
-            }
-
-        with open(f, 'w') as fh:
-            json.dump(data, fh, indent=3, sort_keys=True)
+        backup(v, os.environ['OUTPUT1_STAGING_DIR'], bucket)
     else:
-        f = os.path.join(os.environ['INPUT1_STAGING_DIR'], 'export.json')
-        with open(f, 'r') as fh:
-            data = json.load(fh)
+        input_dir = os.environ['INPUT1_STAGING_DIR']
+        f = os.path.join(input_dir, 'export.json')
+        if os.path.exists(f):
+            # Older, full, backup format
+            with open(f, 'r') as fh:
+                data = json.load(fh)
+            existing_secrets = [path for path in export(v, 'secret/')
+                                     if path not in data['secrets']]
+        else:
+            data, existing_secrets = load_backup(input_dir, bucket)
 
         # DP NOTE: The print statements in the restore are here to help
         #          understand the input data if a call fails to restore
@@ -130,11 +279,7 @@ token =
             v.client.delete_policy(policy)
 
         # Restore secrets
-        existing = list(export(v, 'secret/').keys())
         for path in data['secrets']:
-            if path in existing:
-                existing.remove(path)
-
             old_data = data['secrets'][path]
             if 'password' in old_data:
                 # Don't restore passwords, unless they don't exist
@@ -152,7 +297,7 @@ token =
             print("Restoring {}".format(path))
             v.write(path, **old_data)
 
-        for path in existing:
+        for path in existing_secrets:
             print("Deleting {}".format(path))
             v.delete(path)
 
@@ -182,26 +182,26 @@ if __name__ == '__main__':
     cur_dir = pathlib.Path(__file__).parent
     os.chdir(cur_dir)
 
-    if len(sys.argv) != 3:
-        print("Usage: {} <domain name> <bucket name>".format(sys.argv[0]))
+    if len(sys.argv) not in (3, 4):
+        print("Usage: {} <domain name> <bucket name> [staging name]".format(sys.argv[0]))
         sys.exit(-1)
 
     domain = sys.argv[1]
     bucket = sys.argv[2]
+    # The staging name allows multiple lambdas to be built at the same time
+    staging = sys.argv[3] if len(sys.argv) == 4 else domain
 
-    # Not all AWS Lambda containers have these libraries installed
-    # verify that they are installed before importing them
-    # (This can happen with non-python runtimes)
-    # DP NOTE: using --user in case the script is not run as root
-    #          this can sometimes result in an import error, though
-    #          running the script again (after the packages have been
-    #          installed) normally works
-    run('python3 -m pip install --user boto3 PyYaml')
+    # Not all AWS Lambda containers have these libraries installed, they are
+    # installed when the build container is started (lib/lambdas.py BuildContainers)
+    # and by the lambda-dev salt state on the lambda build server
     import boto3
     import yaml
 
-    zip_file = cur_dir / 'staging' / (domain + '.zip')
-    staging_dir = cur_dir / 'staging' / domain
+    # Wheels downloaded or built by pip are cached between builds
+    pip_cache = cur_dir / 'cache' / 'pip'
+
+    zip_file = cur_dir / 'staging' / (staging + '.zip')
+    staging_dir = cur_dir / 'staging' / staging
 
     # Remove the old build directory
     if staging_dir.exists():
@@ -213,7 +213,9 @@ if __name__ == '__main__':
 
     staging_dir.mkdir()
     unzip(zip_file, staging_dir)
-    starting_hash = script_stdout('find . -type f -print0 | sort -z | xargs -0 sha1sum | sha1sum').split()[0]
+    # NOTE: lib/zip.py ZipBuilder.manifest_hash() calculates the same hash before the
+    #       zip is built, so the sort order must not depend on the locale
+    starting_hash = script_stdout('find . -type f -print0 | LC_ALL=C sort -z | xargs -0 sha1sum | sha1sum').split()[0]
 
     lambda_config = load_config(staging_dir)
 
@@ -246,8 +248,8 @@ if __name__ == '__main__':
 
     # Install Python Packages
     if lambda_config.get('python_packages'):
-        cmd_req = 'python3 -m pip install -t {location} -r {requirements}'
-        cmd_pkgs = 'python3 -m pip install -t {location} {packages}'
+        cmd_req = 'python3 -m pip install --cache-dir {cache} -t {location} -r {requirements}'
+        cmd_pkgs = 'python3 -m pip install --cache-dir {cache} -t {location} {packages}'
 
         entries = lambda_config['python_packages']
         if type(entries) == list: # list of packages, convert to the dict format with
@@ -258,10 +260,12 @@ if __name__ == '__main__':
         packages = {}
         for entry in entries:
             if (staging_dir / entry).is_file(): # pointing to requirements file
-                run(cmd_req.format(location = staging_dir / entries[entry],
+                run(cmd_req.format(cache = pip_cache,
+                                   location = staging_dir / entries[entry],
                                    requirements = staging_dir / entry))
             elif (staging_dir / entry).is_dir(): # pointing to a local repository
-                run(cmd_pkgs.format(location = staging_dir / entries[entry],
+                run(cmd_pkgs.format(cache = pip_cache,
+                                    location = staging_dir / entries[entry],
                                     packages = staging_dir / entry))
             else:
                 location = entries[entry]
@@ -270,7 +274,8 @@ if __name__ == '__main__':
                 packages[location].append(entry)
 
         for loc, pkgs in packages.items():
-            run(cmd_pkgs.format(location = staging_dir / loc,
+            run(cmd_pkgs.format(cache = pip_cache,
+                                location = staging_dir / loc,
                                 packages = ' '.join(pkgs)))
 
     # Run Manual Commands
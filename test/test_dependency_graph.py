@@ -1,13 +1,14 @@
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import os
+import sys
 cur_dir = os.path.dirname(os.path.realpath(__file__))
 os.chdir(os.path.join(cur_dir))
 
 import alter_path
-from bin.cloudformation import build_dependency_graph
-from lib.exceptions import MissingDependencyError, CircularDependencyError, DependencyInProgressError
+from bin.cloudformation import build_dependency_graph, build_blockers, call_configs_parallel
+from lib.exceptions import BossManageError, MissingDependencyError, CircularDependencyError, DependencyInProgressError
 
 class Module(object):
     def __init__(self, deps):
@@ -200,3 +201,65 @@ class TestDependencyGraph(TestCase):
 
         with self.assertRaises(CircularDependencyError):
             build_dependency_graph(action, bosslet_config, modules)
+
+class TestBuildBlockers(TestCase):
+    modules = TestDependencyGraph.modules
+
+    def test_create(self):
+        blockers = build_blockers('create', self.modules)
+
+        self.assertEqual(blockers['a'], set())
+        self.assertEqual(blockers['d'], {'a', 'b', 'f'})
+        self.assertEqual(blockers['j'], {'i', 'k'})
+
+    def test_partial(self):
+        blockers = build_blockers('update', self.modules[::3])
+
+        self.assertEqual(blockers, {'a': set(), 'd': {'a'}, 'g': set(), 'j': set()})
+
+    def test_generate(self):
+        blockers = build_blockers('generate', self.modules)
+
+        self.assertTrue(all(len(deps) == 0 for deps in blockers.values()))
+
+class TestCallConfigsParallel(TestCase):
+    def _module(self, deps, fail=False):
+        def create(bosslet_config):
+            # print() is patched in the parent process, and so also in the
+            # forked worker, so write directly to the redirected stdout
+            sys.stdout.write('created\n')
+            if fail:
+                raise Exception('create failed')
+
+        module = Module(deps)
+        module.create = create
+        return module
+
+    def _call(self, modules, workers):
+        lines = []
+        with patch('builtins.print', side_effect=lambda *a, **k: lines.append(' '.join(map(str, a)))):
+            try:
+                call_configs_parallel(MagicMock(), modules, 'create', workers)
+            finally:
+                created = [l.split(']')[0][1:] for l in lines if l.endswith('] created')]
+        return created
+
+    def test_dependency_order(self):
+        modules = [(config, self._module(module.DEPENDENCIES))
+                   for config, module in TestDependencyGraph.modules]
+        created = self._call(modules, 3)
+
+        self.assertEqual(sorted(created), sorted(TestDependencyGraph.expected))
+        for config, module in TestDependencyGraph.modules:
+            for dep in module.DEPENDENCIES:
+                self.assertLess(created.index(dep), created.index(config))
+
+    def test_stop_on_failure(self):
+        modules = (('a', self._module([])),
+                   ('b', self._module(['a'], fail=True)),
+                   ('c', self._module(['b'])))
+
+        with self.assertRaises(BossManageError) as ctx:
+            self._call(modules, 2)
+
+        self.assertIn('Not started: c', ctx.exception.causes)